@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+"""
+Compares the memory used by each model object with __slots__ against the
+old layout, where every instance had a __dict__ and its own int_types,
+bool_types and float_types lists. Attribute values are shared by both
+layouts, so only the per-object overhead is counted.
+"""
+import sys
+from xml.etree import ElementTree
+#append system path
+sys.path.insert(0, "../")
+from pylastfm.api.user import User
+from pylastfm.api.track import Track
+from pylastfm.api.album import Album
+from pylastfm.api.artist import Artist
+from pylastfm.api.event import Event
+
+class DictObject(object):
+    pass
+
+def legacy_size(obj):
+    """The size of obj as it would have been before __slots__"""
+    legacy = DictObject()
+    for name in obj.__slots__:
+        setattr(legacy, name, getattr(obj, name))
+    size = sys.getsizeof(legacy) + sys.getsizeof(legacy.__dict__)
+    for types in (obj.int_types, obj.bool_types, obj.float_types):
+        size += sys.getsizeof(list(types))
+    return size
+
+def main():
+    print "%-8s %8s %8s %8s" % ("class", "before", "after", "saved")
+    for _class in (User, Track, Album, Artist, Event):
+        obj = _class(ElementTree.fromstring("<%s/>" % _class.ROOT_NODE))
+        before = legacy_size(obj)
+        after = sys.getsizeof(obj)
+        print "%-8s %8d %8d %7d%%" % (_class.__name__, before, after,
+                                      100 - after * 100 / before)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+Measures how many objects per second are built from the XML fixtures in
+tests/data, using the compiled schema in AbstractType._parse_etree and the
+attribute by attribute lookup it replaced.
+"""
+import sys
+import time
+from xml.etree import ElementTree
+#append system path
+sys.path.insert(0, "../")
+from pylastfm.api.user import User
+from pylastfm.api.track import Track
+
+FIXTURES = [("../tests/data/user.getInfo", User),
+            ("../tests/data/user.getRecentTracks", Track)]
+
+def legacy_set_attribute(obj, name, value):
+    if hasattr(obj, name):
+        if name in obj.int_types:
+            try:
+                value = int(value)
+            except: pass
+        if name in obj.bool_types:
+            value = False if value == "0" else True
+            value = bool(value)
+        setattr(obj, name, value)
+
+def legacy_build(_class, etree):
+    obj = _class.__new__(_class)
+    for name in _class.__slots__:
+        setattr(obj, name, None)
+    for attribute in etree.getiterator():
+        legacy_set_attribute(obj, attribute.tag, attribute.text)
+        if attribute.attrib != {}:
+            for key, val in attribute.attrib.iteritems():
+                legacy_set_attribute(obj, attribute.tag + "_" + key, val)
+    return obj
+
+def compiled_build(_class, etree):
+    return _class(etree)
+
+def rate(build, nodes, _class, seconds=1.0):
+    count = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        for node in nodes:
+            build(_class, node)
+        count += len(nodes)
+    return count / (time.time() - start)
+
+def main():
+    print "%-24s %12s %12s" % ("fixture", "legacy/s", "compiled/s")
+    for path, _class in FIXTURES:
+        nodes = ElementTree.parse(path).getroot().getiterator(_class.ROOT_NODE)
+        legacy = rate(legacy_build, nodes, _class)
+        compiled = rate(compiled_build, nodes, _class)
+        print "%-24s %12d %12d" % (path.split("/")[-1], legacy, compiled)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""
+Measures how many tracks per second are form encoded for a submission by
+encode_tracks, from ScrobbleTrack objects and from columns, against the
+naive way of building and urlencoding a dictionary for every track.
+"""
+import sys
+import time
+import urllib
+#append system path
+sys.path.insert(0, "../")
+from pylastfm.scrobbler import ScrobbleTrack, encode_tracks
+
+def make_tracks(count):
+    tracks = []
+    for i in xrange(count):
+        tracks.append(ScrobbleTrack(u"Sigur R\xf3s", u"Track %d" % (i % 12),
+                                    1234567890 + i * 240, 240,
+                                    album=u"Me\xf0 su\xf0 \xed eyrum", track_number=i % 12))
+    return tracks
+
+def naive_encode(tracks):
+    data = []
+    for i, track in enumerate(tracks):
+        params = {}
+        for key, value in track.to_dict().iteritems():
+            if isinstance(value, unicode):
+                value = value.encode("UTF-8")
+            params["%s[%d]" % (key, i)] = value
+        data.append(urllib.urlencode(params))
+    return "&".join(data)
+
+def to_columns(tracks):
+    return dict((field, [getattr(track, field) for track in tracks])
+                for field in ScrobbleTrack.FIELDS)
+
+def rate(encode, tracks, size, seconds=1.0):
+    count = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        encode(tracks)
+        count += size
+    return count / (time.time() - start)
+
+def main():
+    print "%-8s %12s %12s %12s" % ("batch", "naive/s", "tracks/s", "columns/s")
+    for size in (1, 50, 1000):
+        tracks = make_tracks(size)
+        columns = to_columns(tracks)
+        print "%-8d %12d %12d %12d" % (size, rate(naive_encode, tracks, size),
+                                       rate(encode_tracks, tracks, size),
+                                       rate(encode_tracks, columns, size))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""
+Measures how many api signatures per second are created by RequestSigner,
+for new parameter sets and for repeated ones, against the old string
+concatenation in _create_api_signature.
+"""
+import sys
+import time
+import hashlib
+#append system path
+sys.path.insert(0, "../")
+from pylastfm.api.signing import RequestSigner
+
+API_KEY = "b25b959554ed76058ac220b7b2e0a026"
+SECRET = "425b55975eed76058ac220b7b2e0a026"
+SESSION_KEY = "d580d57f32848f5dcf574d1ce18d78b2"
+
+def legacy_sign(kwargs):
+    kwargs['api_key'] = API_KEY
+    kwargs["sk"] = SESSION_KEY
+    data = ""
+    for method, value in sorted(kwargs.iteritems()):
+        data += "%s%s" % (method, value)
+    data += SECRET
+    return hashlib.md5(data.encode('UTF-8')).hexdigest()
+
+def make_params(count):
+    return [{"method" : "track.love", "artist" : "Artist %d" % i,
+             "track" : "Track %d" % i} for i in xrange(count)]
+
+def rate(sign, params, seconds=1.0):
+    count = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        for p in params:
+            sign(dict(p, api_key=API_KEY, sk=SESSION_KEY))
+        count += len(params)
+    return count / (time.time() - start)
+
+def main():
+    print "%-10s %12s %12s" % ("params", "legacy/s", "signer/s")
+    unique = make_params(100000)
+    repeated = make_params(100)
+    for name, params, max_entries in (("unique", unique, 1024),
+                                      ("repeated", repeated, 1024)):
+        signer = RequestSigner(API_KEY, SECRET, max_entries)
+        print "%-10s %12d %12d" % (name, rate(legacy_sign, params),
+                                   rate(signer.sign, params))
+
+if __name__ == "__main__":
+    main()
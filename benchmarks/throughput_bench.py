@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Measures the throughput and latency of LastfmApiConnection against the
+local stub server, with no network, and of replaying the same requests
+from recorded responses, with and without a MetricsAggregator. Pass the
+stub's latency in seconds as the first argument, the default is 0.02.
+"""
+import sys
+import shutil
+import tempfile
+import time
+#append system path
+sys.path.insert(0, "../")
+from pylastfm.api.connection import LastfmApiConnection
+from pylastfm.api.metrics import MetricsAggregator
+from pylastfm.api.replay import ReplayTransport
+from pylastfm.api.stubserver import StubLastfmServer
+from pylastfm.api.transport import HTTPConnectionPool
+
+REQUESTS = 200
+
+def get_info(api, i):
+    start = time.time()
+    api._api_get_request(method="artist.getInfo", artist="Artist %d" % i).read()
+    return time.time() - start
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def run(api, workers, label=""):
+    start = time.time()
+    calls = [(get_info, (api, i)) for i in range(REQUESTS)]
+    latencies = [result.value for result in api.batch(calls, workers=workers)]
+    elapsed = time.time() - start
+    print "%-28s %8d %10.1f %8.1f %8.1f" % (
+        "%s x%d%s" % (api.transport.__class__.__name__, workers, label), REQUESTS,
+        REQUESTS / elapsed, percentile(latencies, 0.5) * 1000,
+        percentile(latencies, 0.99) * 1000)
+
+def main():
+    latency = 0.02
+    if len(sys.argv) > 1:
+        latency = float(sys.argv[1])
+    stub = StubLastfmServer(latency=latency)
+    stub.start()
+    path = tempfile.mkdtemp()
+    try:
+        print "%-28s %8s %10s %8s %8s" % ("transport", "requests", "req/s",
+                                          "p50 ms", "p99 ms")
+        for workers in (1, 10, 50):
+            api = LastfmApiConnection("xxx", "yyy", rate_limit=None,
+                                      transport=HTTPConnectionPool(pool_size=workers))
+            api.URL = stub.url
+            run(api, workers)
+            api.transport.close()
+        recorder = ReplayTransport(path, "record", HTTPConnectionPool())
+        api = LastfmApiConnection("xxx", "yyy", rate_limit=None, transport=recorder)
+        api.URL = stub.url
+        for i in range(REQUESTS):
+            get_info(api, i)
+        recorder.close()
+        api = LastfmApiConnection("xxx", "yyy", rate_limit=None,
+                                  transport=ReplayTransport(path))
+        run(api, 1)
+        api.add_observer(MetricsAggregator())
+        run(api, 1, " +metrics")
+    finally:
+        stub.stop()
+        shutil.rmtree(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Compares holding a listening history as Track objects from create_objects
+with a TrackTable filled from the same XML, and times saving and loading
+the table. Pass the number of tracks as the first argument, the default
+is 200000.
+"""
+import gc
+import os
+import sys
+import tempfile
+import time
+from StringIO import StringIO
+#append system path
+sys.path.insert(0, "../")
+from pylastfm.api.connection import LastfmApiConnection
+from pylastfm.api.track import Track
+from pylastfm.api.tracktable import TrackTable
+
+def make_history(count):
+    tracks = "".join('<track><artist mbid="">Artist %d</artist><name>Track %d</name>'
+                     '<streamable>0</streamable><album mbid="">Album %d</album>'
+                     '<date uts="%d">x</date></track>' % (i % 2000, i % 20000,
+                                                          i % 5000, 1200000000 + i)
+                     for i in range(count))
+    return '<lfm status="ok"><recenttracks>%s</recenttracks></lfm>' % tracks
+
+def rss():
+    """@return: The memory used by this process in MB, only on linux"""
+    pages = int(open("/proc/self/statm").read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / 1048576.0
+
+def main():
+    count = 200000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    body = make_history(count)
+    api = LastfmApiConnection("xxx", "yyy")
+    gc.collect()
+    before = rss()
+    start = time.time()
+    table = TrackTable()
+    table.feed(StringIO(body))
+    print "TrackTable.feed      %8.2fs %8.1f MB" % (time.time() - start,
+                                                        rss() - before)
+    start = time.time()
+    top = table.top(10)
+    print "top 10 artists       %8.3fs" % (time.time() - start)
+    start = time.time()
+    rows = table.select(artist="Artist 7", since=1200000000 + count / 2)
+    print "select               %8.3fs %8d rows" % (time.time() - start, len(rows))
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        start = time.time()
+        table.save(path)
+        print "save                 %8.3fs %8.1f MB" % (time.time() - start,
+                                                       os.path.getsize(path) / 1048576.0)
+        start = time.time()
+        loaded = TrackTable.load(path)
+        print "load                 %8.4fs" % (time.time() - start)
+        start = time.time()
+        assert loaded.top(10) == top
+        print "load and top 10      %8.3fs" % (time.time() - start)
+        loaded.close()
+    finally:
+        os.remove(path)
+    del table, loaded
+    gc.collect()
+    before = rss()
+    start = time.time()
+    tracks = api.create_objects(StringIO(body), Track)
+    print "create_objects       %8.2fs %8.1f MB" % (time.time() - start,
+                                                        rss() - before)
+
+if __name__ == "__main__":
+    main()
@@ -4,30 +4,89 @@ from xml.etree import ElementTree as ET
 from error import LastfmAuthenticationError, LastfmError, LastfmParamError
 
 class AbstractType(object):
-    """Abstract class for all Last.fm API methods"""
-    def __init__(self, int_types=[], bool_types=[], float_types=[]):
+    """
+    Abstract class for all Last.fm API methods. Subclasses list their
+    attributes in __slots__, so instances don't carry a __dict__, and
+    declare which of them are converted from strings at class level.
+    """
+    __slots__ = ()
+    int_types = ()
+    """Attributes that should be integers"""
+    bool_types = ()
+    """Attributes that should be boolean"""
+    float_types = ()
+    """Attributes that should be floats"""
+    
+    def __getstate__(self):
         """
-        @param int_types: A list of attributes that should be integers
-        @param bool_types: A list of attributes that should be boolean
-        @param float_types: A list of attributes that should be floats
+        Slotted objects have no __dict__ for pickle to save, so their state
+        is a dictionary of the slots that are set
         """
-        self.int_types = int_types
-        self.bool_types = bool_types
-        self.float_types = float_types
-    
+        state = {}
+        for klass in self.__class__.__mro__:
+            for name in getattr(klass, "__slots__", ()):
+                if hasattr(self, name):
+                    state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.iteritems():
+            setattr(self, name, value)
+
+    containers = ()
+    """Elements whose children are read as if they were the node's own, eg.
+    an artist's stats"""
     
     def _parse_etree(self, etree):
         """
-        Looks at attributes for the subclass and adds any it finds in the etree
+        Looks at attributes for the subclass and adds any it finds among the
+        children of the etree. Elements set the attribute named after their
+        tag, XML attributes set the attribute named <tag>_<key>. Only direct
+        children are read, so the tags and similar items nested in a response
+        don't overwrite its own fields.
         @param etree: An ElementTree for the subclass
         """
-        iter = etree.getiterator()
-        for attribute in iter:
-            self._set_attribute(attribute.tag, attribute.text)
-            if attribute.attrib != {}:
-                for key, val in attribute.attrib.iteritems():
-                    self._set_attribute(attribute.tag + "_" + key, val)
+        text_fields, attribute_fields = _compile_schema(self.__class__)
+        self._parse_node(etree, None, attribute_fields)
+        containers = self.containers
+        for node in etree:
+            if node.tag in containers:
+                for child in node:
+                    self._parse_node(child, text_fields, attribute_fields)
+            else:
+                self._parse_node(node, text_fields, attribute_fields)
 
+    def _parse_node(self, node, text_fields, attribute_fields):
+        """
+        Sets the attributes from a single element. Items referred to by
+        another, like a track's artist, nest their name, mbid and url: the
+        name is the element's value and the others are read like its XML
+        attributes.
+        @param text_fields: The text fields, or None to only read XML attributes
+        """
+        tag = node.tag
+        if text_fields is not None and tag in text_fields:
+            convert = text_fields[tag]
+            if len(node):
+                value = node.findtext("name")
+            else:
+                value = node.text
+            if convert is not None:
+                value = convert(value)
+            setattr(self, tag, value)
+        fields = attribute_fields.get(tag)
+        if fields is None:
+            return
+        values = node.attrib.items()
+        if len(node) and text_fields is not None:
+            values.extend((child.tag, child.text) for child in node)
+        for key, value in values:
+            field = fields.get(key)
+            if field is not None:
+                name, convert = field
+                if convert is not None:
+                    value = convert(value)
+                setattr(self, name, value)
 
     def _set_attribute(self, name, value):
         """
@@ -35,16 +94,79 @@ class AbstractType(object):
         @param name: The name of the attribute eg. realname
         @param value: The value of the attribute eg. Daniel Woodhouse
         """
-        if hasattr(self, name):
-            if name in self.int_types:
-                try:
-                    value = int(value)
-                except: pass
-            if name in self.bool_types:
-                value = False if value == "0" else True
-                value = bool(value)           
+        text_fields = _compile_schema(self.__class__)[0]
+        if name in text_fields:
+            convert = text_fields[name]
+            if convert is not None:
+                value = convert(value)
             setattr(self, name, value)
-    
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+def _to_bool(value):
+    return value != "0"
+
+def _find_nodes(node, tag):
+    """
+    Yields the outermost nodes with the tag below and including node, nodes
+    nested in one are part of it, eg. the similar artists of artist.getInfo
+    @param node: An Element
+    @param tag: The ROOT_NODE of a class
+    @return: A generator of Elements in document order
+    """
+    if node.tag == tag:
+        yield node
+        return
+    for child in node:
+        for found in _find_nodes(child, tag):
+            yield found
+
+_SCHEMAS = {}
+
+def _compile_schema(_class):
+    """
+    Builds the lookup tables used by L{AbstractType._parse_etree} from the
+    __slots__ and type lists of a class. This is done once per class.
+    @param _class: A subclass of L{AbstractType}
+    @return: A tuple of (text_fields, attribute_fields). text_fields maps an
+    element tag to the converter for its text, or None if it is kept as a
+    string. attribute_fields maps an element tag to a dictionary of XML
+    attribute names to (attribute name, converter) tuples.
+    """
+    schema = _SCHEMAS.get(_class)
+    if schema is not None:
+        return schema
+    text_fields = {}
+    for klass in _class.__mro__:
+        for name in getattr(klass, "__slots__", ()):
+            text_fields[name] = None
+    for types, convert in ((_class.int_types, _to_int),
+                           (_class.float_types, _to_float),
+                           (_class.bool_types, _to_bool)):
+        for name in types:
+            if name in text_fields:
+                text_fields[name] = convert
+    attribute_fields = {}
+    for name, convert in text_fields.iteritems():
+        index = name.find("_")
+        while index > 0:
+            fields = attribute_fields.setdefault(name[:index], {})
+            fields[name[index + 1:]] = (name, convert)
+            index = name.find("_", index + 1)
+    schema = _SCHEMAS[_class] = (text_fields, attribute_fields)
+    return schema
+
 
 class AbstractMethod(object):
     
@@ -54,20 +176,23 @@ class AbstractMethod(object):
                 raise LastfmError("Username not set")
             return self.conn.username
         else:
-            if isinstance(user, AbstractMethod):
+            if isinstance(user, AbstractType):
                 return user.name
+            return user
     
+    MAX_ITEMS = 10
+    """The most tags, recipients etc. last.fm accepts in one call"""
+
     def _create_comma_delimited_string(self, items, wanted_attrib="name"):
         """Return a strings fromthat can be used as tags"""
         # could be either : a string, a list of strings, a AbstractType object, a list
         #of AbstractType objects
-        if not isinstance(items, list):
-            tags = [items]
+        if not isinstance(items, (list, tuple)):
+            items = [items]
         #last.fm only allows 10 items per api call
-        if len(items) > 10:
+        if len(items) > AbstractMethod.MAX_ITEMS:
             raise LastfmParamError("Maximum of 10 items allowed")
-        if isinstance(tags[0], AbstractType):
-            items = [self._get_attribute(item, wanted_attrib) for item in items]
+        items = [self._get_attribute(item, wanted_attrib) for item in items]
         return ",".join(items)
         
     def _get_attribute(self, obj, attribute="name"):
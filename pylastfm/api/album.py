@@ -1,9 +1,18 @@
 
 from _basetype import AbstractType, AbstractMethod
+from error import LastfmParamError
+from pager import PageIterator
+from tag import Tag
 
 class Album(AbstractType):
+    ROOT_NODE = "album"
+    __slots__ = ("album_rank", "id", "name", "playcount", "release_date",
+                 "listeners", "mbid", "top_tags", "url", "artist", "artist_url",
+                 "image_small", "image_medium", "image_large", "image_xlarge",
+                 "wiki")
+    int_types = ("listeners", "playcount", "album_rank")
+
     def __init__(self, etree):
-        AbstractType.__init__(self, int_types=["listeners", "playcount"])
         self.album_rank = None
         """How this album ranks against others"""
         self.id = None
@@ -40,10 +49,11 @@ class AlbumMethod(AbstractMethod):
         @param tags: A list of user supplied tags to apply to this
         album. Accepts a maximum of 10 tags. These can be strings or L{Tag} objects
         """
+        artist = self._get_attribute(artist)
+        album = self._get_attribute(album)
         tags = self._create_comma_delimited_string(tags)
-        data = self.conn._create_api_signature(artist=artist, album=album,
-                                          tags=tags, method="album.addTags")
-        return self.conn._api_post_request(data)
+        return self.conn._api_post_request(artist=artist, album=album, tags=tags,
+                                           method="album.addTags")
     
     
     def getInfo(self, artist=None, album=None, mbid=None, username=None,
@@ -68,19 +78,23 @@ class AlbumMethod(AbstractMethod):
         xml = self.conn._api_get_request(artist=artist, album=album, mbid=mbid,
                                      username=username, lang=lang,
                                      method="album.getInfo")
-        return self.conn.create_objects(xml, "Album")
+        return self.conn.create_objects(xml, Album)
     
     
-    def getTags(self, artist, album):
+    def getTags(self, artist, album, user=None):
         """
         Get the tags applied by users to an album on Last.fm.
         @param artist: (Required) The artist name or an L{Artist} object
         @param album: (Required) The album name or an L{Album} object
+        @param user: (Optional) The user whose tags are wanted, as a string or
+        L{User} object. Without it authentication is required
         @return a list of L{Tag} objects or None
         """
         artist = self._get_attribute(artist)
         album = self._get_attribute(album)
-        xml = self.conn._api_get_request(artist=artist, album=album,
+        if user is not None:
+            user = self._getUsername(user)
+        xml = self.conn._api_get_request(artist=artist, album=album, user=user,
                                     method="album.getTags")
         return self.conn.create_objects(xml, Tag)
         
@@ -96,9 +110,8 @@ class AlbumMethod(AbstractMethod):
         artist = self._get_attribute(artist)
         album = self._get_attribute(album)
         tag = self._get_attribute(tag)
-        data = self.conn._create_api_signature(artist=artist, album=album, tag=tag,
-                                      method="album.removeTag")
-        return self.conn._api_post_request(data)
+        return self.conn._api_post_request(artist=artist, album=album, tag=tag,
+                                           method="album.removeTag")
         
     def search(self, album, limit=30, page=1):
         """
@@ -114,3 +127,14 @@ class AlbumMethod(AbstractMethod):
         xml = self.conn._api_get_request(album=album, limit=limit, page=page,
                                     method="album.search")
         return self.conn.create_objects(xml, Album)
+
+    def iterSearch(self, album, limit=30):
+        """
+        Iterate over every album matching this name, fetching pages as needed.
+        @param album: (Required) The album name or an L{Album} object
+        @param limit: (Optional) The number of albums fetched per page.
+        @return: A L{PageIterator} of L{Album} objects
+        """
+        album = self._get_attribute(album)
+        return PageIterator(self.conn, Album, album=album, limit=limit,
+                            method="album.search")
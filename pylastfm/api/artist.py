@@ -1,12 +1,47 @@
 #!/usr/bin/env python
 from _basetype import AbstractType, AbstractMethod
 from error import LastfmParamError
+from shout import Shout
+from image import Image
+from tag import Tag
+from pager import PageIterator
 
 class Artist(AbstractType):
+    ROOT_NODE = "artist"
+    __slots__ = ("name", "mbid", "url", "streamable", "image", "listeners",
+                 "playcount", "match", "artist_rank", "summary", "content",
+                 "published")
+    int_types = ("listeners", "playcount", "artist_rank")
+    bool_types = ("streamable",)
+    float_types = ("match",)
+    containers = ("stats", "bio")
+
     def __init__(self, etree):
-        AbstractType.__init__(self, int_types=[])
-        #init properties
-        
+        """
+        @param etree: An ElementTree that is the data of a
+        single artist on last.fm
+        """
+        self.name = None
+        self.mbid = None
+        """The musicbrainz id of this artist"""
+        self.url = None
+        self.streamable = None
+        self.image = None
+        self.listeners = None
+        self.playcount = None
+        """How many times this artist has been played (this can refer to a
+        single user or many)"""
+        self.match = None
+        """How similar this artist is to another, from 0 to 1"""
+        self.artist_rank = None
+        """How this artist ranks against others in a chart"""
+        self.summary = None
+        """A short biography"""
+        self.content = None
+        """The full biography"""
+        self.published = None
+        """When the biography was last changed"""
+
         self._parse_etree(etree)
 
 class ArtistMethod(AbstractMethod):
@@ -26,9 +61,8 @@ class ArtistMethod(AbstractMethod):
         album. Accepts a maximum of 10 tags. These can be strings or L{Tag} objects
         """
         tags = self._create_comma_delimited_string(tags)
-        data = self.conn._create_api_signature(artist=self.name, tags=tags,
-                                               method="artist.addTags")
-        return self.conn._api_post_request(data)
+        return self.conn._api_post_request(artist=self.name, tags=tags,
+                                           method="artist.addTags")
     
     def getEvents(self):
         """
@@ -47,11 +81,22 @@ class ArtistMethod(AbstractMethod):
         (default) or 'dateadded'. While ordering by popularity officially
         selected images by labels and artists will be ordered first.
         @return: A list of L{Image} objects."""
-        if order != "popularity" or order != "dateadded":
+        if order not in ("popularity", "dateadded"):
             raise LastfmParamError("Invalid order parameter")
         xml = self.conn._api_get_request(artist=self.name, page=page, limit=limit,
                                          order=order, method="artist.getImages")
         return self.conn.create_objects(xml, Image)
+
+    def iterImages(self, limit=50, order="popularity"):
+        """
+        Iterate over every image of this artist, fetching pages as needed.
+        @param limit: (Optional) The number of images fetched per page.
+        @param order: (Optional) Either 'popularity' (default) or 'dateadded'.
+        @return: A L{PageIterator} of L{Image} objects."""
+        if order not in ("popularity", "dateadded"):
+            raise LastfmParamError("Invalid order parameter")
+        return PageIterator(self.conn, Image, artist=self.name, limit=limit,
+                            order=order, method="artist.getImages")
         
         
     def getInfo(self, mbid=None, username=None, lang=None):
@@ -101,6 +146,15 @@ class ArtistMethod(AbstractMethod):
         xml = self.conn._api_get_request(artist=self.name, limit=limit,
                                          page=page, method="artist.getShouts")
         return self.conn.create_objects(xml, Shout)
+
+    def iterShouts(self, limit=None):
+        """
+        Iterate over every shout for this artist, fetching pages as needed.
+        @param limit: (Optional) The number of shouts fetched per page.
+        @return: A L{PageIterator} of L{Shout} objects.
+        """
+        return PageIterator(self.conn, Shout, artist=self.name, limit=limit,
+                            method="artist.getShouts")
     
     def getSimilar(self, limit=None):
         """
@@ -112,13 +166,17 @@ class ArtistMethod(AbstractMethod):
                                          method="artist.getSimilar")
         return self.conn.create_objects(xml, Artist)
         
-    def getTags(self):
+    def getTags(self, user=None):
         """
         Get the tags applied by an individual user to an artist on Last.fm.
-        This service requires authentication.
+        @param user: (Optional) The user whose tags are wanted, as a string or
+        L{User} object. Without it authentication is required
         @return: A list of L{Tag} objects.
         """
-        xml = self.conn._api_get_request(artist=self.name, method="artist.getTags")
+        if user is not None:
+            user = self._getUsername(user)
+        xml = self.conn._api_get_request(artist=self.name, user=user,
+                                         method="artist.getTags")
         return self.conn.create_objects(xml, Tag)
     
     def getTopAlbums(self):
@@ -160,9 +218,8 @@ class ArtistMethod(AbstractMethod):
         This service requires authentication.
         """
         tag = self._get_attribute(tag)
-        data = self.conn._create_api_signature(artist=self.name, tag=tag,
-                                            method="artist.removeTag")
-        return self.conn._api_post_request(data)
+        return self.conn._api_post_request(artist=self.name, tag=tag,
+                                           method="artist.removeTag")
     
     def search(self, limit=None, page=None):
         """
@@ -176,6 +233,15 @@ class ArtistMethod(AbstractMethod):
         xml = self.conn._api_get_request(artist=self.name, limit=limit,
                                          page=page, method="artist.search")
         return self.conn.create_objects(xml, Artist)
+
+    def iterSearch(self, limit=None):
+        """
+        Iterate over every artist matching this name, fetching pages as needed.
+        @param limit: (Optional) The number of artists fetched per page.
+        @return: A L{PageIterator} of L{Artist} objects
+        """
+        return PageIterator(self.conn, Artist, artist=self.name, limit=limit,
+                            method="artist.search")
         
     
     def share(self, recipient, message=None):
@@ -188,14 +254,12 @@ class ArtistMethod(AbstractMethod):
         This method requires authentication.
         """
         recipient = self._create_comma_delimited_string(recipient)
-        data = self.conn._create_api_signature(artist=self.name, recipient=recipient,
-                                    message=message, method="artist.share")
-        return self.conn._api_post_request(data)
+        return self.conn._api_post_request(artist=self.name, recipient=recipient,
+                                           message=message, method="artist.share")
     
     def shout(self, message):
         """
         @param message: The message to post to the artists shoutbox.
         """
-        data = self.conn._create_api_signature(artist=self.name, message=message,
-                                            method="artist.shout")
-        return self.conn._api_post_request(data)
\ No newline at end of file
+        return self.conn._api_post_request(artist=self.name, message=message,
+                                           method="artist.shout")
\ No newline at end of file
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+from connection import LastfmApiConnection
+from pool import WorkerPool
+
+class AsyncMethodGroup(object):
+    """
+    Wraps a method group such as L{UserMethod} so that every api call is
+    run on a L{WorkerPool} and returns a L{Future} instead of blocking.
+    """
+
+    def __init__(self, group, pool):
+        """
+        @param group: The method group to wrap eg. L{UserMethod}
+        @param pool: The L{WorkerPool} to run calls on
+        """
+        self._group = group
+        self._pool = pool
+
+    def __getattr__(self, name):
+        attribute = getattr(self._group, name)
+        if not callable(attribute):
+            return attribute
+        def submit(*args, **kwargs):
+            return self._pool.submit(attribute, *args, **kwargs)
+        submit.__name__ = name
+        submit.__doc__ = attribute.__doc__
+        return submit
+
+
+class AsyncLastfmApiConnection(LastfmApiConnection):
+    """
+    A L{LastfmApiConnection} whose method groups return L{Future} objects.
+    Signing, caching and object creation are shared with the blocking
+    connection, so results are identical. At most max_concurrency requests
+    are in flight at once, any further calls are queued.
+
+    Results can be collected with L{Future.result} or delivered to an event
+    loop with L{Future.add_done_callback}.
+    """
+
+    def __init__(self, api_key, secret, max_concurrency=50, **kwargs):
+        """
+        @param api_key: The api key provided by last.fm for your application
+        @param secret: The secret key provided by last.fm
+        @param max_concurrency: The maximum number of requests in flight at once
+        @param kwargs: Any other L{LastfmApiConnection} parameters
+        """
+        LastfmApiConnection.__init__(self, api_key, secret, **kwargs)
+        self.pool = WorkerPool(max_concurrency)
+        if hasattr(self.transport, "pool_size"):
+            self.transport.pool_size = max(self.transport.pool_size, max_concurrency)
+        self.user = AsyncMethodGroup(self.user, self.pool)
+        self.auth = AsyncMethodGroup(self.auth, self.pool)
+        self.event = AsyncMethodGroup(self.event, self.pool)
+        self.album = AsyncMethodGroup(self.album, self.pool)
+        self.track = AsyncMethodGroup(self.track, self.pool)
+
+    def artist(self, name):
+        """
+        @param name: The name of the artist
+        @return: An L{ArtistMethod} for this artist whose calls return futures
+        """
+        from artist import ArtistMethod
+        return AsyncMethodGroup(ArtistMethod(self, name), self.pool)
+
+    def close(self):
+        """Stops the worker threads and closes idle connections"""
+        self.pool.shutdown()
+        self.transport.close()
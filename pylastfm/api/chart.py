@@ -3,4 +3,18 @@
 from _basetype import AbstractType
 
 class Chart(AbstractType):
-    pass
\ No newline at end of file
+    ROOT_NODE = "chart"
+    __slots__ = ("chart_from", "chart_to")
+    int_types = ("chart_from", "chart_to")
+
+    def __init__(self, etree):
+        """
+        @param etree: An ElementTree that is the data of a
+        single chart on last.fm
+        """
+        self.chart_from = None
+        """When this chart starts as a unix timestamp"""
+        self.chart_to = None
+        """When this chart ends as a unix timestamp"""
+
+        self._parse_etree(etree)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+import sqlite3
+import time
+from cStringIO import StringIO
+from _basetype import AbstractType
+from album import Album
+from artist import Artist
+from chart import Chart
+from connection import _get_error_code, _is_ok_response
+from error import LastfmError
+from pool import map_calls
+from track import Track
+
+class ChartHistory(object):
+    """
+    Keeps users' weekly artist, album and track charts in a sqlite database,
+    as a time series of playcounts. Past weeks never change, so a download
+    only fetches the weeks that aren't stored yet, and each week is stored
+    in its own transaction, so an interrupted download resumes where it
+    stopped.
+
+    Artists, albums and tracks are stored once and referred to by id, so a
+    week's chart costs a few integers per entry. Artists are stored with
+    an empty artist column, sqlite counts NULLs as distinct in a unique
+    key.
+    """
+    KINDS = {"artist" : ("user.getWeeklyArtistChart", Artist),
+             "album" : ("user.getWeeklyAlbumChart", Album),
+             "track" : ("user.getWeeklyTrackChart", Track)}
+
+    def __init__(self, conn, path, workers=8):
+        """
+        @param conn: A L{LastfmApiConnection}
+        @param path: The path of the sqlite database holding the charts
+        @param workers: The number of charts downloaded at once
+        """
+        self.conn = conn
+        self.workers = workers
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS users ("
+                        "id INTEGER PRIMARY KEY, name TEXT UNIQUE)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS items ("
+                        "id INTEGER PRIMARY KEY, kind TEXT, artist TEXT, name TEXT, "
+                        "UNIQUE (kind, artist, name))")
+        self.db.execute("CREATE TABLE IF NOT EXISTS weeks ("
+                        "user INTEGER, kind TEXT, week INTEGER, week_to INTEGER, "
+                        "PRIMARY KEY (user, kind, week))")
+        self.db.execute("CREATE TABLE IF NOT EXISTS plays ("
+                        "user INTEGER, item INTEGER, week INTEGER, playcount INTEGER, "
+                        "PRIMARY KEY (user, item, week))")
+        self.db.commit()
+        self._items = {}
+
+    def _get_user_id(self, user):
+        self.db.execute("INSERT OR IGNORE INTO users (name) VALUES (?)", (user,))
+        return self.db.execute("SELECT id FROM users WHERE name = ?",
+                               (user,)).fetchone()[0]
+
+    def _get_item_id(self, kind, artist, name):
+        key = (kind, artist, name)
+        item_id = self._items.get(key)
+        if item_id is None:
+            self.db.execute("INSERT OR IGNORE INTO items (kind, artist, name) "
+                            "VALUES (?, ?, ?)", key)
+            item_id = self._items[key] = self.db.execute(
+                "SELECT id FROM items WHERE kind = ? AND artist = ? AND name = ?",
+                key).fetchone()[0]
+        return item_id
+
+    def get_weeks(self, user, kind="artist"):
+        """
+        @param user: A last.fm username
+        @param kind: artist, album or track
+        @return: The start timestamps of the stored weeks, oldest first
+        """
+        return [row[0] for row in self.db.execute(
+            "SELECT week FROM weeks JOIN users ON users.id = weeks.user "
+            "WHERE users.name = ? AND kind = ? ORDER BY week", (user, kind))]
+
+    def download(self, user, kinds=("artist", "album", "track")):
+        """
+        Downloads every weekly chart of the user that isn't stored yet.
+        Charts that fail are left for the next download.
+        @param user: A last.fm username
+        @param kinds: The charts to download, any of artist, album and track
+        @raise LastfmError: if the list of charts couldn't be downloaded
+        @return: A dictionary of the number of weeks stored and skipped, and
+        a list of (kind, week, exception) for the charts that failed
+        """
+        ranges = self._get_ranges(user)
+        #the current week is still changing and is left out of the list
+        now = int(time.time())
+        with self.db:
+            user_id = self._get_user_id(user)
+        stored = set(self.db.execute("SELECT kind, week FROM weeks WHERE user = ?",
+                                     (user_id,)))
+        calls = []
+        skipped = 0
+        for kind in kinds:
+            for week, week_to in ranges:
+                if (kind, week) in stored or week_to > now:
+                    skipped += 1
+                    continue
+                calls.append((self._fetch, (user, kind, week, week_to)))
+        report = {"stored" : 0, "skipped" : skipped, "failed" : []}
+        for result in map_calls(calls, self.workers, ordered=False):
+            kind, week, week_to = result.call[1][1:]
+            if result.ok:
+                self._store(user_id, kind, week, week_to, result.value)
+                report["stored"] += 1
+            else:
+                report["failed"].append((kind, week, result.error))
+        return report
+
+    def _get_ranges(self, user):
+        """
+        @return: A list of the (from, to) timestamps of the user's charts
+        """
+        body = self.conn._api_get_request(user=user,
+                                          method="user.getWeeklyChartList").read()
+        if not _is_ok_response(body):
+            raise LastfmError("Could not get the chart list, error %s" %
+                              _get_error_code(body))
+        charts = self._create_objects(body, Chart)
+        return [(chart.chart_from, chart.chart_to) for chart in charts]
+
+    def _fetch(self, user, kind, week, week_to):
+        """
+        Runs on a worker thread
+        @return: A list of (artist, name, playcount) tuples
+        """
+        method, _class = ChartHistory.KINDS[kind]
+        body = self.conn._api_get_request(user=user, to=week_to, method=method,
+                                          **{"from" : week}).read()
+        if not _is_ok_response(body):
+            raise LastfmError("Could not get the %s chart for %d, error %s" %
+                              (kind, week, _get_error_code(body)))
+        entries = []
+        for obj in self._create_objects(body, _class):
+            if kind == "artist":
+                entries.append(("", obj.name, obj.playcount))
+            else:
+                entries.append((obj.artist, obj.name, obj.playcount))
+        return entries
+
+    def _create_objects(self, body, _class):
+        objects = self.conn.create_objects(StringIO(body), _class)
+        if isinstance(objects, AbstractType):
+            return [objects]
+        return objects
+
+    def _store(self, user_id, kind, week, week_to, entries):
+        """
+        Stores a week's chart, marking the week as done in the same transaction
+        """
+        with self.db:
+            rows = [(user_id, self._get_item_id(kind, artist, name), week, playcount)
+                    for artist, name, playcount in entries]
+            self.db.executemany("INSERT OR REPLACE INTO plays VALUES (?, ?, ?, ?)", rows)
+            self.db.execute("INSERT OR REPLACE INTO weeks VALUES (?, ?, ?, ?)",
+                            (user_id, kind, week, week_to))
+
+    def get_series(self, user, kind, name, artist=None):
+        """
+        @param user: A last.fm username
+        @param kind: artist, album or track
+        @param name: The name of the artist, album or track
+        @param artist: The artist of the album or track
+        @return: A list of (week, playcount) tuples, oldest first, weeks when
+        it wasn't played are left out
+        """
+        return self.db.execute(
+            "SELECT week, playcount FROM plays JOIN users ON users.id = plays.user "
+            "JOIN items ON items.id = plays.item WHERE users.name = ? AND "
+            "items.kind = ? AND items.artist = ? AND items.name = ? ORDER BY week",
+            (user, kind, artist or "", name)).fetchall()
+
+    def get_totals(self, user, kind, since=None, until=None, limit=None):
+        """
+        @param user: A last.fm username
+        @param kind: artist, album or track
+        @param since: (Optional) Only count weeks starting at or after this timestamp
+        @param until: (Optional) Only count weeks starting before this timestamp
+        @param limit: (Optional) The number of results to return
+        @return: A list of (artist, name, playcount) tuples, most played first.
+        artist is None for artist charts
+        """
+        query = ("SELECT NULLIF(items.artist, ''), items.name, SUM(playcount) AS total "
+                 "FROM plays JOIN users ON users.id = plays.user "
+                 "JOIN items ON items.id = plays.item "
+                 "WHERE users.name = ? AND items.kind = ? AND week >= ? AND week < ? "
+                 "GROUP BY plays.item ORDER BY total DESC, items.name")
+        params = [user, kind, since or 0, until or 2 ** 62]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        return self.db.execute(query, params).fetchall()
+
+    def close(self):
+        self.db.close()
@@ -3,19 +3,33 @@ import hashlib
 import webbrowser
 import re
 import urllib
-import urllib2
 import time
+import threading
+from collections import OrderedDict
+from cStringIO import StringIO
 from xml.etree import ElementTree
-from _basetype import AbstractType
+from _basetype import AbstractType, _find_nodes
+from diskcache import DiskCache
+from transport import HTTPConnectionPool
+from pool import map_calls, SingleFlight
+from ratelimit import TokenBucket
+from retry import RetryPolicy
+from signing import RequestSigner
 from error import LastfmAuthenticationError, LastfmError, LastfmParamError
 
 class LastfmApiConnection(object):
     """The LastfmApiConnection class is the main entry point into this library."""
     URL = "http://ws.audioscrobbler.com/2.0/"
+    RATE_LIMIT_EXCEEDED = 29
+    RATE_LIMIT_PAUSE = 10
+    """How long in seconds to stop making requests after exceeding the rate limit"""
 
     
     def __init__(self, api_key, secret, session_key=None,
-                 username=None, password=None, cache_enabled=False, cache_expiry=20):
+                 username=None, password=None, cache_enabled=False, cache_expiry=20,
+                 cache_max_entries=1024, cache_max_bytes=8 * 1024 * 1024,
+                 cache_method_expiry=None, cache_path=None, transport=None,
+                 rate_limit=5, rate_burst=None, retry_policy=None, coalesce=True):
         """
         Creates a new LastfmApiConnection object.
         @param api_key: The api key provided by last.fm for your application
@@ -25,22 +39,60 @@ class LastfmApiConnection(object):
         @param password: The users password, in plain text/md5 hash or None
         @param cache_enabled: Whether objects will be cached for reuse
         @param cache_expiry: The cache expiry time in minutes
+        @param cache_max_entries: The maximum number of responses held in the cache
+        @param cache_max_bytes: The maximum total size of cached responses in bytes
+        @param cache_method_expiry: A dictionary of api method names to expiry
+        times in seconds, overriding L{Cache.METHOD_EXPIRY}
+        @param cache_path: (Optional) The path of a L{DiskCache} database shared
+        by all processes using the same path
+        @param transport: (Optional) The L{HTTPConnectionPool} used to make
+        requests, a new one is created if this is None
+        @param rate_limit: The maximum number of requests per second made with
+        this api key, shared by all connections in the process, or None for
+        no limit
+        @param rate_burst: (Optional) The number of requests that can be made
+        at once after a quiet period, defaults to rate_limit
+        @param retry_policy: (Optional) The L{RetryPolicy} for failed requests,
+        a default policy is used if this is None
+        @param coalesce: Whether identical GET requests made at the same time
+        share one HTTP request
         """
-        from _basetype import AbstractType
+        from _basetype import AbstractType, _find_nodes
         from user import UserMethod
         from auth import AuthMethod
         from event import EventMethod
+        from album import AlbumMethod
+        from track import TrackMethod
         
-        self.api_key = api_key
-        self.secret = secret
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst
+        self.set_api_key(api_key, secret)
         self.session_key = session_key
-        self.username = self.set_username(username)
-        self.password = self.set_password(password)
-        Cache.set_cache(cache_enabled, cache_expiry)
-        #self.album = AlbumMethod(self)
+        self.set_username(username)
+        self.set_password(password)
+        if transport is None:
+            transport = HTTPConnectionPool()
+        self.transport = transport
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
+        self.retry_policy = retry_policy
+        self.single_flight = None
+        if coalesce:
+            self.single_flight = SingleFlight()
+        self.observers = []
+        self._local = threading.local()
+        self.cache = None
+        if cache_enabled:
+            store = None
+            if cache_path is not None:
+                store = DiskCache(cache_path)
+            self.cache = Cache(cache_expiry, cache_max_entries, cache_max_bytes,
+                               cache_method_expiry, store)
+        self.album = AlbumMethod(self)
         self.user = UserMethod(self)
         self.auth = AuthMethod(self)
         self.event = EventMethod(self)
+        self.track = TrackMethod(self)
 
     def set_api_key(self, api_key, secret):
         """
@@ -49,7 +101,27 @@ class LastfmApiConnection(object):
         """
         self.api_key = api_key
         self.secret = secret
+        self.signer = RequestSigner(api_key, secret)
+        self.rate_limiter = None
+        if self.rate_limit:
+            self.rate_limiter = TokenBucket.for_key(api_key, self.rate_limit,
+                                                    self.rate_burst)
+
 
+    def add_observer(self, observer):
+        """
+        Starts timing requests, when no observer is registered nothing is timed.
+        @param observer: A L{ConnectionObserver} eg. a L{MetricsAggregator}
+        """
+        self.observers.append(observer)
+        if hasattr(self.transport, "record_timings"):
+            self.transport.record_timings = True
+
+    def remove_observer(self, observer):
+        """
+        @param observer: A L{ConnectionObserver} added with L{add_observer}
+        """
+        self.observers.remove(observer)
 
     def set_username(self, username):
         """
@@ -78,6 +150,20 @@ class LastfmApiConnection(object):
         self.session_key = session_key
 
     
+    def batch(self, calls, workers=10, ordered=True):
+        """
+        Makes many api calls at once on a bounded pool of threads.
+        eg. conn.batch((ArtistMethod(conn, name).getInfo, ()) for name in names)
+        @param calls: An iterable of callables, or tuples of (function, args)
+        or (function, args, kwargs)
+        @param workers: The maximum number of requests in flight at once
+        @param ordered: True to return results in the order of calls, False to
+        return them as they complete
+        @return: A generator of L{BatchResult} objects, failed calls have
+        their exception set as the error attribute
+        """
+        return map_calls(calls, workers, ordered)
+
     def _create_api_signature(self, **kwargs):
         """
         Construct your api method signatures by first ordering all the
@@ -93,17 +179,17 @@ class LastfmApiConnection(object):
 
         api signature = md5("api_keyxxxxxxxxmethodauth.getSessiontokenxxxxxxxmysecret")
 
-        @return: A dictionary containing all parameters and a md5 signature hash
+        Parameters set to None are not sent and are left out of the signature.
+        Signing is done by L{RequestSigner}, which remembers recent signatures.
+
+        @return: A new dictionary containing all parameters and a md5 signature hash
         """
-        kwargs['api_key'] = self.api_key
+        params = dict(kwargs)
+        params['api_key'] = self.api_key
         if self.session_key is not None:
-            kwargs["sk"] = self.session_key
-        data = ""
-        for method, value in sorted(kwargs.iteritems()):
-            data += "%s%s" % (method, value)
-        data += self.secret
-        kwargs['api_sig'] = hashlib.md5(data.encode('UTF-8')).hexdigest()
-        return kwargs
+            params["sk"] = self.session_key
+        params['api_sig'] = self.signer.sign(params)
+        return params
     
 
 
@@ -114,19 +200,46 @@ class LastfmApiConnection(object):
         eg. limit=1, user='woodenbrick'
         """
         kwargs['api_key'] = self.api_key
-        encoded_url = LastfmApiConnection.URL + "?" + _encode_url_params(kwargs)
-        if Cache.ENABLED:
-            signature = self._create_api_signature(**kwargs)
-            object = Cache.return_object(signature)
-            if object is not None:
-                return object
-        #download new data    
-        request = urllib2.Request(url=encoded_url)
-        try:
-            response = urllib2.urlopen(request)
-        except urllib2.HTTPError, e:
-                response = e
-        return response
+        if self.observers:
+            return StringIO(self._observe(self._fetch, kwargs))
+        return StringIO(self._fetch(kwargs)[0])
+
+    def _fetch(self, params):
+        """
+        Answers a GET request from the cache or by downloading it
+        @return: A tuple of the response body and whether it came from the cache
+        """
+        key = None
+        if self.cache is not None or self.single_flight is not None:
+            key = Cache.make_key(params)
+        if self.cache is not None:
+            body = self.cache.get(key)
+            if body is not None:
+                return body, True
+        if self.single_flight is not None:
+            #threads asking for the same thing share the download, each
+            #gets its own file object for the body
+            return self.single_flight.do(key, self._download, key, params), False
+        return self._download(key, params), False
+
+    def _download(self, key, params):
+        """
+        Makes a GET request and caches the response if it was successful
+        @return: The response body
+        """
+        body = self._get(params)
+        #only successful responses are worth keeping
+        if self.cache is not None and _is_ok_response(body):
+            self.cache.put(key, body, params.get("method"))
+        return body
+
+    def _get(self, params):
+        """
+        Sends a GET request, bypassing the cache
+        @return: The response body
+        """
+        encoded_url = self.URL + "?" + _encode_url_params(params)
+        return self._request("GET", encoded_url)
 
         
 
@@ -141,23 +254,106 @@ class LastfmApiConnection(object):
         if self.session_key is None:
             raise LastfmAuthenticationError("This service requires authentication")
         kwargs = self._create_api_signature(**kwargs)
-        encoded_data = _encode_lastfm_params(kwargs)
-        request = urllib2.Request(url=LastfmApiConnection.URL, data=encoded_data)
-        try:
-            response = urllib2.urlopen(request)
-        except urllib2.HTTPError, e:
-            response = e
-        tree = ElementTree.parse(response)
+        if self.observers:
+            body = self._observe(self._post, kwargs)
+        else:
+            body = self._post(kwargs)[0]
+        tree = self._parse(StringIO(body))
         return self._get_xml_response_code(tree)
+
+    def _post(self, params):
+        """
+        @return: A tuple of the response body and False, as for L{_fetch}
+        """
+        encoded_data = self._encode_lastfm_params(params)
+        return self._request("POST", self.URL, encoded_data), False
+
+    def _observe(self, send, params):
+        """
+        Makes a request and tells the observers about it
+        @param send: L{_fetch} or L{_post}
+        @return: The response body
+        """
+        method = params.get("method")
+        #the transport and create_objects report phases for this method
+        self._local.method = method
+        start = time.time()
+        try:
+            body, cached = send(params)
+        except Exception, e:
+            for observer in self.observers:
+                observer.on_exception(method, e)
+            raise
+        seconds = time.time() - start
+        error_code = _get_error_code(body)
+        for observer in self.observers:
+            observer.on_request(method, seconds, len(body), cached, error_code)
+        return body
+
+    def _notify_phase(self, phase, seconds):
+        method = getattr(self._local, "method", None)
+        for observer in self.observers:
+            observer.on_phase(method, phase, seconds)
+
+    def _parse(self, doc):
+        """
+        @return: The ElementTree of doc, timed if there are observers
+        """
+        if not self.observers:
+            return ElementTree.parse(doc)
+        start = time.time()
+        tree = ElementTree.parse(doc)
+        self._notify_phase("parse", time.time() - start)
+        return tree
     
 
+    def _request(self, method, url, data=None):
+        """
+        Sends a request, retrying it if it fails in a way that
+        L{RetryPolicy} considers transient. POST requests are only retried
+        when last.fm reports that it didn't process them.
+        @return: The response body
+        """
+        send = lambda: self._send(method, url, data)
+        status, body = self.retry_policy.call(send, _get_error_code,
+                                              idempotent=(method == "GET"))
+        return body
+
+    def _send(self, method, url, data=None):
+        """
+        Sends a request once the rate limit allows it
+        @return: A tuple of the HTTP status and the response body
+        """
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        if self.observers:
+            start = time.time()
+            status, body = self.transport.request(method, url, data)
+            self._observe_transfer(time.time() - start)
+        else:
+            status, body = self.transport.request(method, url, data)
+        if self.rate_limiter is not None and \
+           _get_error_code(body) == LastfmApiConnection.RATE_LIMIT_EXCEEDED:
+            self.rate_limiter.penalize(LastfmApiConnection.RATE_LIMIT_PAUSE)
+        return status, body
+
+    def _observe_transfer(self, seconds):
+        """
+        Reports the phases of a request the transport timed, or the whole
+        transfer if it can't time them
+        """
+        get_timings = getattr(self.transport, "get_timings", None)
+        timings = None
+        if get_timings is not None:
+            timings = get_timings()
+        if timings is None:
+            timings = (("transfer", seconds),)
+        for phase, phase_seconds in timings:
+            self._notify_phase(phase, phase_seconds)
+
     def _encode_lastfm_params(self, arg_dic):
         """Remove unwanted parameters from argument list and encode"""
-        clean_dic = {}
-        for key, value in arg_dic.items():
-            if value is None:
-                clean_dic[key] = value
-        return urllib.urlencode(clean_dic)
+        return _encode_url_params(arg_dic)
 
     def _get_xml_response_code(self, etree):
         """
@@ -172,48 +368,255 @@ class LastfmApiConnection(object):
             return False
         
 
-    def create_objects(self, doc, _class):
+    def create_objects(self, doc, _class, stream=False):
         """
         Creates an Object from an XML document.
         @param doc: an XML document
         @param _class: a class that subclasses L{AbstractType} eg. L{User}
+        @param stream: (Optional) If True a generator from L{iter_objects} is
+        returned instead
         @return: A list or single instance of type _class or None if it couldnt
         be built
         """
+        if stream:
+            return self.iter_objects(doc, _class)
         #sometimes we have a cached version, so we dont need to create objects
         if isinstance(doc, list) or isinstance(doc, AbstractType):
             return doc
-        tree = ElementTree.parse(doc)
-        iter = tree.getiterator(_class.ROOT_NODE)
+        tree = self._parse(doc)
+        if self.observers:
+            start = time.time()
         object_list = []
-        for node in iter:
+        for node in _find_nodes(tree.getroot(), _class.ROOT_NODE):
             object_list.append(_class(node))
+        if self.observers:
+            self._notify_phase("build", time.time() - start)
         if len(object_list) == 1:
             return object_list[0]
         return object_list
 
+    def iter_objects(self, doc, _class):
+        """
+        Creates Objects from an XML document as it is parsed. Each node is
+        discarded once its object has been built, so only one node is held
+        in memory at a time. Nodes nested inside a node of the same type are
+        part of their parent and aren't yielded on their own.
+        @param doc: an XML document
+        @param _class: a class that subclasses L{AbstractType} eg. L{User}
+        @return: A generator of _class instances
+        """
+        if isinstance(doc, AbstractType):
+            yield doc
+            return
+        if isinstance(doc, list):
+            for obj in doc:
+                yield obj
+            return
+        for node in _iter_nodes(doc, (_class.ROOT_NODE,)):
+            yield _class(node)
+
+
+def _iter_nodes(doc, tags, iterparse=ElementTree.iterparse):
+    """
+    Yields the outermost nodes with one of the tags as they are parsed.
+    Each one is removed from its parent once it has been yielded, the
+    parser keeps appending to open nodes, so clearing would leave every
+    node's empty shell in the tree.
+    @param doc: A file like object or the path of an XML document
+    @param tags: A tuple of the tags to yield
+    @param iterparse: The iterparse function to use, eg. cElementTree's
+    @return: A generator of Elements, each complete only until the next is yielded
+    """
+    parents = []
+    depth = 0
+    for event, node in iterparse(doc, events=("start", "end")):
+        if event == "start":
+            if node.tag in tags:
+                depth += 1
+            parents.append(node)
+            continue
+        parents.pop()
+        if node.tag not in tags:
+            continue
+        depth -= 1
+        if depth == 0:
+            yield node
+            if parents:
+                parents[-1].remove(node)
+            node.clear()
+
+def _clean_params(params):
+    """
+    Drops parameters that were not set and utf8 encodes the rest
+    @param params: A dictionary of request parameters
+    @return: A sorted list of (name, value) pairs
+    """
+    clean = []
+    for key, value in params.iteritems():
+        if value is None:
+            continue
+        if isinstance(value, unicode):
+            value = value.encode("UTF-8")
+        clean.append((key, value))
+    clean.sort()
+    return clean
+
+def _encode_url_params(params):
+    """Encodes request parameters in a normalized (sorted) order"""
+    return urllib.urlencode(_clean_params(params))
+
+def _is_ok_response(body):
+    """Checks the lfm status of a raw response body without parsing it"""
+    return 'status="ok"' in body[:256]
+
+ERROR_CODE_RE = re.compile(r'<error code="(\d+)"')
+
+def _get_error_code(body):
+    """
+    @return: The last.fm error code of a raw response body, or None
+    """
+    match = ERROR_CODE_RE.search(body, 0, 512)
+    if match is None:
+        return None
+    return int(match.group(1))
+
 
 class Cache(object):
-    CACHE_DICT = {}
-    EXPIRY = 20
-    ENABLED = False
-    
-    def __init__(self, sig, object):
-        Cache.CACHE_DICT['sig'] = object
-        self.cache_time = time.time()
-        
-    @staticmethod
-    def set_cache(enabled, expiry):
-        Cache.ENABLED = enabled
-        Cache.EXPIRY = expiry
+    """
+    A bounded least recently used cache of raw api responses, keyed on the
+    normalized request parameters. An optional L{DiskCache} can be used as
+    a second level shared with other processes.
+    """
+    METHOD_EXPIRY = {
+        "user.getrecenttracks" : 30,
+        "user.getlovedtracks" : 5 * 60,
+        "user.getinfo" : 10 * 60,
+        "artist.getinfo" : 60 * 60,
+        "album.getinfo" : 60 * 60,
+        "user.getweeklychartlist" : 6 * 60 * 60,
+        "user.getweeklyartistchart" : 6 * 60 * 60,
+        "user.getweeklyalbumchart" : 6 * 60 * 60,
+        "user.getweeklytrackchart" : 6 * 60 * 60,
+        "auth.gettoken" : 0,
+        "auth.getsession" : 0,
+    }
+    """Expiry times in seconds for api methods, 0 disables caching"""
+    IGNORED_PARAMS = ("api_key", "api_sig")
+    """Parameters that have no effect on the response body"""
+
+    def __init__(self, expiry=20, max_entries=1024, max_bytes=8 * 1024 * 1024,
+                 method_expiry=None, store=None):
+        """
+        @param expiry: The default expiry time in minutes
+        @param max_entries: The maximum number of responses to hold
+        @param max_bytes: The maximum total size of all held responses
+        @param method_expiry: (Optional) A dictionary of method names to expiry
+        times in seconds
+        @param store: (Optional) A L{DiskCache} to read through and write through to
+        """
+        self.expiry = expiry * 60
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.method_expiry = dict(Cache.METHOD_EXPIRY)
+        if method_expiry is not None:
+            for method, seconds in method_expiry.iteritems():
+                self.method_expiry[method.lower()] = seconds
+        self.size = 0
+        """The total size in bytes of all held responses"""
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.store = store
+        self.store_hits = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
 
     @staticmethod
-    def return_object(signature):
-        try:
-            obj = Cache.CACHE_DICT['sig']
-            if obj.cache_time - time.time() < Cache.EXPIRY:
-                return Cache.CACHE_DICT['sig']
-            return None
-        except KeyError:
-            return None
-        
+    def make_key(params):
+        """
+        @param params: A dictionary of request parameters
+        @return: A string that is equal for all requests returning the same data
+        """
+        return urllib.urlencode([(key, value) for key, value in _clean_params(params)
+                                 if key not in Cache.IGNORED_PARAMS])
+
+    def get_expiry(self, method):
+        """
+        @param method: An api method name eg. user.getInfo or None
+        @return: How long in seconds a response for this method may be kept
+        """
+        if method is None:
+            return self.expiry
+        return self.method_expiry.get(method.lower(), self.expiry)
+
+    def get(self, key):
+        """
+        @param key: A key from L{make_key}
+        @return: The cached response body or None if it is missing or has expired
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                expires, body = entry
+                if expires >= time.time():
+                    #reinsert so this key becomes the most recently used
+                    self._entries[key] = entry
+                    self.hits += 1
+                    return body
+                self.size -= len(body)
+        if self.store is not None:
+            entry = self.store.get(key)
+            if entry is not None:
+                with self._lock:
+                    self.store_hits += 1
+                    self._insert(key, entry)
+                return entry[1]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, body, method=None):
+        """
+        Stores a response body, evicting the least recently used responses
+        if the cache grows beyond its bounds.
+        @param key: A key from L{make_key}
+        @param body: The raw response body
+        @param method: (Optional) The api method name, used to find the expiry
+        @return: True if the body was stored
+        """
+        expiry = self.get_expiry(method)
+        if expiry <= 0 or len(body) > self.max_bytes:
+            return False
+        expires = time.time() + expiry
+        with self._lock:
+            self._insert(key, (expires, body))
+        if self.store is not None:
+            self.store.put(key, body, expires)
+        return True
+
+    def _insert(self, key, entry):
+        """Stores an (expires, body) entry, the lock must be held"""
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old[1])
+        self._entries[key] = entry
+        self.size += len(entry[1])
+        while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+            expires, evicted = self._entries.popitem(last=False)[1]
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def clear(self):
+        """Removes all responses from the cache"""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """
+        @return: A dictionary of cache counters
+        """
+        with self._lock:
+            return {"entries" : len(self._entries), "bytes" : self.size,
+                    "hits" : self.hits, "misses" : self.misses,
+                    "evictions" : self.evictions, "store_hits" : self.store_hits}
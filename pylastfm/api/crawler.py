@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+import json
+import os
+from cStringIO import StringIO
+from _basetype import AbstractType
+from artist import Artist
+from connection import _get_error_code, _is_ok_response
+from error import LastfmError, LastfmParamError
+from pool import map_calls
+from tag import Tag
+
+class SimilarArtistCrawler(object):
+    """
+    Builds a graph of similar artists by a breadth first search from some
+    seed artists with artist.getSimilar. The edges are yielded as they are
+    found, as (source, target, match) tuples, so large graphs never have
+    to be held in memory; only the names of the artists seen are kept.
+
+    Artists are the same if their names match ignoring case or their mbids
+    match. Each depth is expanded on a bounded number of workers before the
+    next one starts. The seeds are at depth 0 and artists at max_depth are
+    reached but not expanded. Once max_nodes artists have been seen, edges
+    to new artists are dropped.
+
+    With a checkpoint file the frontier is saved as the crawl goes, and a
+    crawl started with the same file carries on from it. Edges of artists
+    expanded after the last save are found again, so a resumed crawl may
+    repeat up to checkpoint_interval artists' edges. The checkpoint of a
+    finished crawl has an empty frontier, so running it again yields nothing.
+    """
+
+    def __init__(self, conn, workers=10, max_depth=2, max_nodes=None, limit=None,
+                 min_match=0.0, checkpoint=None, checkpoint_interval=100,
+                 on_tags=None):
+        """
+        @param conn: A L{LastfmApiConnection}
+        @param workers: The number of artists expanded at once
+        @param max_depth: How many steps from the seeds artists are reached,
+        0 expands nothing
+        @param max_nodes: (Optional) The maximum number of artists in the graph
+        @param limit: (Optional) The number of similar artists fetched for each
+        artist
+        @param min_match: Edges with a lower match score are dropped
+        @param checkpoint: (Optional) The path of a file to save the frontier to
+        @param checkpoint_interval: The number of artists expanded between saves
+        @param on_tags: (Optional) A function called with each expanded
+        artist's name and a list of its top tag names, setting it also fetches
+        artist.getTopTags for every expanded artist. It is called on the
+        thread iterating over the crawl
+        @raise LastfmParamError: if max_depth is negative
+        """
+        if max_depth < 0:
+            raise LastfmParamError("max_depth can't be negative")
+        self.conn = conn
+        self.workers = workers
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+        self.limit = limit
+        self.min_match = min_match
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.on_tags = on_tags
+        self._reset()
+
+    def _reset(self):
+        self._seen = set()
+        self.nodes = 0
+        """The number of artists seen"""
+        self.expanded = 0
+        """The number of artists expanded"""
+        self.edges = 0
+        """The number of edges yielded"""
+        self.failed = []
+        """A list of (name, exception) for the artists that couldn't be expanded"""
+        self.depth = 0
+        self._frontier = []
+        self._next = []
+
+    def _add(self, name, mbid=None):
+        """
+        Adds an artist to the graph if it hasn't been seen
+        @return: True if the artist is new and within the node budget
+        """
+        keys = [name.lower()]
+        if mbid:
+            keys.append(mbid)
+        if any(key in self._seen for key in keys):
+            return False
+        if self.max_nodes is not None and self.nodes >= self.max_nodes:
+            return False
+        self._seen.update(keys)
+        self.nodes += 1
+        return True
+
+    def crawl(self, seeds):
+        """
+        @param seeds: A list of artist names or L{Artist} objects, ignored when
+        resuming from a checkpoint
+        @return: A generator of (source, target, match) tuples
+        """
+        if not self._load():
+            self._reset()
+            for seed in seeds:
+                if isinstance(seed, AbstractType):
+                    seed = seed.name
+                if self._add(seed) and self.max_depth > 0:
+                    self._frontier.append(seed)
+        while self._frontier:
+            frontier = self._frontier
+            done = set()
+            calls = [(self._expand, (name,)) for name in frontier]
+            for result in map_calls(calls, self.workers, ordered=False):
+                name = result.call[1][0]
+                if result.ok:
+                    for edge in self._follow(name, result.value):
+                        self.edges += 1
+                        yield edge
+                else:
+                    self.failed.append((name, result.error))
+                done.add(name)
+                self.expanded += 1
+                if self.checkpoint and self.expanded % self.checkpoint_interval == 0:
+                    self._frontier = [n for n in frontier if n not in done]
+                    self._save()
+            self.depth += 1
+            self._frontier, self._next = self._next, []
+            self._save()
+
+    def _expand(self, name):
+        """
+        Runs on a worker thread
+        @return: A tuple of the similar artists as (name, mbid, match) tuples
+        and the top tag names, or None if they aren't wanted
+        """
+        similar = self._get(Artist, artist=name, limit=self.limit,
+                            method="artist.getSimilar")
+        tags = None
+        if self.on_tags is not None:
+            tags = [tag.name for tag in self._get(Tag, artist=name,
+                                                  method="artist.getTopTags")]
+        return [(artist.name, artist.mbid, artist.match) for artist in similar], tags
+
+    def _get(self, _class, **params):
+        """
+        Makes the same requests as L{ArtistMethod}, but raises on errors
+        rather than returning no objects, so the artist isn't taken as having
+        no neighbours
+        @raise LastfmError: if last.fm returned an error
+        @return: A list of _class objects
+        """
+        body = self.conn._api_get_request(**params).read()
+        if not _is_ok_response(body):
+            raise LastfmError("%s failed for %s, error %s" % (
+                params["method"], params["artist"], _get_error_code(body)))
+        objects = self.conn.create_objects(StringIO(body), _class)
+        if isinstance(objects, AbstractType):
+            return [objects]
+        return objects
+
+    def _follow(self, name, expansion):
+        """
+        Adds an artist's neighbours to the graph
+        @return: A generator of the artist's edges
+        """
+        similar, tags = expansion
+        if tags is not None:
+            self.on_tags(name, tags)
+        expand = self.depth + 1 < self.max_depth
+        for target, mbid, match in similar:
+            if target.lower() == name.lower():
+                continue
+            if match is not None and match < self.min_match:
+                continue
+            if self._add(target, mbid):
+                if expand:
+                    self._next.append(target)
+            elif target.lower() not in self._seen and mbid not in self._seen:
+                #a new artist over the node budget
+                continue
+            yield name, target, match
+
+    def _save(self):
+        """Writes the frontier to the checkpoint file, replacing it atomically"""
+        if not self.checkpoint:
+            return
+        state = {"depth" : self.depth, "frontier" : self._frontier,
+                 "next" : self._next, "seen" : list(self._seen),
+                 "nodes" : self.nodes, "expanded" : self.expanded,
+                 "edges" : self.edges,
+                 "failed" : [name for name, error in self.failed]}
+        f = open(self.checkpoint + ".tmp", "wb")
+        try:
+            json.dump(state, f)
+        finally:
+            f.close()
+        os.rename(self.checkpoint + ".tmp", self.checkpoint)
+
+    def _load(self):
+        """
+        @return: True if the crawl was restored from the checkpoint file
+        """
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return False
+        f = open(self.checkpoint, "rb")
+        try:
+            state = json.load(f)
+        finally:
+            f.close()
+        self._reset()
+        self.depth = state["depth"]
+        self._frontier = state["frontier"]
+        self._next = state["next"]
+        self._seen = set(state["seen"])
+        self.nodes = state["nodes"]
+        self.expanded = state["expanded"]
+        self.edges = state["edges"]
+        self.failed = [(name, None) for name in state["failed"]]
+        return True
+
+    def stats(self):
+        """
+        @return: A dictionary of the crawl's counters
+        """
+        return {"depth" : self.depth, "nodes" : self.nodes,
+                "expanded" : self.expanded, "edges" : self.edges,
+                "failed" : len(self.failed),
+                "frontier" : len(self._frontier) + len(self._next)}
+
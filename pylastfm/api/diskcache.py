@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+import hashlib
+import sqlite3
+import threading
+import time
+
+class DiskCache(object):
+    """
+    A persistent store of raw api responses that can be shared by many
+    processes. Responses are kept in an sqlite database in write ahead log
+    mode, so readers never block each other or a writer.
+    """
+    COMPACT_INTERVAL = 256
+    """How many writes are made between automatic compactions"""
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, timeout=30):
+        """
+        @param path: The path of the database file, it will be created if needed
+        @param max_bytes: The maximum total size of all stored responses
+        @param timeout: How long in seconds to wait for another process
+        holding a write lock
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._connect()
+
+    def _connect(self):
+        """
+        sqlite connections can't be shared between threads, so each thread
+        gets its own.
+        @return: An sqlite3 connection for the current thread
+        """
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.timeout,
+                                 isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("CREATE TABLE IF NOT EXISTS responses ("
+                       "hash TEXT PRIMARY KEY, expires REAL, size INTEGER, body BLOB)")
+            db.execute("CREATE INDEX IF NOT EXISTS responses_expires "
+                       "ON responses (expires)")
+            self._local.db = db
+        return db
+
+    @staticmethod
+    def _hash(key):
+        return hashlib.sha1(key).hexdigest()
+
+    def get(self, key):
+        """
+        @param key: A key from L{Cache.make_key}
+        @return: A tuple of (expires, body) or None if the response is missing
+        or has expired
+        """
+        row = self._connect().execute("SELECT expires, body FROM responses "
+                                      "WHERE hash = ?", (self._hash(key),)).fetchone()
+        if row is None or row[0] < time.time():
+            return None
+        return row[0], str(row[1])
+
+    def put(self, key, body, expires):
+        """
+        @param key: A key from L{Cache.make_key}
+        @param body: The raw response body
+        @param expires: The unix time this response expires at
+        """
+        self._connect().execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                                (self._hash(key), expires, len(body),
+                                 sqlite3.Binary(body)))
+        #threads share the count, so exactly one of them compacts each interval
+        with self._lock:
+            self._writes += 1
+            compact = self._writes % DiskCache.COMPACT_INTERVAL == 0
+        if compact:
+            self.compact()
+
+    def size(self):
+        """
+        @return: The total size in bytes of all stored responses
+        """
+        return self._connect().execute("SELECT COALESCE(SUM(size), 0) "
+                                       "FROM responses").fetchone()[0]
+
+    def compact(self, vacuum=False):
+        """
+        Removes expired responses, then the responses closest to expiring
+        until the store is within max_bytes.
+        @param vacuum: Whether to return the freed space to the filesystem
+        @return: The number of responses removed
+        """
+        db = self._connect()
+        removed = db.execute("DELETE FROM responses WHERE expires < ?",
+                             (time.time(),)).rowcount
+        excess = self.size() - self.max_bytes
+        if excess > 0:
+            doomed = []
+            for hash, size in db.execute("SELECT hash, size FROM responses "
+                                         "ORDER BY expires"):
+                if excess <= 0:
+                    break
+                doomed.append((hash,))
+                excess -= size
+            db.executemany("DELETE FROM responses WHERE hash = ?", doomed)
+            removed += len(doomed)
+        if vacuum:
+            db.execute("VACUUM")
+        return removed
+
+    def clear(self):
+        """Removes all stored responses"""
+        self._connect().execute("DELETE FROM responses")
@@ -4,10 +4,10 @@ class LastfmError(Exception):
     """Base class for all Last.fm Errors"""
     pass
 
-class LastfmAuthenticationError(Exception):
+class LastfmAuthenticationError(LastfmError):
     """Errors caused by authentication problems"""
     pass
 
-class LastfmParamError(Exception):
+class LastfmParamError(LastfmError):
     """Errors caused by passing incorrect parameters or invalid data"""
     pass
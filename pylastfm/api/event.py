@@ -1,15 +1,24 @@
 #!/usr/bin/env python
 
-from _basetype import AbstractType
+from _basetype import AbstractType, _to_float, _to_int
 
 class Event(AbstractType):
+    ROOT_NODE = "event"
+    __slots__ = ("id", "title", "artists", "headliner", "venue", "city",
+                 "country", "street", "postalcode", "longitude", "latitude",
+                 "timezone", "venue_url", "start_date", "description",
+                 "image_small", "image_medium", "image_large", "attendance",
+                 "reviews", "tag", "url", "website", "tickets")
+    int_types = ("reviews", "attendance")
+    float_types = ("longitude", "latitude")
+    GEO = "{http://www.w3.org/2003/01/geo/wgs84_pos#}"
+    """The namespace of the venue's coordinates"""
+
     def __init__(self, etree):
         """
         A Last.fm event object.
         @param etree: An ElementTree for this event
         """
-        AbstractType.__init__(self, int_types=["reviews", "attendance"],
-            float_types=["longitude", "latitude"])
         self.id = None
         """Unique id of this event"""
         self.title = None
@@ -59,6 +68,45 @@ class Event(AbstractType):
         self.tickets = []
         """A list of urls where tickets for this event can be purchased"""
 
+        self._parse_etree(etree)
+
+    def _parse_etree(self, etree):
+        """
+        Events nest their artists, venue and tickets, and the venue has its
+        own id, name and url, so fields are read from their own paths
+        rather than by tag name
+        @param etree: An ElementTree for this event
+        """
+        self.id = etree.findtext("id")
+        self.title = etree.findtext("title")
+        self.artists = [node.text for node in etree.findall("artists/artist")]
+        self.headliner = [node.text for node in etree.findall("artists/headliner")]
+        self.venue = etree.findtext("venue/name")
+        self.venue_url = etree.findtext("venue/url")
+        location = etree.find("venue/location")
+        if location is not None:
+            self.city = location.findtext("city")
+            self.country = location.findtext("country")
+            self.street = location.findtext("street")
+            self.postalcode = location.findtext("postalcode")
+            self.timezone = location.findtext("timezone")
+            point = location.find(Event.GEO + "point")
+            if point is not None:
+                self.latitude = _to_float(point.findtext(Event.GEO + "lat"))
+                self.longitude = _to_float(point.findtext(Event.GEO + "long"))
+        self.start_date = etree.findtext("startDate")
+        self.description = etree.findtext("description")
+        for node in etree.findall("image"):
+            size = node.get("size")
+            if size in ("small", "medium", "large"):
+                setattr(self, "image_" + size, node.text)
+        self.attendance = _to_int(etree.findtext("attendance"))
+        self.reviews = _to_int(etree.findtext("reviews"))
+        self.tag = etree.findtext("tag")
+        self.url = etree.findtext("url")
+        self.website = etree.findtext("website")
+        self.tickets = [node.text for node in etree.findall("tickets/ticket")]
+
 
 class EventMethod(object):
     def __init__(self, conn):
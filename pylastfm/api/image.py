@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+
+from _basetype import AbstractType
+
+class Image(AbstractType):
+    ROOT_NODE = "image"
+    __slots__ = ("title", "url", "dateadded", "format", "size", "size_name")
+    containers = ("sizes",)
+
+    def __init__(self, etree):
+        """
+        @param etree: An ElementTree that is the data of a
+        single image on last.fm
+        """
+        self.title = None
+        self.url = None
+        """The last.fm page for this image"""
+        self.dateadded = None
+        self.format = None
+        """The file format eg. jpg"""
+        self.size = None
+        """The url of the image file, the last size listed is kept"""
+        self.size_name = None
+        """The name of the size of the image file eg. original"""
+
+        self._parse_etree(etree)
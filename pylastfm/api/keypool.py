@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+import threading
+import time
+from connection import LastfmApiConnection, _encode_url_params, _get_error_code
+from error import LastfmParamError
+
+class PooledLastfmApiConnection(LastfmApiConnection):
+    """
+    A L{LastfmApiConnection} that spreads GET requests over several api
+    keys, so its throughput is the sum of their rate limits.
+
+    The first api key is the connection's own: it signs requests and owns
+    the session, so signed requests, including every POST and
+    auth.getSession, always use it. Unsigned GET requests go to the key
+    with the fewest requests in flight, or to each key in turn. A key that
+    last.fm reports as over its rate limit gets no traffic until its
+    cooldown ends, unless every key is cooling down.
+    """
+    SCHEDULERS = ("least_loaded", "round_robin")
+
+    def __init__(self, credentials, scheduling="least_loaded", cooldown=None,
+                 **kwargs):
+        """
+        @param credentials: A list of (api_key, secret) pairs, the first is
+        used for signed requests
+        @param scheduling: How GET requests are spread, "least_loaded" or
+        "round_robin"
+        @param cooldown: (Optional) How long in seconds to stop using a
+        throttled key, defaults to L{LastfmApiConnection.RATE_LIMIT_PAUSE}
+        @param kwargs: Any other L{LastfmApiConnection} parameters, the rate
+        limit applies to each key
+        @raise LastfmParamError: if there are no credentials or the scheduling
+        is unknown
+        """
+        if not credentials:
+            raise LastfmParamError("At least one api key is required")
+        if scheduling not in PooledLastfmApiConnection.SCHEDULERS:
+            raise LastfmParamError("Unknown scheduling: %s" % scheduling)
+        api_key, secret = credentials[0]
+        LastfmApiConnection.__init__(self, api_key, secret, **kwargs)
+        self.scheduling = scheduling
+        if cooldown is None:
+            cooldown = LastfmApiConnection.RATE_LIMIT_PAUSE
+        self.cooldown = cooldown
+        #other keys only need to send requests, they share the transport
+        self.members = [self]
+        for api_key, secret in credentials[1:]:
+            member = LastfmApiConnection(api_key, secret, transport=self.transport,
+                                         rate_limit=self.rate_limit,
+                                         rate_burst=self.rate_burst, coalesce=False)
+            #requests sent by members are reported to this connection's observers
+            member.observers = self.observers
+            member._local = self._local
+            self.members.append(member)
+        count = len(self.members)
+        self._active = [0] * count
+        self._requests = [0] * count
+        self._throttles = [0] * count
+        self._throttled_until = [0.0] * count
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def _get(self, params):
+        """
+        Sends a GET request with the key chosen by the scheduler, a retry
+        may use a different key
+        @return: The response body
+        """
+        if "api_sig" in params:
+            return LastfmApiConnection._get(self, params)
+        def send():
+            index = self._checkout()
+            member = self.members[index]
+            try:
+                url = self.URL + "?" + _encode_url_params(dict(params,
+                                                               api_key=member.api_key))
+                status, body = member._send("GET", url)
+            finally:
+                self._checkin(index)
+            if _get_error_code(body) == LastfmApiConnection.RATE_LIMIT_EXCEEDED:
+                self._throttle(index)
+            return status, body
+        status, body = self.retry_policy.call(send, _get_error_code)
+        return body
+
+    def _checkout(self):
+        """
+        @return: The index of the member to send the next request with
+        """
+        with self._lock:
+            now = time.time()
+            count = len(self.members)
+            order = [(self._next + i) % count for i in range(count)]
+            ready = [i for i in order if self._throttled_until[i] <= now]
+            if not ready:
+                ready = [min(order, key=self._throttled_until.__getitem__)]
+            if self.scheduling == "least_loaded":
+                #min keeps the first of equals, so ties are taken in turn
+                index = min(ready, key=self._active.__getitem__)
+            else:
+                index = ready[0]
+            self._next = (index + 1) % count
+            self._active[index] += 1
+            self._requests[index] += 1
+            return index
+
+    def _checkin(self, index):
+        with self._lock:
+            self._active[index] -= 1
+
+    def _throttle(self, index):
+        with self._lock:
+            self._throttles[index] += 1
+            self._throttled_until[index] = time.time() + self.cooldown
+
+    def key_stats(self):
+        """
+        @return: A list with a dictionary of counters for each api key
+        """
+        with self._lock:
+            now = time.time()
+            return [{"api_key" : member.api_key, "requests" : self._requests[i],
+                     "active" : self._active[i], "throttles" : self._throttles[i],
+                     "throttled" : self._throttled_until[i] > now}
+                    for i, member in enumerate(self.members)]
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+import bisect
+import threading
+
+class ConnectionObserver(object):
+    """
+    Receives timings from a L{LastfmApiConnection}, register one with
+    L{LastfmApiConnection.add_observer}. Subclasses override the methods
+    they need. Methods are called on the thread making the request, so they
+    should return quickly. When no observer is registered nothing is timed.
+
+    The phases of a request are connect (getting a connection, which is
+    close to nothing when one is reused), server (sending the request and
+    waiting for the response headers), read (reading the body), parse
+    (building the element tree) and build (creating objects from it).
+    Transports that can't tell the first three apart report a single
+    transfer phase instead.
+    """
+
+    def on_phase(self, method, phase, seconds):
+        """
+        @param method: The api method eg. user.getInfo, or None if unknown
+        @param phase: The name of the phase
+        @param seconds: How long the phase took
+        """
+        pass
+
+    def on_request(self, method, seconds, size, cached, error_code):
+        """
+        Called once for every api request, including those answered from
+        the cache
+        @param method: The api method eg. user.getInfo
+        @param seconds: How long the request took, including retries
+        @param size: The size of the response body in bytes
+        @param cached: Whether the response came from the cache
+        @param error_code: The last.fm error code of the response, or None
+        """
+        pass
+
+    def on_exception(self, method, exception):
+        """
+        Called when a request raised instead of returning a response
+        @param method: The api method eg. user.getInfo
+        @param exception: The exception raised
+        """
+        pass
+
+
+class Histogram(object):
+    """
+    Counts values in fixed buckets whose bounds double, from 1ms to about
+    30s, so recording is a bisect and an increment.
+    """
+    BOUNDS = [0.001 * 2 ** i for i in range(16)]
+    """The upper bound in seconds of each bucket but the last, which is unbounded"""
+
+    def __init__(self):
+        self.counts = [0] * (len(Histogram.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(Histogram.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        """
+        @param fraction: eg. 0.99
+        @return: The upper bound of the bucket holding that fraction of the
+        values, or the largest value if it is in the last bucket
+        """
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(Histogram.BOUNDS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        """
+        @return: A dictionary of the count, sum, mean, max, p50, p90 and p99
+        in seconds, and the count in each bucket keyed by its upper bound,
+        with None for the last
+        """
+        mean = 0.0
+        if self.count:
+            mean = self.total / self.count
+        buckets = zip(Histogram.BOUNDS + [None], self.counts)
+        return {"count" : self.count, "sum" : self.total, "mean" : mean,
+                "max" : self.max, "p50" : self.percentile(0.5),
+                "p90" : self.percentile(0.9), "p99" : self.percentile(0.99),
+                "buckets" : [(bound, count) for bound, count in buckets if count]}
+
+
+class MethodMetrics(object):
+    """The counters kept by L{MetricsAggregator} for one api method"""
+    __slots__ = ("requests", "cache_hits", "errors", "error_codes", "exceptions",
+                 "bytes", "latency", "phases")
+
+    def __init__(self):
+        self.requests = 0
+        self.cache_hits = 0
+        self.errors = 0
+        self.error_codes = {}
+        self.exceptions = 0
+        self.bytes = 0
+        self.latency = Histogram()
+        self.phases = {}
+
+    def snapshot(self):
+        hit_rate = 0.0
+        if self.requests:
+            hit_rate = float(self.cache_hits) / self.requests
+        return {"requests" : self.requests, "cache_hits" : self.cache_hits,
+                "cache_hit_rate" : hit_rate, "errors" : self.errors,
+                "error_codes" : dict(self.error_codes),
+                "exceptions" : self.exceptions, "bytes" : self.bytes,
+                "latency" : self.latency.snapshot(),
+                "phases" : dict((phase, histogram.snapshot()) for phase, histogram
+                                in self.phases.iteritems())}
+
+
+class MetricsAggregator(ConnectionObserver):
+    """
+    Keeps latency histograms for whole requests and for each phase, byte
+    counts, cache hit rates and error counts for every api method.
+    """
+
+    def __init__(self):
+        self._methods = {}
+        self._lock = threading.Lock()
+
+    def _get(self, method):
+        metrics = self._methods.get(method)
+        if metrics is None:
+            metrics = self._methods[method] = MethodMetrics()
+        return metrics
+
+    def on_phase(self, method, phase, seconds):
+        with self._lock:
+            phases = self._get(method).phases
+            histogram = phases.get(phase)
+            if histogram is None:
+                histogram = phases[phase] = Histogram()
+            histogram.add(seconds)
+
+    def on_request(self, method, seconds, size, cached, error_code):
+        with self._lock:
+            metrics = self._get(method)
+            metrics.requests += 1
+            metrics.bytes += size
+            metrics.latency.add(seconds)
+            if cached:
+                metrics.cache_hits += 1
+            if error_code is not None:
+                metrics.errors += 1
+                metrics.error_codes[error_code] = metrics.error_codes.get(error_code, 0) + 1
+
+    def on_exception(self, method, exception):
+        with self._lock:
+            metrics = self._get(method)
+            metrics.requests += 1
+            metrics.errors += 1
+            metrics.exceptions += 1
+
+    def snapshot(self):
+        """
+        @return: A dictionary of api method names to dictionaries of their
+        counters, see L{MethodMetrics.snapshot} and L{Histogram.snapshot}
+        """
+        with self._lock:
+            return dict((method, metrics.snapshot()) for method, metrics
+                        in self._methods.iteritems())
+
+    def reset(self):
+        """Forgets everything recorded so far"""
+        with self._lock:
+            self._methods = {}
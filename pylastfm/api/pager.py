@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+import math
+from xml.etree import ElementTree
+from _basetype import _find_nodes
+from error import LastfmError
+from pool import WorkerPool
+
+class PageIterator(object):
+    """
+    Iterates over every object of a paginated api method, eg.
+    user.getRecentTracks, fetching pages only as they are needed. While one
+    page is being consumed the next is downloaded in the background.
+    Stopping iteration early stops fetching.
+    """
+
+    def __init__(self, conn, _class, prefetch=True, **params):
+        """
+        @param conn: A L{LastfmApiConnection}
+        @param _class: The L{AbstractType} subclass to build for each item
+        @param prefetch: Whether to download the next page in the background
+        @param params: The api method parameters, including method. page
+        sets the first page to fetch
+        """
+        self.conn = conn
+        self._class = _class
+        self.prefetch = prefetch
+        self.page = params.pop("page", None) or 1
+        self.params = params
+        self.total = None
+        """The number of items on all pages, known once a page is fetched"""
+        self.total_pages = None
+        """The number of pages, known once a page is fetched"""
+        self.per_page = None
+        self._first = None
+
+    def get_total(self):
+        """
+        Fetches the first page if needed, it is kept for iteration.
+        @return: The number of items on all pages
+        """
+        if self.total_pages is None:
+            self._first = self._load(self._fetch(self.page))
+        return self.total
+
+    def _fetch(self, page):
+        params = dict(self.params)
+        params["page"] = page
+        return self.conn._api_get_request(**params).read()
+
+    def _load(self, body):
+        """
+        Parses a page and reads the totals from it
+        @raise LastfmError: if last.fm returned an error
+        @return: The root element of the page
+        """
+        root = ElementTree.fromstring(body)
+        if root.get("status") != "ok":
+            raise LastfmError(root.findtext("error"))
+        if len(root):
+            self._read_totals(root[0])
+        if self.total_pages is None:
+            self.total_pages = 1
+        return root
+
+    def _read_totals(self, node):
+        """
+        Most methods give totals as attributes, searches use opensearch
+        elements instead.
+        """
+        attrib = dict((key.lower(), value) for key, value in node.attrib.iteritems())
+        if "totalpages" in attrib:
+            self.total_pages = int(attrib["totalpages"])
+            self.total = int(attrib.get("total", 0)) or None
+            self.per_page = int(attrib.get("perpage", 0)) or None
+            return
+        for child in node:
+            if child.tag.endswith("}totalResults"):
+                self.total = int(child.text)
+            elif child.tag.endswith("}itemsPerPage"):
+                self.per_page = int(child.text)
+        if self.total is not None and self.per_page:
+            self.total_pages = int(math.ceil(float(self.total) / self.per_page))
+
+    def __iter__(self):
+        pool = WorkerPool(1)
+        try:
+            page = self.page
+            root = self._first
+            self._first = None
+            if root is None:
+                root = self._load(self._fetch(page))
+            while True:
+                next_page = None
+                if self.prefetch and page < self.total_pages:
+                    next_page = pool.submit(self._fetch, page + 1)
+                found = False
+                for node in _find_nodes(root, self._class.ROOT_NODE):
+                    found = True
+                    yield self._class(node)
+                if page >= self.total_pages or not found:
+                    return
+                page += 1
+                if next_page is not None:
+                    root = self._load(next_page.result())
+                else:
+                    root = self._load(self._fetch(page))
+        finally:
+            pool.shutdown(wait=False)
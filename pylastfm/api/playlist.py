@@ -3,4 +3,23 @@
 from _basetype import AbstractType
 
 class Playlist(AbstractType):
-    pass
\ No newline at end of file
+    ROOT_NODE = "playlist"
+    __slots__ = ("id", "title", "description", "date", "size", "duration", "creator", "url")
+    int_types = ("id", "size", "duration")
+
+    def __init__(self, etree):
+        """
+        @param etree: An ElementTree that is the data of a
+        single playlist on last.fm
+        """
+        self.id = None
+        self.title = None
+        self.description = None
+        self.date = None
+        self.size = None
+        """How many tracks are in this playlist"""
+        self.duration = None
+        self.creator = None
+        self.url = None
+
+        self._parse_etree(etree)
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+import collections
+import sys
+import threading
+import Queue
+
+class Future(object):
+    """The pending result of a call submitted to a L{WorkerPool}"""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        """
+        @return: True if the call has finished
+        """
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Waits for the call to finish.
+        @param timeout: (Optional) The maximum time in seconds to wait
+        @raise Exception: Whatever the call raised
+        @return: The value returned by the call
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError("Timed out waiting for result")
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        """
+        Waits for the call to finish.
+        @return: The exception raised by the call, or None
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError("Timed out waiting for result")
+        if self._exc_info is None:
+            return None
+        return self._exc_info[1]
+
+    def add_done_callback(self, callback):
+        """
+        @param callback: A function taking this future as its only argument,
+        called from the worker thread once the call has finished, or at once
+        if it already has
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exc_info(self, exc_info):
+        self._exc_info = exc_info
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                pass
+
+
+class WorkerPool(object):
+    """
+    A bounded pool of daemon threads. Threads are started as work arrives,
+    up to max_workers, so the pool also caps how many calls run at once.
+    """
+
+    def __init__(self, max_workers=10):
+        """
+        @param max_workers: The maximum number of calls running at once
+        """
+        self.max_workers = max_workers
+        self._queue = Queue.Queue()
+        self._workers = []
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Queues a call to run on a worker thread.
+        @param function: The function to call with args and kwargs
+        @return: A L{Future} for the call's result
+        """
+        future = Future()
+        with self._lock:
+            self._pending += 1
+            if self._pending > len(self._workers) and \
+               len(self._workers) < self.max_workers:
+                worker = threading.Thread(target=self._work)
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+        self._queue.put((future, function, args, kwargs))
+        return future
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, function, args, kwargs = item
+            try:
+                future.set_result(function(*args, **kwargs))
+            except Exception:
+                future.set_exc_info(sys.exc_info())
+            with self._lock:
+                self._pending -= 1
+
+    def shutdown(self, wait=True):
+        """
+        Stops all workers once the queued calls have finished.
+        @param wait: Whether to block until the workers have stopped
+        """
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            self._queue.put(None)
+        if wait:
+            for worker in workers:
+                worker.join()
+
+
+class SingleFlight(object):
+    """
+    Shares one call between every thread asking for the same key at the
+    same time. The first caller runs it and the others wait for its
+    result, or exception. A key is only shared while its call is running,
+    nothing is kept afterwards.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        """How many calls were run"""
+        self.coalesced = 0
+        """How many callers waited for another caller's call instead"""
+        self.errors = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args, **kwargs):
+        """
+        @param key: A hashable key, equal for calls that return the same result
+        @param function: The function to call if no call for key is running
+        @raise Exception: Whatever the shared call raised
+        @return: The value returned by the shared call
+        """
+        with self._lock:
+            future = self._flights.get(key)
+            leader = future is None
+            if leader:
+                future = self._flights[key] = Future()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+        try:
+            result = function(*args, **kwargs)
+        except:
+            #waiters must not be left hanging, whatever went wrong
+            exc_info = sys.exc_info()
+            with self._lock:
+                del self._flights[key]
+                self.errors += 1
+            future.set_exc_info(exc_info)
+            raise
+        with self._lock:
+            del self._flights[key]
+        future.set_result(result)
+        return result
+
+    def stats(self):
+        """
+        @return: A dictionary of call counters
+        """
+        with self._lock:
+            return {"calls" : self.calls, "coalesced" : self.coalesced,
+                    "errors" : self.errors, "in_flight" : len(self._flights)}
+
+
+class BatchResult(object):
+    """The outcome of a single call made by L{map_calls}"""
+
+    def __init__(self, index, call, value=None, error=None):
+        self.index = index
+        """The position of this call in the batch"""
+        self.call = call
+        """The call as it was given to the batch"""
+        self.value = value
+        """The value returned by the call, or None if it failed"""
+        self.error = error
+        """The exception raised by the call, or None if it succeeded"""
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def _unpack_call(call):
+    """
+    @param call: A callable, or a tuple of (function, args) or
+    (function, args, kwargs)
+    @return: A tuple of (function, args, kwargs)
+    """
+    if callable(call):
+        return call, (), {}
+    function, args = call[0], tuple(call[1])
+    kwargs = {}
+    if len(call) > 2:
+        kwargs = call[2]
+    return function, args, kwargs
+
+def map_calls(calls, workers=10, ordered=True, pool=None):
+    """
+    Runs many calls on a bounded pool, streaming back a L{BatchResult} for
+    each one. Only a small window of calls is queued at once, so calls can
+    be a generator of any length. A call that raises doesn't stop the batch,
+    its exception is returned in the result instead.
+    @param calls: An iterable of callables, or tuples of (function, args)
+    or (function, args, kwargs)
+    @param workers: The maximum number of calls running at once
+    @param ordered: True to yield results in the order of calls, False to
+    yield them as they complete
+    @param pool: (Optional) A L{WorkerPool} to run calls on, a new one is
+    created and shut down afterwards if this is None
+    @return: A generator of L{BatchResult} objects
+    """
+    own_pool = pool is None
+    if own_pool:
+        pool = WorkerPool(workers)
+    window = workers * 2
+    completed = Queue.Queue()
+    pending = collections.deque()
+    def run(index, call):
+        try:
+            function, args, kwargs = _unpack_call(call)
+            return BatchResult(index, call, value=function(*args, **kwargs))
+        except Exception, e:
+            return BatchResult(index, call, error=e)
+    try:
+        for index, call in enumerate(calls):
+            future = pool.submit(run, index, call)
+            if not ordered:
+                future.add_done_callback(completed.put)
+            pending.append(future)
+            if len(pending) >= window:
+                yield _next_result(pending, ordered, completed)
+        while pending:
+            yield _next_result(pending, ordered, completed)
+    finally:
+        if own_pool:
+            pool.shutdown(wait=False)
+
+def _next_result(pending, ordered, completed):
+    """Waits for the next result of L{map_calls}"""
+    future = pending.popleft()
+    if ordered:
+        return future.result()
+    return completed.get().result()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+import threading
+import time
+
+class TokenBucket(object):
+    """
+    Limits the rate of requests. Callers that arrive when the bucket is
+    empty reserve a future token and sleep until it is due, so excess
+    requests are delayed in arrival order rather than refused.
+    """
+    BUCKETS = {}
+    """Buckets shared by every connection using the same api key"""
+    _buckets_lock = threading.Lock()
+
+    def __init__(self, rate, burst=None):
+        """
+        @param rate: The number of requests allowed per second
+        @param burst: (Optional) How many requests can be made at once after
+        a quiet period, defaults to rate
+        """
+        self.rate = float(rate)
+        self.burst = burst or max(1, rate)
+        self.tokens = float(self.burst)
+        self.updated = time.time()
+        self.requests = 0
+        self.delayed = 0
+        """How many requests had to wait for a token"""
+        self.waiting = 0
+        """How many requests are waiting for a token right now"""
+        self.wait_time = 0.0
+        """The total time in seconds requests have spent waiting"""
+        self.max_wait = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def for_key(api_key, rate, burst=None):
+        """
+        @param api_key: The api key the bucket limits
+        @param rate: The number of requests allowed per second, used only if
+        the bucket doesn't exist yet
+        @param burst: (Optional) As for rate
+        @return: The L{TokenBucket} shared by all users of this api key
+        """
+        with TokenBucket._buckets_lock:
+            bucket = TokenBucket.BUCKETS.get(api_key)
+            if bucket is None:
+                bucket = TokenBucket.BUCKETS[api_key] = TokenBucket(rate, burst)
+            return bucket
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """
+        Takes a token, sleeping until one is available.
+        @return: The time in seconds spent waiting
+        """
+        with self._lock:
+            self._refill(time.time())
+            self.tokens -= 1
+            self.requests += 1
+            if self.tokens >= 0:
+                return 0.0
+            wait = -self.tokens / self.rate
+            self.delayed += 1
+            self.waiting += 1
+        time.sleep(wait)
+        with self._lock:
+            self.waiting -= 1
+            self.wait_time += wait
+            self.max_wait = max(self.max_wait, wait)
+        return wait
+
+    def penalize(self, seconds):
+        """
+        Stops handing out tokens for a while, eg. after last.fm reports
+        that the rate limit was exceeded.
+        @param seconds: How long to pause for
+        """
+        with self._lock:
+            self._refill(time.time())
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    def stats(self):
+        """
+        @return: A dictionary of the bucket's counters
+        """
+        with self._lock:
+            average_wait = 0.0
+            if self.delayed:
+                average_wait = self.wait_time / self.delayed
+            return {"requests" : self.requests, "delayed" : self.delayed,
+                    "queue_depth" : self.waiting, "wait_time" : self.wait_time,
+                    "average_wait" : average_wait, "max_wait" : self.max_wait}
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+import hashlib
+import os
+import tempfile
+import threading
+import urllib
+import urlparse
+from error import LastfmError, LastfmParamError
+
+class ReplayTransport(object):
+    """
+    A transport that records last.fm responses to a directory of XML files,
+    or answers requests from them without touching the network. It can be
+    given to L{LastfmApiConnection} in place of an L{HTTPConnectionPool}.
+
+    Each response is stored as <method>.<hash>.xml, where the hash covers
+    the request parameters except the credentials (api_key, api_sig and
+    sk), so recordings can be replayed with any keys. When replaying, a
+    file named after the method alone, like those in tests/data, answers
+    any request for that method with no recording of its own.
+    """
+    MODES = ("record", "replay", "auto")
+    """record always makes the request and stores the response, replay never
+    does and auto only does when there is no recording"""
+    IGNORED_PARAMS = ("api_key", "api_sig", "sk")
+
+    def __init__(self, path, mode="replay", transport=None):
+        """
+        @param path: The directory holding the recorded responses
+        @param mode: One of L{MODES}
+        @param transport: (Optional) The transport that makes real requests
+        when recording, a new L{HTTPConnectionPool} is created if this is None
+        @raise LastfmParamError: if the mode is unknown
+        """
+        if mode not in ReplayTransport.MODES:
+            raise LastfmParamError("Unknown mode: %s" % mode)
+        if mode != "replay" and transport is None:
+            from transport import HTTPConnectionPool
+            transport = HTTPConnectionPool()
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.mode = mode
+        self.transport = transport
+        self.requests = 0
+        self.replayed = 0
+        self.recorded = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_name(method, url, body=None):
+        """
+        @param method: GET or POST
+        @param url: The full url of the request
+        @param body: (Optional) The encoded POST data
+        @return: The file name a response to this request is stored under
+        """
+        if method == "POST":
+            query = body or ""
+        else:
+            query = urlparse.urlsplit(url).query
+        params = sorted((key, value) for key, value in
+                        urlparse.parse_qsl(query, keep_blank_values=True)
+                        if key not in ReplayTransport.IGNORED_PARAMS)
+        api_method = dict(params).get("method", "unknown").replace("/", "_")
+        digest = hashlib.md5(urllib.urlencode(params)).hexdigest()[:16]
+        return "%s.%s.xml" % (api_method, digest)
+
+    def _load(self, name):
+        """
+        @return: The recorded body for a file name, falling back to the
+        file for the whole method, or None
+        """
+        for candidate in (name, name.rsplit(".", 2)[0]):
+            path = os.path.join(self.path, candidate)
+            if os.path.exists(path):
+                f = open(path, "rb")
+                try:
+                    return f.read()
+                finally:
+                    f.close()
+        return None
+
+    def _save(self, name, body):
+        #write then rename, so a reader never sees half a response. Each
+        #writer has its own temporary file, threads may record the same request
+        fd, temp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        f = os.fdopen(fd, "wb")
+        try:
+            f.write(body)
+        finally:
+            f.close()
+        os.rename(temp, os.path.join(self.path, name))
+
+    def request(self, method, url, body=None, timeout=None):
+        """
+        @param method: GET or POST
+        @param url: The full url to request
+        @param body: (Optional) The encoded POST data
+        @param timeout: (Optional) Passed on to the real transport
+        @raise LastfmError: if replaying and the request was never recorded
+        @return: A tuple of the HTTP status code and the response body,
+        replayed responses always have status 200
+        """
+        name = ReplayTransport.get_name(method, url, body)
+        with self._lock:
+            self.requests += 1
+        if self.mode != "record":
+            recorded = self._load(name)
+            if recorded is not None:
+                with self._lock:
+                    self.replayed += 1
+                return 200, recorded
+            if self.mode == "replay":
+                raise LastfmError("No recorded response for %s" % name)
+        status, response = self.transport.request(method, url, body, timeout)
+        if status == 200:
+            self._save(name, response)
+            with self._lock:
+                self.recorded += 1
+        return status, response
+
+    def close(self):
+        if self.transport is not None and hasattr(self.transport, "close"):
+            self.transport.close()
+
+    def stats(self):
+        """
+        @return: A dictionary of request counters
+        """
+        with self._lock:
+            return {"requests" : self.requests, "replayed" : self.replayed,
+                    "recorded" : self.recorded}
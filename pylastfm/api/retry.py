@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+import httplib
+import random
+import socket
+import threading
+import time
+
+class RetryPolicy(object):
+    """
+    Decides which failed requests are retried and how long to wait between
+    attempts. Delays grow exponentially with full jitter, and retries are
+    paid for from a budget that is topped up by each request, so a failing
+    service sees only a small fraction of extra traffic.
+    """
+    RETRYABLE_CODES = (11, 16, 29)
+    """Last.fm error codes for service offline, temporarily unavailable and
+    rate limit exceeded. The request was not processed, so it is always safe
+    to send it again"""
+
+    def __init__(self, max_attempts=4, base_delay=0.5, max_delay=30,
+                 budget_ratio=0.1, max_budget=10):
+        """
+        @param max_attempts: The most times a single request is sent
+        @param base_delay: The delay in seconds before the first retry
+        @param max_delay: The longest delay in seconds between attempts
+        @param budget_ratio: How many retries each request earns
+        @param max_budget: The most retries the budget can hold, it starts full
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget_ratio = budget_ratio
+        self.max_budget = max_budget
+        self.budget = float(max_budget)
+        self.retries = 0
+        self.exhausted = 0
+        """How many retries were refused because the budget was empty"""
+        self._lock = threading.Lock()
+
+    def get_delay(self, attempt):
+        """
+        @param attempt: The number of attempts made so far
+        @return: A random delay of up to base_delay * 2^(attempt - 1) seconds
+        """
+        ceiling = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(0, ceiling)
+
+    def is_retryable(self, status, error_code, idempotent):
+        """
+        @param status: The HTTP status of the response
+        @param error_code: The last.fm error code of the response, or None
+        @param idempotent: Whether sending the request twice is harmless
+        @return: True if the request should be sent again
+        """
+        if error_code is not None:
+            return error_code in RetryPolicy.RETRYABLE_CODES
+        return status >= 500 and idempotent
+
+    def _spend(self):
+        """
+        @return: True if the budget allows another retry
+        """
+        with self._lock:
+            if self.budget < 1:
+                self.exhausted += 1
+                return False
+            self.budget -= 1
+            self.retries += 1
+            return True
+
+    def call(self, send, get_error_code, idempotent=True):
+        """
+        Sends a request, retrying it while it fails in a retryable way.
+        @param send: A function that sends the request and returns a tuple of
+        (status, body)
+        @param get_error_code: A function returning the last.fm error code of
+        a body, or None
+        @param idempotent: Whether sending the request twice is harmless.
+        Requests that aren't are only retried when last.fm says it didn't
+        process them
+        @return: The last (status, body) received
+        """
+        with self._lock:
+            self.budget = min(self.budget + self.budget_ratio, self.max_budget)
+        attempt = 1
+        while True:
+            try:
+                status, body = send()
+            except (socket.error, httplib.HTTPException):
+                if not idempotent or attempt >= self.max_attempts or \
+                   not self._spend():
+                    raise
+            else:
+                if attempt >= self.max_attempts or \
+                   not self.is_retryable(status, get_error_code(body), idempotent) or \
+                   not self._spend():
+                    return status, body
+            time.sleep(self.get_delay(attempt))
+            attempt += 1
+
+    def stats(self):
+        """
+        @return: A dictionary of retry counters
+        """
+        with self._lock:
+            return {"retries" : self.retries, "exhausted" : self.exhausted,
+                    "budget" : self.budget}
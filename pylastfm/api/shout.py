@@ -3,4 +3,18 @@
 from _basetype import AbstractType
 
 class Shout(AbstractType):
-    pass
\ No newline at end of file
+    ROOT_NODE = "shout"
+    __slots__ = ("body", "author", "date")
+
+    def __init__(self, etree):
+        """
+        @param etree: An ElementTree that is the data of a
+        single shout on last.fm
+        """
+        self.body = None
+        self.author = None
+        """The name of the user who made this shout"""
+        self.date = None
+        """Date string in the form of Sat, 7 Feb 2009 12:30:00"""
+
+        self._parse_etree(etree)
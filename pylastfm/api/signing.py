@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+from hashlib import md5
+
+class RequestSigner(object):
+    """
+    Creates api signatures: the md5 of the parameters sorted by name,
+    concatenated as <name><value>, followed by the secret. The parameters
+    are sorted once, and the sorted pairs are both what is signed and the
+    key signatures are remembered by, so repeated requests, eg. polling,
+    are only hashed once.
+    When max_entries are remembered they are all forgotten, which is much
+    cheaper than keeping them in recently used order. Nothing is locked,
+    single dictionary operations are atomic and a lost entry is only signed
+    again, so the hit and miss counters are approximate under concurrent use.
+    """
+    def __init__(self, api_key, secret, max_entries=1024):
+        """
+        @param api_key: The api key provided by last.fm for your application
+        @param secret: The secret key provided by last.fm
+        @param max_entries: The number of signatures to remember
+        """
+        self._api_key = api_key
+        self.secret = _to_utf8(secret)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._signatures = {}
+
+    def sign(self, params):
+        """
+        @param params: A dictionary of request parameters, including method
+        and sk. Parameters set to None are not sent, so they aren't signed,
+        and api_key is always the signer's
+        @return: The api_sig for these parameters
+        """
+        if params.get("api_key") != self._api_key:
+            params = dict(params, api_key=self._api_key)
+        #the sorted items are both the memo key and what is signed on a miss
+        items = params.items()
+        items.sort()
+        if "api_sig" in params:
+            items = [item for item in items if item[0] != "api_sig"]
+        key = tuple(items)
+        signatures = self._signatures
+        try:
+            signature = signatures.get(key)
+        except TypeError:
+            #unhashable values can't be remembered
+            return self._sign(items)
+        if signature is not None:
+            self.hits += 1
+            return signature
+        self.misses += 1
+        try:
+            #plain strings are joined in one go, None and other types raise
+            #and are converted one by one
+            data = "".join([name + value for name, value in items]) + self.secret
+            if data.__class__ is not str:
+                data = data.encode("UTF-8")
+            signature = md5(data).hexdigest()
+        except (TypeError, UnicodeError):
+            signature = self._sign(items)
+        if len(signatures) >= self.max_entries:
+            #start over rather than track recency on every hit
+            signatures.clear()
+        signatures[key] = signature
+        return signature
+
+    def _sign(self, items):
+        """
+        Signs parameters that aren't all strings
+        @param items: The (name, value) pairs sorted by name, without api_sig
+        """
+        return md5("".join(_canonical(items)) + self.secret).hexdigest()
+
+    def stats(self):
+        """
+        @return: A dictionary of memoization counters
+        """
+        return {"hits" : self.hits, "misses" : self.misses,
+                "entries" : len(self._signatures)}
+
+
+def _canonical(items):
+    """
+    @param items: Sorted (name, value) pairs
+    @return: A list of alternating utf8 encoded names and values, without
+    the parameters set to None
+    """
+    data = []
+    for name, value in items:
+        if value is None:
+            continue
+        data.append(name)
+        data.append(_to_utf8(value))
+    return data
+
+def _to_utf8(value):
+    if isinstance(value, unicode):
+        return value.encode("UTF-8")
+    return str(value)
@@ -3,4 +3,15 @@
 from _basetype import AbstractType
 
 class Station(AbstractType):
-    pass
\ No newline at end of file
+    ROOT_NODE = "station"
+    __slots__ = ("name", "url")
+
+    def __init__(self, etree):
+        """
+        @param etree: An ElementTree that is the data of a
+        single station on last.fm
+        """
+        self.name = None
+        self.url = None
+
+        self._parse_etree(etree)
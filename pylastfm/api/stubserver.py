@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+"""
+A local stand in for the last.fm web service, for benchmarks and load tests
+that must not touch the network. Run this module to serve on a fixed port:
+
+    python stubserver.py 8080 --latency 0.05
+"""
+import BaseHTTPServer
+import SocketServer
+import hashlib
+import random
+import threading
+import time
+import urlparse
+from xml.sax.saxutils import escape, quoteattr
+from error import LastfmError
+from replay import ReplayTransport
+
+def _seed(*values):
+    """@return: A number derived from values, the same on every run"""
+    return int(hashlib.md5("\0".join(values)).hexdigest()[:8], 16)
+
+def _mbid(name):
+    digest = hashlib.md5(name).hexdigest()
+    return "%s-%s-%s-%s-%s" % (digest[:8], digest[8:12], digest[12:16],
+                               digest[16:20], digest[20:32])
+
+
+class StubLastfmServer(object):
+    """
+    Serves generated, Last.fm shaped XML over HTTP/1.1 with keep-alive.
+    Responses are the same for the same parameters, so runs can be
+    compared, and paged methods have as many pages as configured. Any
+    request can be delayed, and chosen methods, or a random fraction of all
+    requests, can fail with a last.fm error code. POST requests always
+    succeed unless they are made to fail.
+
+    Give the url to a connection with C{conn.URL = server.url}.
+    """
+    BASE_UTS = 1234567890
+    """The timestamp of the newest generated track"""
+    ERROR_STATUS = {11 : 503, 16 : 503, 29 : 429}
+    """HTTP status codes of errors, any others are sent with 400"""
+    ERROR_MESSAGES = {3 : "Invalid Method - No method with that name in this package",
+                      6 : "Invalid parameters - Your request is missing a required parameter",
+                      11 : "Service Offline - This service is temporarily offline",
+                      16 : "There was a temporary error processing your request",
+                      29 : "Rate Limit Exceded - Your IP has made too many requests"}
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0, errors=None,
+                 error_rate=0.0, error_code=16, pages=1, per_page=50,
+                 responses=None):
+        """
+        @param host: The address to listen on
+        @param port: The port to listen on, 0 picks a free one
+        @param latency: The delay in seconds before each response, or a tuple
+        of the shortest and longest delay
+        @param errors: (Optional) A dictionary of api method names to the
+        error code they always fail with
+        @param error_rate: The fraction of other requests that fail with
+        error_code
+        @param error_code: The last.fm error code of random failures
+        @param pages: The number of pages every paged method has
+        @param per_page: The number of items on a page when no limit is given
+        @param responses: (Optional) A directory of responses recorded by
+        L{ReplayTransport}, served instead of generated ones when they exist
+        """
+        self.latency = latency
+        self.errors = errors or {}
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.pages = pages
+        self.per_page = per_page
+        self.responses = None
+        if responses is not None:
+            self.responses = ReplayTransport(responses, "replay")
+        self.requests = 0
+        self.failed = 0
+        """How many requests were answered with an error"""
+        self.methods = {}
+        """The number of requests for each api method"""
+        self._random = random.Random(0)
+        self._lock = threading.Lock()
+        self.server = _Server((host, port), _Handler)
+        self.server.stub = self
+        self.url = "http://%s:%d/2.0/" % self.server.server_address
+        self._thread = None
+
+    def start(self):
+        """
+        Starts serving on a background thread
+        @return: The url to send api requests to
+        """
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        """Stops serving and closes the listening socket"""
+        if self._thread is not None:
+            self.server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server.server_close()
+
+    def stats(self):
+        """
+        @return: A dictionary of request counters
+        """
+        with self._lock:
+            return {"requests" : self.requests, "failed" : self.failed,
+                    "methods" : dict(self.methods)}
+
+    def _get_delay(self):
+        if isinstance(self.latency, tuple):
+            with self._lock:
+                return self._random.uniform(*self.latency)
+        return self.latency
+
+    def respond(self, http_method, path, query):
+        """
+        @param http_method: GET or POST
+        @param path: The request path including the query string
+        @param query: The encoded parameters
+        @return: A tuple of the HTTP status and the response body
+        """
+        params = dict(urlparse.parse_qsl(query, keep_blank_values=True))
+        method = params.get("method", "")
+        with self._lock:
+            self.requests += 1
+            self.methods[method] = self.methods.get(method, 0) + 1
+            code = self.errors.get(method)
+            if code is None and self.error_rate and \
+               self._random.random() < self.error_rate:
+                code = self.error_code
+            if code is not None:
+                self.failed += 1
+        if code is not None:
+            return self._error(code)
+        if self.responses is not None:
+            try:
+                return self.responses.request(http_method, path, query)
+            except LastfmError:
+                #not recorded, generate one
+                pass
+        if http_method == "POST":
+            return 200, '<?xml version="1.0" encoding="utf-8"?>\n<lfm status="ok">\n</lfm>'
+        generate = _GENERATORS.get(method.lower())
+        if generate is None:
+            with self._lock:
+                self.failed += 1
+            return self._error(3)
+        try:
+            body = generate(self, params)
+        except (KeyError, ValueError):
+            with self._lock:
+                self.failed += 1
+            return self._error(6)
+        return 200, '<?xml version="1.0" encoding="utf-8"?>\n' \
+                    '<lfm status="ok">\n%s</lfm>' % body
+
+    def _error(self, code):
+        message = StubLastfmServer.ERROR_MESSAGES.get(code, "Error")
+        return StubLastfmServer.ERROR_STATUS.get(code, 400), \
+               '<?xml version="1.0" encoding="utf-8"?>\n<lfm status="failed">\n' \
+               '<error code="%d">%s</error></lfm>' % (code, message)
+
+    def _page(self, params):
+        """
+        @return: A tuple of the page number, the items per page and the
+        indexes of the items on the page, pages past the last are empty
+        """
+        page = max(1, int(params.get("page") or 1))
+        limit = int(params.get("limit") or self.per_page)
+        if page > self.pages:
+            return page, limit, []
+        return page, limit, range((page - 1) * limit, page * limit)
+
+    def _paged(self, tag, attributes, items, page, limit):
+        attributes = "".join(' %s=%s' % (key, quoteattr(str(value)))
+                             for key, value in attributes)
+        return '<%s%s page="%d" perPage="%d" totalPages="%d" total="%d">\n%s</%s>\n' % (
+            tag, attributes, page, limit, self.pages, self.pages * limit,
+            "".join(items), tag)
+
+
+def _track(user, index):
+    """A track played by user, index 0 being the most recent"""
+    seed = _seed(user, str(index))
+    artist = "Artist %d" % (seed % 500)
+    name = "Track %d" % (seed % 5000)
+    uts = StubLastfmServer.BASE_UTS - index * 240
+    return ('<track>\n\t<artist mbid="%s">%s</artist>\n\t<name>%s</name>\n'
+            '\t<streamable>0</streamable>\n\t<mbid></mbid>\n'
+            '\t<album mbid="">Album %d</album>\n'
+            '\t<url>http://www.last.fm/music/%s/_/%s</url>\n'
+            '\t<date uts="%d">%s</date>\n</track>\n') % (
+        _mbid(artist), artist, name, seed % 1000, artist.replace(" ", "+"),
+        name.replace(" ", "+"), uts,
+        time.strftime("%d %b %Y, %H:%M", time.gmtime(uts)))
+
+def _loved_track(user, index):
+    """A track loved by user, loved tracks nest their artist and have no album"""
+    seed = _seed(user + "\0loved", str(index))
+    artist = "Artist %d" % (seed % 500)
+    name = "Track %d" % (seed % 5000)
+    uts = StubLastfmServer.BASE_UTS - index * 240
+    url = "http://www.last.fm/music/%s" % artist.replace(" ", "+")
+    return ('<track>\n\t<name>%s</name>\n\t<mbid></mbid>\n'
+            '\t<url>%s/_/%s</url>\n\t<date uts="%d">%s</date>\n'
+            '\t<artist>\n\t\t<name>%s</name>\n\t\t<mbid>%s</mbid>\n'
+            '\t\t<url>%s</url>\n\t</artist>\n'
+            '\t<streamable fulltrack="0">0</streamable>\n</track>\n') % (
+        name, url, name.replace(" ", "+"), uts,
+        time.strftime("%d %b %Y, %H:%M", time.gmtime(uts)), artist,
+        _mbid(artist), url)
+
+def _user_getinfo(stub, params):
+    user = params["user"]
+    return ('<user>\n\t<id>%d</id>\n\t<name>%s</name>\n'
+            '\t<url>http://www.last.fm/user/%s</url>\n'
+            '\t<playcount>%d</playcount>\n\t<subscriber>0</subscriber>\n'
+            '\t<registered unixtime="1178554666">2007-05-07 16:17</registered>\n'
+            '</user>') % (_seed(user) % 10000000, escape(user), escape(user),
+                          stub.pages * stub.per_page)
+
+def _user_getrecenttracks(stub, params):
+    user = params["user"]
+    page, limit, indexes = stub._page(params)
+    tracks = [_track(user, i) for i in indexes]
+    return stub._paged("recenttracks", [("user", user)], tracks, page, limit)
+
+def _user_getlovedtracks(stub, params):
+    user = params["user"]
+    page, limit, indexes = stub._page(params)
+    tracks = [_loved_track(user, i) for i in indexes]
+    return stub._paged("lovedtracks", [("user", user)], tracks, page, limit)
+
+def _artist_getinfo(stub, params):
+    name = params["artist"]
+    seed = _seed(name)
+    return ('<artist>\n\t<name>%s</name>\n\t<mbid>%s</mbid>\n'
+            '\t<url>http://www.last.fm/music/%s</url>\n\t<streamable>1</streamable>\n'
+            '\t<stats>\n\t\t<listeners>%d</listeners>\n\t\t<playcount>%d</playcount>\n'
+            '\t</stats>\n</artist>') % (escape(name), _mbid(name),
+                                        escape(name.replace(" ", "+")),
+                                        seed % 100000, seed % 1000000)
+
+def _artist_getsimilar(stub, params):
+    """Every artist has limit similar artists, with falling match scores"""
+    name = params["artist"]
+    limit = int(params.get("limit") or stub.per_page)
+    artists = []
+    for i in range(limit):
+        similar = "Artist %d" % (_seed(name, str(i)) % 500)
+        artists.append('<artist>\n\t<name>%s</name>\n\t<mbid>%s</mbid>\n'
+                       '\t<match>%.4f</match>\n'
+                       '\t<url>http://www.last.fm/music/%s</url>\n</artist>\n' % (
+            escape(similar), _mbid(similar), 1.0 - float(i) / (limit + 1),
+            similar.replace(" ", "+")))
+    return '<similarartists artist=%s>\n%s</similarartists>\n' % (
+        quoteattr(name), "".join(artists))
+
+def _artist_gettoptags(stub, params):
+    """Every artist has five tags, most used first"""
+    name = params["artist"]
+    tags = []
+    for i in range(5):
+        tag = "tag %d" % (_seed(name, "tag", str(i)) % 50)
+        tags.append('<tag>\n\t<name>%s</name>\n\t<count>%d</count>\n'
+                    '\t<url>http://www.last.fm/tag/%s</url>\n</tag>\n' % (
+            escape(tag), 100 - i * 20, tag.replace(" ", "+")))
+    return '<toptags artist=%s>\n%s</toptags>\n' % (quoteattr(name), "".join(tags))
+
+_GENERATORS = {"user.getinfo" : _user_getinfo,
+               "user.getrecenttracks" : _user_getrecenttracks,
+               "user.getlovedtracks" : _user_getlovedtracks,
+               "artist.getinfo" : _artist_getinfo,
+               "artist.getsimilar" : _artist_getsimilar,
+               "artist.gettoptags" : _artist_gettoptags}
+"""Api methods the stub can answer, by lower case name"""
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    wbufsize = -1
+    """Send each response in one write, headers written a line at a time
+    meet the client's delayed ACK and add 40ms to every request"""
+
+    def do_GET(self):
+        self._respond("GET", urlparse.urlsplit(self.path).query)
+
+    def do_POST(self):
+        length = int(self.headers.getheader("Content-Length") or 0)
+        self._respond("POST", self.rfile.read(length))
+
+    def _respond(self, http_method, query):
+        stub = self.server.stub
+        delay = stub._get_delay()
+        if delay:
+            time.sleep(delay)
+        status, body = stub.respond(http_method, self.path, query)
+        self.send_response(status)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+if __name__ == "__main__":
+    import optparse
+    parser = optparse.OptionParser(usage="%prog [options] [port]")
+    parser.add_option("--latency", type="float", default=0)
+    parser.add_option("--error-rate", type="float", default=0.0)
+    parser.add_option("--error-code", type="int", default=16)
+    parser.add_option("--pages", type="int", default=1)
+    parser.add_option("--responses", help="A directory of recorded responses")
+    options, args = parser.parse_args()
+    port = 8080
+    if args:
+        port = int(args[0])
+    stub = StubLastfmServer(port=port, latency=options.latency,
+                            error_rate=options.error_rate,
+                            error_code=options.error_code, pages=options.pages,
+                            responses=options.responses)
+    print "Serving on", stub.url
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        stub.server.server_close()
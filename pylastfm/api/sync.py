@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+import sqlite3
+import threading
+import time
+from xml.etree import ElementTree
+from error import LastfmError
+from track import Track
+
+class RecentTracksSync(object):
+    """
+    Keeps a local copy of users' listening histories up to date. Each user
+    has a checkpoint, the timestamp of the newest track stored, and a sync
+    only downloads tracks played since then.
+
+    Pages are stored oldest first, each in a single transaction along with
+    the new checkpoint, so a sync that is interrupted resumes where it
+    stopped. The end of the range is fixed when a sync starts, so tracks
+    scrobbled during it don't shift tracks between pages.
+
+    Users can be synced from several threads at once. They share one
+    connection, so transactions are serialized by a lock, while pages are
+    downloaded in parallel.
+    """
+
+    def __init__(self, conn, path, limit=200):
+        """
+        @param conn: A L{LastfmApiConnection}
+        @param path: The path of the sqlite database holding the histories
+        @param limit: The number of tracks fetched per page, the maximum is 200
+        """
+        self.conn = conn
+        self.limit = limit
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS checkpoints ("
+                        "user TEXT PRIMARY KEY, uts INTEGER)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS scrobbles ("
+                        "user TEXT, uts INTEGER, artist TEXT, name TEXT, "
+                        "album TEXT, mbid TEXT, "
+                        "PRIMARY KEY (user, uts, artist, name))")
+        self.db.commit()
+        self._lock = threading.Lock()
+
+    def get_checkpoint(self, user):
+        """
+        @param user: A last.fm username
+        @return: The timestamp of the newest track stored for this user, or None
+        """
+        with self._lock:
+            row = self.db.execute("SELECT uts FROM checkpoints WHERE user = ?",
+                                  (user,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def sync(self, user):
+        """
+        Downloads and stores every track the user has played since the last sync.
+        @param user: A last.fm username
+        @raise LastfmError: if last.fm returned an error, tracks already stored
+        are kept
+        @return: The number of new tracks stored
+        """
+        checkpoint = self.get_checkpoint(user)
+        _from = None
+        if checkpoint is not None:
+            #from is inclusive, the track at the checkpoint is fetched again
+            #and ignored
+            _from = checkpoint
+        to = int(time.time())
+        total_pages, newest = self._fetch_page(user, 1, _from, to)
+        added = 0
+        for page in range(total_pages, 1, -1):
+            added += self._store(user, self._fetch_page(user, page, _from, to)[1])
+        added += self._store(user, newest)
+        return added
+
+    def _fetch_page(self, user, page, _from, to):
+        """
+        @return: A tuple of the total number of pages and the tracks on this page
+        """
+        body = self.conn._api_get_request(user=user, limit=self.limit, page=page,
+                                          to=to, method="user.getRecentTracks",
+                                          **{"from" : _from}).read()
+        root = ElementTree.fromstring(body)
+        if root.get("status") != "ok":
+            raise LastfmError(root.findtext("error"))
+        total_pages = 1
+        if len(root):
+            total_pages = int(root[0].get("totalPages", 1))
+        return total_pages, [Track(node) for node in root.getiterator(Track.ROOT_NODE)]
+
+    def _store(self, user, tracks):
+        """
+        Stores a page of tracks and moves the checkpoint forward in one
+        transaction. The track playing now has no timestamp and is skipped.
+        @return: The number of tracks that weren't already stored
+        """
+        rows = [(user, track.date_uts, track.artist, track.name, track.album,
+                 track.mbid) for track in tracks if track.date_uts is not None]
+        if not rows:
+            return 0
+        newest = max(row[1] for row in rows)
+        with self._lock, self.db:
+            before = self.db.total_changes
+            self.db.executemany("INSERT OR IGNORE INTO scrobbles "
+                                "VALUES (?, ?, ?, ?, ?, ?)", rows)
+            added = self.db.total_changes - before
+            self.db.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, "
+                            "MAX(?, COALESCE((SELECT uts FROM checkpoints "
+                            "WHERE user = ?), 0)))", (user, newest, user))
+        return added
+
+    def iter_tracks(self, user, since=None):
+        """
+        @param user: A last.fm username
+        @param since: (Optional) Only return tracks played after this timestamp
+        @return: A generator of (uts, artist, name, album, mbid) tuples, oldest first
+        """
+        with self._lock:
+            return self.db.execute("SELECT uts, artist, name, album, mbid FROM scrobbles "
+                                   "WHERE user = ? AND uts > ? ORDER BY uts",
+                                   (user, since or 0))
+
+    def close(self):
+        self.db.close()
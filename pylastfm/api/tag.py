@@ -3,4 +3,18 @@
 from _basetype import AbstractType
 
 class Tag(AbstractType):
-    pass
\ No newline at end of file
+    ROOT_NODE = "tag"
+    __slots__ = ("name", "url", "count")
+    int_types = ("count",)
+
+    def __init__(self, etree):
+        """
+        @param etree: An ElementTree that is the data of a
+        single tag on last.fm
+        """
+        self.name = None
+        self.url = None
+        self.count = None
+        """How many times this tag has been applied"""
+
+        self._parse_etree(etree)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+from cStringIO import StringIO
+from _basetype import AbstractType, AbstractMethod
+from album import AlbumMethod
+from artist import ArtistMethod
+from connection import _get_error_code, _is_ok_response
+from tag import Tag
+from track import TrackMethod
+from error import LastfmError, LastfmParamError
+from pool import map_calls
+
+class TagResult(object):
+    """What L{BulkTagger} did to one item"""
+    __slots__ = ("item", "added", "removed", "failed", "error")
+
+    def __init__(self, item):
+        self.item = item
+        """The item as it was given"""
+        self.added = []
+        """The tags that were added"""
+        self.removed = []
+        """The tags that were removed"""
+        self.failed = []
+        """The tags that should have been added or removed but weren't"""
+        self.error = None
+        """The first exception raised for this item, or None"""
+
+    @property
+    def ok(self):
+        """True if every change was made"""
+        return self.error is None
+
+    def __repr__(self):
+        return "<TagResult %r added=%r removed=%r failed=%r>" % (
+            self.item, self.added, self.removed, self.failed)
+
+
+class BulkTagger(object):
+    """
+    Applies tags to many artists, albums and tracks. Each item's tags are
+    compared with the ones the user has already applied, so only the
+    changes are posted, additions in calls of up to 10 tags. Items are
+    worked on concurrently; the connection's rate limit still applies to
+    every request. Requires authentication.
+
+    Items are tuples of ("artist", artist), ("album", artist, album) or
+    ("track", artist, track), where names can be strings or objects.
+    """
+    MODES = ("set", "add", "remove")
+    """set makes an item's tags exactly those given, add only adds the
+    missing ones and remove only removes the given ones"""
+
+    def __init__(self, conn, workers=10):
+        """
+        @param conn: A L{LastfmApiConnection} with a session
+        @param workers: The number of items worked on at once
+        """
+        self.conn = conn
+        self.workers = workers
+        self._album = AlbumMethod(conn)
+        self._track = TrackMethod(conn)
+
+    def retag(self, items, mode="set", ordered=True):
+        """
+        @param items: An iterable of (item, tags) pairs, where tags is a list of
+        any length of strings or L{Tag} objects
+        @param mode: One of L{MODES}
+        @param ordered: Whether results are returned in the order of items,
+        rather than as each item is finished
+        @raise LastfmParamError: if the mode is unknown
+        @return: A generator of L{TagResult} objects
+        """
+        if mode not in BulkTagger.MODES:
+            raise LastfmParamError("Unknown mode: %s" % mode)
+        calls = ((self._retag_item, (item, tags, mode)) for item, tags in items)
+        for result in map_calls(calls, self.workers, ordered):
+            yield result.value
+
+    def _retag_item(self, item, tags, mode):
+        """
+        Works on a single item. Errors are kept in the result rather than
+        raised so the other items carry on.
+        """
+        result = TagResult(item)
+        try:
+            kind, artist, name = self._unpack(item)
+            wanted = _unique(self._get_name(tag) for tag in tags)
+            current = self._get_tags(kind, artist, name)
+        except Exception, e:
+            result.error = e
+            return result
+        current_names = set(tag.lower() for tag in current)
+        wanted_names = set(tag.lower() for tag in wanted)
+        if mode == "remove":
+            add = []
+            remove = [tag for tag in current if tag.lower() in wanted_names]
+        else:
+            add = [tag for tag in wanted if tag.lower() not in current_names]
+            remove = []
+            if mode == "set":
+                remove = [tag for tag in current if tag.lower() not in wanted_names]
+        size = AbstractMethod.MAX_ITEMS
+        for chunk in [add[i:i + size] for i in range(0, len(add), size)]:
+            self._apply(result, result.added, chunk, self._add_tags, kind, artist, name)
+        for tag in remove:
+            self._apply(result, result.removed, [tag], self._remove_tag,
+                        kind, artist, name)
+        return result
+
+    def _apply(self, result, done, tags, post, *args):
+        try:
+            post(*(args + (tags,)))
+        except Exception, e:
+            result.failed.extend(tags)
+            if result.error is None:
+                result.error = e
+        else:
+            done.extend(tags)
+
+    def _unpack(self, item):
+        """
+        @return: A tuple of the kind, artist name and album or track name
+        """
+        kind = item[0]
+        if kind == "artist" and len(item) == 2:
+            return kind, self._get_name(item[1]), None
+        if kind in ("album", "track") and len(item) == 3:
+            return kind, self._get_name(item[1]), self._get_name(item[2])
+        raise LastfmParamError("Can't tag %r" % (item,))
+
+    def _get_name(self, obj):
+        if isinstance(obj, AbstractType):
+            return obj.name
+        return obj
+
+    def _get_tags(self, kind, artist, name):
+        """
+        Makes the same request as the getTags methods, but raises on errors
+        rather than returning no tags, which would be taken as nothing to remove
+        @raise LastfmError: if last.fm returned an error
+        @return: The names of the tags the user has applied to the item
+        """
+        user = self.conn.username
+        if user is None:
+            raise LastfmError("Username not set")
+        params = {"artist" : artist, "user" : user, "method" : kind + ".getTags"}
+        if kind != "artist":
+            params[kind] = name
+        body = self.conn._api_get_request(**params).read()
+        if not _is_ok_response(body):
+            raise LastfmError("%s.getTags failed, error %s" % (kind,
+                                                              _get_error_code(body)))
+        tags = self.conn.create_objects(StringIO(body), Tag)
+        if isinstance(tags, AbstractType):
+            tags = [tags]
+        return [tag.name for tag in tags]
+
+    def _add_tags(self, kind, artist, name, tags):
+        if kind == "artist":
+            return ArtistMethod(self.conn, artist).addTags(tags)
+        if kind == "album":
+            return self._album.addTags(artist, name, tags)
+        return self._track.addTags(artist, name, tags)
+
+    def _remove_tag(self, kind, artist, name, tags):
+        if kind == "artist":
+            return ArtistMethod(self.conn, artist).removeTag(tags[0])
+        if kind == "album":
+            return self._album.removeTag(artist, name, tags[0])
+        return self._track.removeTag(artist, name, tags[0])
+
+
+def _unique(tags):
+    """
+    @return: The tags without repeats, ignoring case, in their first order
+    """
+    seen = set()
+    unique = []
+    for tag in tags:
+        if tag.lower() not in seen:
+            seen.add(tag.lower())
+            unique.append(tag)
+    return unique
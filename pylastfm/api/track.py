@@ -2,11 +2,52 @@
 
 from _basetype import AbstractType, AbstractMethod
 from error import LastfmAuthenticationError, LastfmError, LastfmParamError
+from tag import Tag
 
 class Track(AbstractType):
     ROOT_NODE = "track"
-    def __init__(self):
-        pass      
+    __slots__ = ("name", "mbid", "url", "streamable", "artist", "artist_mbid",
+                 "album", "album_mbid", "image", "date", "date_uts",
+                 "track_nowplaying", "track_rank", "playcount", "listeners",
+                 "duration", "loved", "match")
+    int_types = ("date_uts", "track_rank", "playcount", "listeners", "duration")
+    bool_types = ("streamable", "track_nowplaying", "loved")
+    float_types = ("match",)
+
+    def __init__(self, etree):
+        """
+        @param etree: An ElementTree that is the data of a
+        single track on last.fm
+        """
+        self.name = None
+        self.mbid = None
+        """The musicbrainz id of this track"""
+        self.url = None
+        self.streamable = None
+        self.artist = None
+        """The name of the artist"""
+        self.artist_mbid = None
+        self.album = None
+        """The name of the album"""
+        self.album_mbid = None
+        self.image = None
+        self.date = None
+        """Date string in the form of 12 Jan 2009, 14:20"""
+        self.date_uts = None
+        """When this track was played as a unix timestamp"""
+        self.track_nowplaying = None
+        """True if the user is listening to this track right now"""
+        self.track_rank = None
+        """How this track ranks against others in a chart"""
+        self.playcount = None
+        self.listeners = None
+        self.duration = None
+        """The length of this track in milliseconds"""
+        self.loved = None
+        self.match = None
+        """How similar this track is to another, from 0 to 1"""
+
+        self._parse_etree(etree)
 
 
 class TrackMethod(AbstractMethod):
@@ -22,7 +63,11 @@ class TrackMethod(AbstractMethod):
         @param tags: (Required) A list of user supplied tags to
         apply to this track. Accepts a maximum of 10 tags.
         """
-        pass
+        artist = self._get_attribute(artist)
+        track = self._get_attribute(track)
+        tags = self._create_comma_delimited_string(tags)
+        return self.conn._api_post_request(artist=artist, track=track, tags=tags,
+                                           method="track.addTags")
     
     def ban(self, track, artist):
         """
@@ -50,12 +95,43 @@ class TrackMethod(AbstractMethod):
         """
         pass
     
+    def getTags(self, artist, track, user=None):
+        """
+        Get the tags applied by an individual user to a track on Last.fm.
+        @param artist: (Required) The artist name or an L{Artist} object
+        @param track: (Required) The track name or a L{Track} object
+        @param user: (Optional) The user whose tags are wanted, as a string or
+        L{User} object. Without it authentication is required
+        @return: A list of L{Tag} objects
+        """
+        artist = self._get_attribute(artist)
+        track = self._get_attribute(track)
+        if user is not None:
+            user = self._getUsername(user)
+        xml = self.conn._api_get_request(artist=artist, track=track, user=user,
+                                         method="track.getTags")
+        return self.conn.create_objects(xml, Tag)
+
+    def removeTag(self, artist, track, tag):
+        """
+        Remove a user's tag from a track. Authentication required.
+        @param artist: (Required) The artist name or an L{Artist} object
+        @param track: (Required) The track name or a L{Track} object
+        @param tag: (Required) A single user tag to remove from this track. Can
+        be a string or L{Tag} object
+        """
+        artist = self._get_attribute(artist)
+        track = self._get_attribute(track)
+        tag = self._get_attribute(tag)
+        return self.conn._api_post_request(artist=artist, track=track, tag=tag,
+                                           method="track.removeTag")
+
     def getSimilar(self, track=None, artist=None, mbid=None):
-Get the similar tracks for this track on Last.fm, based on listening data.
-
-e.g. http://ws.audioscrobbler.com/2.0/?method=track.getsimilar&artist=cher&track=believe&api_key=b25...
-Params
-track (Optional) : The track name in question
-artist (Optional) : The artist name in question
-mbid (Optional) : The musicbrainz id for the track
-    
\ No newline at end of file
+        """
+        Get the similar tracks for this track on Last.fm, based on listening data.
+        @param track: (Optional) The track name in question
+        @param artist: (Optional) The artist name in question
+        @param mbid: (Optional) The musicbrainz id for the track
+        @return: A list of L{Track} objects
+        """
+        pass
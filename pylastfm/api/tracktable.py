@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+import collections
+import heapq
+import itertools
+import mmap
+import struct
+import sys
+from array import array
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+from connection import _iter_nodes
+from error import LastfmError, LastfmParamError
+
+class TrackTable(object):
+    """
+    Holds a listening history as columns instead of L{Track} objects: a
+    timestamp, an artist, album and track name and flags for each row, at
+    17 bytes a row. Names are stored once in a string pool and the columns
+    hold their ids, id 0 means no name.
+
+    Tables are filled straight from getRecentTracks or getLovedTracks
+    responses with L{feed}, without building an object per track, and can
+    be saved to a binary file. Loading a file maps it and reads nothing:
+    each column is copied out of the mapping the first time it is used, and
+    the string pool is decoded the first time a name is needed.
+    """
+    LOVED = 1
+    STREAMABLE = 2
+
+    COLUMNS = (("uts", "I"), ("artist", "I"), ("album", "I"), ("name", "I"),
+               ("flags", "B"))
+    """The name and array type code of each column, in the order they are saved"""
+    MAGIC = "PLTT"
+    VERSION = 1
+    HEADER = struct.Struct("<4sBBxxIII")
+    """magic, version, whether the columns are little endian, the number of
+    rows, the number of strings and the size of the string pool in bytes"""
+
+    def __init__(self):
+        for column, typecode in TrackTable.COLUMNS:
+            setattr(self, column, array(typecode))
+        self._strings = [None]
+        self._string_ids = {None : 0}
+        self._map = None
+        self._mapped = {}
+
+    def __getattr__(self, attribute):
+        """Copies a column out of the mapped file the first time it is used"""
+        mapped = self.__dict__.get("_mapped")
+        if not mapped or attribute not in mapped:
+            raise AttributeError(attribute)
+        typecode, offset, size, swap = mapped.pop(attribute)
+        column = array(typecode)
+        column.fromstring(buffer(self._map, offset, size))
+        if swap:
+            column.byteswap()
+        setattr(self, attribute, column)
+        self._release()
+        return column
+
+    def __len__(self):
+        return len(self.uts)
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self.row(i)
+
+    def _get_strings(self):
+        if self._strings is None:
+            self._read_strings()
+        return self._strings
+
+    def _get_string_ids(self):
+        if self._string_ids is None:
+            self._string_ids = dict((string, i) for i, string
+                                    in enumerate(self._get_strings()))
+        return self._string_ids
+
+    def _intern(self, string):
+        """
+        @return: The id of a string, adding it to the pool if it is new
+        """
+        string_ids = self._string_ids
+        if string_ids is None:
+            string_ids = self._get_string_ids()
+        string_id = string_ids.get(string)
+        if string_id is None:
+            string_id = string_ids[string] = len(self._strings)
+            self._strings.append(string)
+        return string_id
+
+    def get_string(self, string_id):
+        """
+        @param string_id: An id from the artist, album or name column
+        @return: The name with that id, or None for id 0
+        """
+        return self._get_strings()[string_id]
+
+    def get_string_id(self, string):
+        """
+        @param string: An artist, album or track name
+        @return: The id of the name, or None if no row uses it
+        """
+        return self._get_string_ids().get(string)
+
+    def add(self, uts, artist, name, album=None, flags=0):
+        """
+        Appends a row
+        @param uts: When the track was played as a unix timestamp
+        @param artist: The artist name
+        @param name: The track name
+        @param album: (Optional) The album name
+        @param flags: (Optional) Any of L{LOVED} and L{STREAMABLE}
+        """
+        self.uts.append(uts)
+        self.artist.append(self._intern(artist))
+        self.album.append(self._intern(album))
+        self.name.append(self._intern(name))
+        self.flags.append(flags)
+
+    def feed(self, doc, flags=0):
+        """
+        Appends the tracks of a user.getRecentTracks or user.getLovedTracks
+        response as it is parsed. The track playing now has no timestamp
+        and is skipped.
+        @param doc: A file like object or the path of an XML document
+        @param flags: (Optional) Flags set on every row, eg. L{LOVED} when
+        feeding loved tracks
+        @raise LastfmError: if the response is an error
+        @return: The number of rows added
+        """
+        added = 0
+        for node in _iter_nodes(doc, ("track", "error"), ElementTree.iterparse):
+            if node.tag == "error":
+                raise LastfmError(node.text)
+            if self._add_node(node, flags):
+                added += 1
+        return added
+
+    def _add_node(self, node, flags):
+        """
+        @return: False if the track has no timestamp
+        """
+        uts = artist = name = album = None
+        for child in node:
+            tag = child.tag
+            if tag == "date":
+                uts = child.get("uts")
+            elif tag == "artist":
+                #extended and loved tracks nest the artist's name
+                artist = child.findtext("name") or child.text
+            elif tag == "name":
+                name = child.text
+            elif tag == "album":
+                album = child.text or None
+            elif tag == "streamable":
+                if child.text == "1":
+                    flags |= TrackTable.STREAMABLE
+            elif tag == "loved":
+                if child.text == "1":
+                    flags |= TrackTable.LOVED
+        if uts is None:
+            return False
+        self.add(int(uts), artist, name, album, flags)
+        return True
+
+    def row(self, i):
+        """
+        @return: A tuple of (uts, artist, album, name, flags)
+        """
+        strings = self._get_strings()
+        return (self.uts[i], strings[self.artist[i]], strings[self.album[i]],
+                strings[self.name[i]], self.flags[i])
+
+    def select(self, artist=None, album=None, name=None, since=None, until=None,
+               flags=0):
+        """
+        Finds the rows matching every condition given
+        @param artist: (Optional) An artist name
+        @param album: (Optional) An album name
+        @param name: (Optional) A track name
+        @param since: (Optional) Only rows played at or after this timestamp
+        @param until: (Optional) Only rows played before this timestamp
+        @param flags: (Optional) Only rows with all of these flags set
+        @return: An array of row numbers, in table order
+        """
+        conditions = []
+        for column, string in (("artist", artist), ("album", album), ("name", name)):
+            if string is not None:
+                string_id = self.get_string_id(string)
+                if string_id is None:
+                    return array("I")
+                conditions.append((getattr(self, column), string_id))
+        if not conditions and since is None and until is None and not flags:
+            return array("I", xrange(len(self)))
+        rows = array("I")
+        #one name column is scanned, the other conditions are only checked
+        #for the rows it matches
+        if conditions:
+            column, string_id = conditions.pop(0)
+            candidates = (i for i, value in enumerate(column) if value == string_id)
+        else:
+            candidates = xrange(len(self))
+        uts = self.uts
+        since = since or 0
+        if until is None:
+            until = 2 ** 32
+        flag_column = self.flags
+        for i in candidates:
+            if not since <= uts[i] < until:
+                continue
+            if flags and flag_column[i] & flags != flags:
+                continue
+            for column, string_id in conditions:
+                if column[i] != string_id:
+                    break
+            else:
+                rows.append(i)
+        return rows
+
+    def count_by(self, column="artist", rows=None):
+        """
+        @param column: artist, album, name or track, which counts each
+        artist and track name pair
+        @param rows: (Optional) The row numbers to count, eg. from
+        L{select}, defaults to every row
+        @raise LastfmParamError: if the column is unknown
+        @return: A Counter of names, or (artist, name) tuples, to the number
+        of rows they appear in
+        """
+        counts = self._count_ids(column, rows)
+        strings = self._get_strings()
+        if column == "track":
+            return collections.Counter(dict(((strings[artist], strings[name]), count)
+                                            for (artist, name), count
+                                            in counts.iteritems()))
+        return collections.Counter(dict((strings[string_id], count) for string_id,
+                                        count in counts.iteritems()))
+
+    def top(self, n=10, column="artist", rows=None):
+        """
+        @param n: The number of results
+        @param column: artist, album, name or track, see L{count_by}
+        @param rows: (Optional) The row numbers to count, defaults to every row
+        @return: A list of (name, count) tuples, most played first
+        """
+        counts = self._count_ids(column, rows)
+        strings = self._get_strings()
+        top = heapq.nlargest(n, counts.iteritems(), key=lambda item: item[1])
+        if column == "track":
+            return [((strings[artist], strings[name]), count)
+                    for (artist, name), count in top]
+        return [(strings[string_id], count) for string_id, count in top]
+
+    def _count_ids(self, column, rows):
+        """
+        Counts ids rather than names, names are only looked up for the results
+        """
+        if column == "track":
+            artists, names = self.artist, self.name
+            if rows is None:
+                return collections.Counter(itertools.izip(artists, names))
+            return collections.Counter((artists[i], names[i]) for i in rows)
+        if column not in ("artist", "album", "name"):
+            raise LastfmParamError("Unknown column: %s" % column)
+        values = getattr(self, column)
+        if rows is None:
+            return collections.Counter(values)
+        return collections.Counter(values[i] for i in rows)
+
+    def save(self, path):
+        """
+        Writes the table to a binary file, which L{load} maps back
+        @param path: The path of the file
+        """
+        pool = "\0".join((string or "").encode("UTF-8")
+                         for string in self._get_strings()[1:])
+        columns = [getattr(self, column) for column, typecode in TrackTable.COLUMNS]
+        with open(path, "wb") as f:
+            f.write(TrackTable.HEADER.pack(TrackTable.MAGIC, TrackTable.VERSION,
+                                           sys.byteorder == "little", len(self),
+                                           len(self._get_strings()) - 1, len(pool)))
+            for column in columns:
+                column.tofile(f)
+            f.write(pool)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Maps a file written by L{save}. The file must not change while the
+        table uses it.
+        @param path: The path of the file
+        @raise LastfmError: if the file isn't a saved table
+        @return: A L{TrackTable}
+        """
+        with open(path, "rb") as f:
+            header = f.read(TrackTable.HEADER.size)
+            if len(header) < TrackTable.HEADER.size:
+                raise LastfmError("Not a track table: %s" % path)
+            magic, version, little, rows, strings, pool = TrackTable.HEADER.unpack(header)
+            if magic != TrackTable.MAGIC or version != TrackTable.VERSION:
+                raise LastfmError("Not a track table: %s" % path)
+            table = cls()
+            if rows == 0 and strings == 0:
+                return table
+            table._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        swap = bool(little) != (sys.byteorder == "little")
+        offset = TrackTable.HEADER.size
+        for column, typecode in TrackTable.COLUMNS:
+            size = rows * array(typecode).itemsize
+            delattr(table, column)
+            table._mapped[column] = (typecode, offset, size, swap)
+            offset += size
+        if offset + pool > len(table._map):
+            table._map.close()
+            raise LastfmError("Truncated track table: %s" % path)
+        table._strings = None
+        table._string_ids = None
+        table._pool = (offset, pool, strings)
+        return table
+
+    def _read_strings(self):
+        offset, size, count = self._pool
+        self._strings = [None]
+        if count:
+            self._strings.extend(string.decode("UTF-8") for string
+                                 in self._map[offset:offset + size].split("\0"))
+        del self._pool
+        self._release()
+
+    def _release(self):
+        """Closes the mapping once everything has been copied out of it"""
+        if self._map is not None and not self._mapped and self._strings is not None:
+            self._map.close()
+            self._map = None
+
+    def close(self):
+        """
+        Releases the file of a loaded table, anything not yet read from it
+        is read first
+        """
+        for column in self._mapped.keys():
+            getattr(self, column)
+        if self._strings is None:
+            self._read_strings()
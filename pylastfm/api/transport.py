@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+import httplib
+import socket
+import threading
+import time
+import urlparse
+
+class HTTPConnectionPool(object):
+    """
+    Makes HTTP/1.1 requests over persistent connections, so that repeated
+    calls to the same host don't pay for a new TCP connection each time.
+    """
+    HEADERS = {"User-Agent" : "pylastfm", "Connection" : "keep-alive"}
+    POST_HEADERS = {"Content-Type" : "application/x-www-form-urlencoded"}
+
+    def __init__(self, pool_size=10, idle_timeout=30, connect_timeout=10,
+                 timeout=30):
+        """
+        @param pool_size: The maximum number of idle connections kept per host
+        @param idle_timeout: How long in seconds an idle connection is kept open
+        @param connect_timeout: How long in seconds to wait for a connection
+        @param timeout: The default time in seconds to wait for a response
+        """
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.requests = 0
+        self.reused = 0
+        """How many requests were sent over an existing connection"""
+        self.connections = 0
+        """How many connections have been opened"""
+        self.connect_time = 0.0
+        """The total time in seconds spent opening connections"""
+        self.record_timings = False
+        """Whether to time the phases of each request, see L{get_timings}"""
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def request(self, method, url, body=None, timeout=None):
+        """
+        @param method: GET or POST
+        @param url: The full url to request
+        @param body: (Optional) The encoded POST data
+        @param timeout: (Optional) The time in seconds to wait for a response,
+        overriding the pool's default
+        @return: A tuple of the HTTP status code and the response body
+        """
+        parts = urlparse.urlsplit(url)
+        host = (parts.hostname, parts.port or 80)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        headers = dict(HTTPConnectionPool.HEADERS)
+        if body is not None:
+            headers.update(HTTPConnectionPool.POST_HEADERS)
+        if timeout is None:
+            timeout = self.timeout
+        if self.record_timings:
+            start = time.time()
+        conn, reused = self._get_connection(host)
+        if self.record_timings:
+            connected = time.time()
+        try:
+            written = False
+            try:
+                self._write(conn, method, path, body, headers, timeout)
+                written = True
+                response = conn.getresponse()
+            except socket.timeout:
+                raise
+            except (httplib.BadStatusLine, socket.error):
+                #the server may have closed an idle connection, try once more
+                #on a new one. Once a POST has been written the server may
+                #have acted on it, so it isn't sent twice
+                conn.close()
+                if not reused or (written and method != "GET"):
+                    raise
+                conn, reused = self._new_connection(host), False
+                self._write(conn, method, path, body, headers, timeout)
+                response = conn.getresponse()
+            if self.record_timings:
+                responded = time.time()
+            data = response.read()
+            if self.record_timings:
+                self._local.timings = (("connect", connected - start),
+                                       ("server", responded - connected),
+                                       ("read", time.time() - responded))
+        except:
+            conn.close()
+            raise
+        with self._lock:
+            self.requests += 1
+            if reused:
+                self.reused += 1
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(host, conn)
+        return response.status, data
+
+    def get_timings(self):
+        """
+        @return: A tuple of (phase, seconds) pairs for the last request made
+        by this thread, or None if timings aren't recorded. A stale
+        connection that had to be replaced counts as server time
+        """
+        return getattr(self._local, "timings", None)
+
+    def _write(self, conn, method, path, body, headers, timeout):
+        conn.sock.settimeout(timeout)
+        conn.request(method, path, body, headers)
+
+    def _get_connection(self, host):
+        """
+        @return: A tuple of an open connection and whether it was reused
+        """
+        now = time.time()
+        with self._lock:
+            idle = self._idle.get(host, [])
+            while idle:
+                conn, released = idle.pop()
+                if now - released < self.idle_timeout:
+                    return conn, True
+                conn.close()
+        return self._new_connection(host), False
+
+    def _new_connection(self, host):
+        conn = httplib.HTTPConnection(host[0], host[1], timeout=self.connect_timeout)
+        start = time.time()
+        conn.connect()
+        with self._lock:
+            self.connections += 1
+            self.connect_time += time.time() - start
+        return conn
+
+    def _release(self, host, conn):
+        with self._lock:
+            idle = self._idle.setdefault(host, [])
+            if len(idle) < self.pool_size:
+                idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def close(self):
+        """Closes all idle connections"""
+        with self._lock:
+            for idle in self._idle.itervalues():
+                for conn, released in idle:
+                    conn.close()
+            self._idle.clear()
+
+    def stats(self):
+        """
+        @return: A dictionary of connection counters
+        """
+        with self._lock:
+            reuse_ratio = 0.0
+            connect_time = 0.0
+            if self.requests:
+                reuse_ratio = float(self.reused) / self.requests
+            if self.connections:
+                connect_time = self.connect_time / self.connections
+            return {"requests" : self.requests, "reused" : self.reused,
+                    "connections" : self.connections, "reuse_ratio" : reuse_ratio,
+                    "average_connect_time" : connect_time}
@@ -1,18 +1,26 @@
 #!/usr/bin/env python
 from error import LastfmError, LastfmParamError, LastfmAuthenticationError
 from _basetype import AbstractType, AbstractMethod
+from track import Track
+from event import Event
+from artist import Artist
+from album import Album
+from chart import Chart
+from pager import PageIterator
 
 class User(AbstractType):
     ROOT_NODE = "user"
+    __slots__ = ("id", "name", "realname", "url", "image", "country", "age",
+                 "gender", "subscriber", "playcount", "playlists", "bootstrap",
+                 "registered_unixtime", "registered")
+    int_types = ("age", "playcount", "playlists", "registered_unixtime")
+    bool_types = ("subscriber", "bootstrap")
+
     def __init__(self, etree):
         """
         @param etree: An ElementTree that is the data of a
         single user on last.fm
         """
-        AbstractType.__init__(self, int_types=["age", "playcount", "playlists",
-                                         "registered_unixtime"],
-                              bool_types=["subscriber", "bootstrap"])
-        
         self.id = None
         """Last.fm unique id"""
         self.name = None
@@ -102,8 +110,21 @@ class UserMethod(AbstractMethod):
         @return: A list of L{Track} objects
         """
         user = self._getUsername(user)
-        xml = self.conn._api_get_request(user=user, method="user.getLovedTracks")
+        xml = self.conn._api_get_request(user=user, limit=limit, page=page,
+                                         method="user.getLovedTracks")
         return self.conn.create_objects(xml, Track)
+
+    def iterLovedTracks(self, user=None, limit=None):
+        """
+        Iterate over every track loved by a user, fetching pages as needed.
+        @param user: (Optional) A string of the user to fetch results for,
+        a L{User} object or None for user of the current session
+        @param limit: (Optional) The number of tracks fetched per page.
+        @return: A L{PageIterator} of L{Track} objects
+        """
+        user = self._getUsername(user)
+        return PageIterator(self.conn, Track, user=user, limit=limit,
+                            method="user.getLovedTracks")
     
     
     def getNeighbours(self, user=None, limit=None):
@@ -127,7 +148,23 @@ class UserMethod(AbstractMethod):
         @param limit: (Optional) The maximum number of events to return per page.
         @return: A list of L{Event} objects
         """
-        pass
+        user = self._getUsername(user)
+        xml = self.conn._api_get_request(user=user, page=page, limit=limit,
+                                         method="user.getPastEvents")
+        return self.conn.create_objects(xml, Event)
+
+    def iterPastEvents(self, user=None, limit=None):
+        """
+        Iterate over every event the user has attended in the past, fetching
+        pages as needed.
+        @param user: (Optional) A string of the user to fetch results for,
+        a L{User} object or None for user of the current session
+        @param limit: (Optional) The number of events fetched per page.
+        @return: A L{PageIterator} of L{Event} objects
+        """
+        user = self._getUsername(user)
+        return PageIterator(self.conn, Event, user=user, limit=limit,
+                            method="user.getPastEvents")
     
     def getPlaylists(self, user=None):
         """
@@ -152,7 +189,7 @@ class UserMethod(AbstractMethod):
         #make sure limit is under 25
         pass
     
-    def getRecentTracks(self, user=None, limit=None, page=None):
+    def getRecentTracks(self, user=None, limit=None, page=None, _from=None, to=None):
         """
         Get a list of the recent tracks listened to by this user. Also
         includes the currently playing track with the nowplaying="true"
@@ -163,9 +200,35 @@ class UserMethod(AbstractMethod):
         @param limit: (Optional) An integer used to limit the number of
         tracks returned.
         @param page: (Optional) An integer used to fetch a specific page of tracks.
+        @param _from: (Optional) Only fetch tracks played at or after this unix
+        timestamp.
+        @param to: (Optional) Only fetch tracks played at or before this unix
+        timestamp.
         @return: A list of L{Track} objects
         """
-        pass
+        user = self._getUsername(user)
+        xml = self.conn._api_get_request(user=user, limit=limit, page=page, to=to,
+                                         method="user.getRecentTracks",
+                                         **{"from" : _from})
+        return self.conn.create_objects(xml, Track)
+
+    def iterRecentTracks(self, user=None, limit=200, _from=None, to=None):
+        """
+        Iterate over a user's whole listening history, newest first,
+        fetching pages as needed.
+        @param user: (Optional) A string of the user to fetch results for,
+        a L{User} object or None for user of the current session
+        @param limit: (Optional) The number of tracks fetched per page, the
+        maximum is 200.
+        @param _from: (Optional) Only fetch tracks played at or after this unix
+        timestamp.
+        @param to: (Optional) Only fetch tracks played at or before this unix
+        timestamp.
+        @return: A L{PageIterator} of L{Track} objects
+        """
+        user = self._getUsername(user)
+        return PageIterator(self.conn, Track, user=user, limit=limit, to=to,
+                            method="user.getRecentTracks", **{"from" : _from})
     
     def getRecommendedArtists(self, page=None, limit=None):
         """
@@ -259,7 +322,11 @@ class UserMethod(AbstractMethod):
         See L{getWeeklyChartList()} for more.
         @return: A list of L{Album} objects
         """
-        pass
+        user = self._getUsername(user)
+        xml = self.conn._api_get_request(user=user, to=to,
+                                         method="user.getWeeklyAlbumChart",
+                                         **{"from" : _from})
+        return self.conn.create_objects(xml, Album)
     
     def getWeeklyArtistChart(self, user=None, _from=None, to=None):
         """
@@ -274,7 +341,11 @@ class UserMethod(AbstractMethod):
         See L{getWeeklyChartList()} for more.
         @return: A list of L{Artist} objects
         """
-        pass
+        user = self._getUsername(user)
+        xml = self.conn._api_get_request(user=user, to=to,
+                                         method="user.getWeeklyArtistChart",
+                                         **{"from" : _from})
+        return self.conn.create_objects(xml, Artist)
     
     def getWeeklyChartList(self, user=None):
         """
@@ -285,7 +356,9 @@ class UserMethod(AbstractMethod):
         a L{User} object or None for user of the current session.
         @return: A list of L{Chart} objects
         """
-        pass
+        user = self._getUsername(user)
+        xml = self.conn._api_get_request(user=user, method="user.getWeeklyChartList")
+        return self.conn.create_objects(xml, Chart)
 
     def getWeeklyTrackChart(self, user=None, _from=None, to=None):
         """
@@ -300,7 +373,11 @@ class UserMethod(AbstractMethod):
         See L{getWeeklyChartList()} for more.
         @return: A list of L{Track} objects
         """
-        pass
+        user = self._getUsername(user)
+        xml = self.conn._api_get_request(user=user, to=to,
+                                         method="user.getWeeklyTrackChart",
+                                         **{"from" : _from})
+        return self.conn.create_objects(xml, Track)
 
     def shout(self, user, message):
         """
@@ -1,41 +1,306 @@
+import os
 import re
+import time
+import json
 import hashlib
+import threading
+import heapq
+import itertools
+import urllib
+from collections import OrderedDict
+from api.transport import HTTPConnectionPool
+from api.pool import WorkerPool
+from api.error import LastfmError, LastfmAuthenticationError
 
 class Scrobbler(object):
+    """
+    Submits tracks to last.fm using the audioscrobbler 1.2.1 protocol.
+    Tracks passed to L{scrobble} are written to a L{ScrobbleJournal} first,
+    then submitted in batches of up to max_tracks, either by calling
+    L{flush} or by a background thread started with L{start}. A single
+    handshake is reused until last.fm reports the session as bad.
+    """
     SCROBBLE_URL = "http://post.audioscrobbler.com:80"
-    
-    def __init__(self, client='tst', version='1.0', max_tracks=50):
+    PROTOCOL_VERSION = "1.2.1"
+    MAX_FAILURES = 3
+    """Hard failures allowed before handshaking again, as the protocol requires"""
+    MAX_BACKOFF = 120
+
+    def __init__(self, client='tst', version='1.0', max_tracks=50,
+                 journal_path=None, flush_interval=1.0, transport=None):
+        """
+        @param client: The client id given to your application by last.fm
+        @param version: The version of your application
+        @param max_tracks: The maximum number of tracks sent in one submission
+        @param journal_path: (Optional) The path of a L{ScrobbleJournal} file.
+        Tracks not yet submitted are kept there across restarts, if this is
+        None they are only kept in memory
+        @param flush_interval: How long in seconds the background thread
+        waits for more tracks before submitting
+        @param transport: (Optional) An L{HTTPConnectionPool} to make requests with
+        """
         self.client = client
         self.version = version
         self.max_tracks = max_tracks
-        
+        self.flush_interval = flush_interval
+        self.journal = ScrobbleJournal(journal_path)
+        if transport is None:
+            transport = HTTPConnectionPool()
+        self.transport = transport
+        self.username = None
+        self.password = None
+        self.session_id = None
+        self.now_playing_url = None
+        self.submission_url = None
+        self.failures = 0
+        self._lock = threading.RLock()
+        self._wake = threading.Condition(threading.Lock())
+        self._thread = None
+        self._running = False
+
     def _create_authentication_code(self, timestamp):
         return hashlib.md5(self.password + timestamp).hexdigest()
 
     def _to_post_string(self, tracks):
-        data = {}
-        for i, track in enumerate(tracks):
-            track_iter = track.get_iterator()
-            item = track_iter.next()
-            data["%s[%s]" % (track.get_short(), i)]
-            
-        
+        """
+        @param tracks: A list of L{ScrobbleTrack} objects, dictionaries
+        using the single letter protocol keys, or columns for L{encode_tracks}
+        @return: The form encoded tracks, without the session id
+        """
+        return encode_tracks(tracks)
 
     def handshake(self):
-        pass
-    
+        """
+        Creates a new session with last.fm
+        @raise LastfmAuthenticationError: if the username or password is wrong,
+        or this client has been banned
+        @raise LastfmError: if the handshake failed for another reason
+        """
+        if self.username is None:
+            raise LastfmAuthenticationError("Username not set")
+        timestamp = str(int(time.time()))
+        params = urllib.urlencode([("hs", "true"), ("p", Scrobbler.PROTOCOL_VERSION),
+                                   ("c", self.client), ("v", self.version),
+                                   ("u", self.username), ("t", timestamp),
+                                   ("a", self._create_authentication_code(timestamp))])
+        status, body = self.transport.request("GET", self.SCROBBLE_URL + "/?" + params)
+        lines = body.strip().split("\n")
+        if lines[0] == "OK" and len(lines) >= 4:
+            with self._lock:
+                self.session_id, self.now_playing_url, self.submission_url = lines[1:4]
+                self.failures = 0
+            return
+        if lines[0] in ("BADAUTH", "BANNED"):
+            raise LastfmAuthenticationError(lines[0])
+        raise LastfmError(lines[0])
+
     def set_username_and_password(self, username, password):
         self.username = username
         if not re.match(r"^([a-fA-F\d]{32})$", password):
             self.password = hashlib.md5(password).hexdigest()
         else:
             self.password = password
-    
+
     def scrobble(self, tracklist):
-        pass
-    
-    
+        """
+        Queues tracks for submission. They are safely in the journal when
+        this returns, and are sent by L{flush} or the background thread.
+        @param tracklist: A L{ScrobbleTrack} or a list of them
+        @return: The number of tracks waiting to be submitted
+        """
+        if isinstance(tracklist, ScrobbleTrack):
+            tracklist = [tracklist]
+        self.journal.append(tracklist)
+        with self._wake:
+            self._wake.notify()
+        return len(self.journal)
+
+    def flush(self):
+        """
+        Submits every queued track, in batches of up to max_tracks.
+        @raise LastfmError: if a submission failed, the tracks stay queued
+        @return: The number of tracks submitted
+        """
+        submitted = 0
+        with self._lock:
+            while True:
+                batch = self.journal.pending(self.max_tracks)
+                if not batch:
+                    return submitted
+                self.submit([track for seq, track in batch])
+                self.journal.ack([seq for seq, track in batch])
+                submitted += len(batch)
+
+    def submit(self, tracks):
+        """
+        Sends one batch of tracks straight to last.fm, bypassing the journal.
+        The session is created if needed, and recreated once if last.fm
+        reports it as bad.
+        @param tracks: A list of at most max_tracks L{ScrobbleTrack} objects
+        @raise LastfmError: if the submission failed
+        """
+        self._post("submission_url", self._to_post_string(tracks))
+
+    def now_playing(self, track):
+        """
+        Tells last.fm what the user is listening to right now. See
+        L{NowPlayingChannel} for sending these without blocking.
+        @param track: A L{ScrobbleTrack}, its timestamp isn't sent
+        @raise LastfmError: if the notification failed
+        """
+        data = []
+        fields = dict(zip(ScrobbleTrack.KEYS, ScrobbleTrack.FIELDS))
+        for key in ScrobbleTrack.NOW_PLAYING_KEYS:
+            value = getattr(track, fields[key])
+            if isinstance(value, unicode):
+                value = value.encode("UTF-8")
+            data.append("%s=%s" % (key, urllib.quote_plus(str(value))))
+        self._post("now_playing_url", "&".join(data))
+
+    def _post(self, url_name, data):
+        """
+        Posts data with the session id to one of the urls from the handshake
+        @param url_name: The attribute holding the url, eg. submission_url
+        @param data: The form encoded data, without the session id
+        @raise LastfmError: if last.fm didn't answer OK
+        """
+        for attempt in range(2):
+            if self.session_id is None:
+                self.handshake()
+            status, body = self.transport.request("POST", getattr(self, url_name),
+                                                  "s=%s&%s" % (self.session_id, data))
+            response = body.strip().split("\n")[0]
+            if response == "OK":
+                self.failures = 0
+                return
+            if response != "BADSESSION":
+                self._failed()
+                raise LastfmError(response)
+            self.session_id = None
+        raise LastfmError("BADSESSION")
+
+    def _failed(self):
+        """Counts a hard failure, dropping the session after too many"""
+        self.failures += 1
+        if self.failures >= Scrobbler.MAX_FAILURES:
+            self.session_id = None
+
+    def start(self):
+        """Starts a background thread that submits queued tracks"""
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, flush=True):
+        """
+        Stops the background thread.
+        @param flush: Whether to submit queued tracks before returning
+        """
+        if self._thread is not None:
+            self._running = False
+            with self._wake:
+                self._wake.notify()
+            self._thread.join()
+            self._thread = None
+        if flush:
+            self.flush()
+
+    def _run(self):
+        backoff = self.flush_interval
+        while self._running:
+            with self._wake:
+                if not len(self.journal) and self._running:
+                    self._wake.wait(backoff)
+            #give a burst of plays the chance to fill a batch
+            if len(self.journal) < self.max_tracks:
+                self._pause(self.flush_interval)
+            if not self._running:
+                break
+            try:
+                self.flush()
+                backoff = self.flush_interval
+            except Exception:
+                backoff = min(backoff * 2, Scrobbler.MAX_BACKOFF)
+                self._pause(backoff)
+
+    def _pause(self, seconds):
+        """
+        Waits for seconds on the wake condition, so L{stop} can end the wait
+        early. Scrobbles notify it too, but don't shorten it
+        """
+        end = time.time() + seconds
+        with self._wake:
+            while self._running:
+                remaining = end - time.time()
+                if remaining <= 0:
+                    return
+                self._wake.wait(remaining)
+
+
+def _quote_column(values):
+    """
+    UTF-8 encodes and quotes a column of values. Values repeat a lot, eg.
+    an album's artist, so each distinct value is quoted once.
+    """
+    quoted = {}
+    column = []
+    for value in values:
+        result = quoted.get(value)
+        if result is None:
+            if isinstance(value, unicode):
+                result = urllib.quote_plus(value.encode("UTF-8"))
+            else:
+                result = urllib.quote_plus(str(value))
+            quoted[value] = result
+        column.append(result)
+    return column
+
+def encode_tracks(tracks):
+    """
+    Form encodes tracks for a submission. The tracks are handled a field
+    at a time rather than a track at a time, so no per track dictionaries
+    are made.
+    @param tracks: A list of L{ScrobbleTrack} objects, a list of dictionaries
+    using the single letter protocol keys, or a dictionary of columns: a list
+    of values for each protocol key (eg. 'a') or L{ScrobbleTrack} attribute
+    (eg. 'artist'). Missing keys are sent empty.
+    @return: The form encoded tracks, without the session id
+    """
+    if isinstance(tracks, dict):
+        count = max(len(column) for column in tracks.itervalues())
+        columns = []
+        for key, field in zip(ScrobbleTrack.KEYS, ScrobbleTrack.FIELDS):
+            column = tracks.get(key, tracks.get(field))
+            if column is None:
+                column = ("",) * count
+            columns.append(column)
+    elif tracks and isinstance(tracks[0], ScrobbleTrack):
+        count = len(tracks)
+        columns = [[getattr(track, field) for track in tracks]
+                   for field in ScrobbleTrack.FIELDS]
+    else:
+        count = len(tracks)
+        columns = [[track.get(key, "") for track in tracks]
+                   for key in ScrobbleTrack.KEYS]
+    labelled = []
+    for key, column in zip(ScrobbleTrack.KEYS, columns):
+        labels = ["%s[%d]=" % (key, i) for i in xrange(count)]
+        labelled.append(map(str.__add__, labels, _quote_column(column)))
+    return "&".join(itertools.chain.from_iterable(itertools.izip(*labelled)))
+
+
 class ScrobbleTrack(object):
+    KEYS = ("a", "t", "i", "o", "r", "l", "b", "n", "m")
+    """The protocol's single letter keys, in the order they are sent"""
+    FIELDS = ("artist", "track", "timestamp", "source", "rating", "length",
+              "album", "track_number", "mbid")
+    """The attribute for each key"""
+    NOW_PLAYING_KEYS = ("a", "t", "b", "l", "n", "m")
+    """The keys sent in a now playing notification, in the order they are sent"""
+
     def __init__(self, artist, track, timestamp, length, album="",
                  track_number="", rating="", source="P", mbid=""):
         self.artist = artist
@@ -47,4 +312,514 @@ class ScrobbleTrack(object):
         self.album= album
         self.track_number = track_number
         self.mbid = mbid
-    
+
+    def to_dict(self):
+        """
+        @return: A dictionary of this track using the protocol's keys
+        """
+        return dict((key, getattr(self, field)) for key, field in
+                    zip(ScrobbleTrack.KEYS, ScrobbleTrack.FIELDS))
+
+    @staticmethod
+    def from_dict(data):
+        """
+        @param data: A dictionary from L{to_dict}
+        @return: A new L{ScrobbleTrack}
+        """
+        return ScrobbleTrack(**dict((field, data.get(key, "")) for key, field in
+                                    zip(ScrobbleTrack.KEYS, ScrobbleTrack.FIELDS)))
+
+
+class ScrobbleJournal(object):
+    """
+    An append only log of tracks waiting to be submitted. A track is
+    written as a '+' line when queued and a '-' line is added once last.fm
+    has accepted it, so on restart only unacknowledged tracks are queued
+    again. Every write is synced to disk before returning.
+
+    If the process dies after last.fm accepted a batch but before its
+    acknowledgement is written, that batch is sent again on restart. Last.fm
+    ignores a repeated submission of a track with the same timestamp.
+    """
+    COMPACT_SIZE = 1024 * 1024
+    """Size in bytes past which acknowledged tracks are removed from the file"""
+
+    def __init__(self, path=None):
+        """
+        @param path: (Optional) The path of the journal file, it is created if
+        needed. If this is None the journal is only kept in memory
+        """
+        self.path = path
+        self._pending = OrderedDict()
+        self._next_seq = 0
+        self._lock = threading.Lock()
+        self._file = None
+        if path is not None:
+            self._replay()
+            self._file = open(path, "a")
+
+    def _replay(self):
+        if not os.path.exists(self.path):
+            return
+        f = open(self.path, "r+")
+        good = 0
+        for line in f:
+            #a line without a newline was cut short by a crash
+            if not line.endswith("\n"):
+                break
+            #anything unreadable is treated as torn, the rest is dropped
+            try:
+                seq = int(line[1:].split("\t", 1)[0])
+                if line[0] == "+":
+                    track = json.loads(line.split("\t", 1)[1])
+                    self._pending[seq] = ScrobbleTrack.from_dict(track)
+                else:
+                    self._pending.pop(seq, None)
+            except (ValueError, IndexError, AttributeError, TypeError):
+                break
+            self._next_seq = max(self._next_seq, seq + 1)
+            good += len(line)
+        #drop anything after the last complete line so appends stay readable
+        f.truncate(good)
+        f.close()
+
+    def _write(self, lines):
+        if self._file is None:
+            return
+        self._file.write("".join(lines))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def __len__(self):
+        return len(self._pending)
+
+    def append(self, tracks):
+        """
+        @param tracks: A list of L{ScrobbleTrack} objects to queue
+        """
+        with self._lock:
+            lines = []
+            for track in tracks:
+                seq = self._next_seq
+                self._next_seq += 1
+                self._pending[seq] = track
+                lines.append("+%d\t%s\n" % (seq, json.dumps(track.to_dict())))
+            self._write(lines)
+
+    def pending(self, limit):
+        """
+        @param limit: The maximum number of tracks to return
+        @return: A list of (sequence number, L{ScrobbleTrack}) tuples, oldest first
+        """
+        with self._lock:
+            batch = []
+            for item in self._pending.iteritems():
+                if len(batch) >= limit:
+                    break
+                batch.append(item)
+            return batch
+
+    def ack(self, seqs):
+        """
+        Marks tracks as accepted by last.fm
+        @param seqs: The sequence numbers from L{pending}
+        """
+        with self._lock:
+            self._write(["-%d\n" % seq for seq in seqs])
+            for seq in seqs:
+                self._pending.pop(seq, None)
+            if self._file is not None and self._file.tell() > ScrobbleJournal.COMPACT_SIZE:
+                self._compact()
+
+    def _compact(self):
+        """Rewrites the file with only pending tracks, the lock must be held"""
+        temp = self.path + ".tmp"
+        f = open(temp, "w")
+        for seq, track in self._pending.iteritems():
+            f.write("+%d\t%s\n" % (seq, json.dumps(track.to_dict())))
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        os.rename(temp, self.path)
+        self._file.close()
+        self._file = open(self.path, "a")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ScrobbleService(object):
+    """
+    Submits scrobbles for many users from one process. Each user has a
+    queue, and a shared pool of workers submits batches from them. Only one
+    batch per user is in flight at a time and each batch is sorted by
+    timestamp, so a user's tracks reach last.fm in order. Handshake sessions
+    are kept in a bounded least recently used cache, a user whose session
+    was evicted simply handshakes again.
+
+    Queues are held in memory, use a L{Scrobbler} with a journal_path for
+    a single user whose tracks must survive a restart.
+
+    A user whose handshake is refused (BADAUTH or BANNED) won't succeed by
+    trying again, so their tracks are parked rather than retried until
+    L{add_user} gives them new credentials.
+
+    Users whose submission failed for any other reason are retried after
+    retry_delay by a single scheduler thread, however many are waiting.
+    """
+
+    def __init__(self, client='tst', version='1.0', max_tracks=50, workers=20,
+                 max_sessions=10000, retry_delay=30, transport=None):
+        """
+        @param client: The client id given to your application by last.fm
+        @param version: The version of your application
+        @param max_tracks: The maximum number of tracks sent in one submission
+        @param workers: The number of submissions made at once
+        @param max_sessions: The maximum number of handshake sessions kept
+        @param retry_delay: How long in seconds to wait before resubmitting
+        for a user whose submission failed
+        @param transport: (Optional) An L{HTTPConnectionPool} shared by all users
+        """
+        self.client = client
+        self.version = version
+        self.max_tracks = max_tracks
+        self.max_sessions = max_sessions
+        self.retry_delay = retry_delay
+        if transport is None:
+            transport = HTTPConnectionPool(pool_size=workers)
+        self.transport = transport
+        self.pool = WorkerPool(workers)
+        self.submitted = 0
+        self.retried = 0
+        """Tracks queued again after a failed submission"""
+        self._passwords = {}
+        self._sessions = OrderedDict()
+        self._queues = {}
+        self._parked = {}
+        self._busy = set()
+        self._errors = {}
+        self._retries = []
+        self._running = True
+        self._lock = threading.Condition(threading.Lock())
+        self._thread = threading.Thread(target=self._run_retries)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add_user(self, username, password):
+        """
+        @param username: The user's last.fm username
+        @param password: The user's password in plain text OR an md5 hash
+        """
+        session = Scrobbler(self.client, self.version, self.max_tracks,
+                            transport=self.transport)
+        session.set_username_and_password(username, password)
+        with self._lock:
+            self._passwords[username] = session.password
+            self._sessions.pop(username, None)
+            parked = self._parked.pop(username, None)
+            if parked:
+                self._errors.pop(username, None)
+                self._queues.setdefault(username, [])[:0] = parked
+                self._schedule(username)
+
+    def _get_session(self, username):
+        """
+        @raise LastfmAuthenticationError: if the user wasn't added
+        @return: The L{Scrobbler} holding this user's session, the lock must
+        be held
+        """
+        if username not in self._passwords:
+            raise LastfmAuthenticationError("Unknown user %s" % username)
+        session = self._sessions.pop(username, None)
+        if session is None:
+            session = Scrobbler(self.client, self.version, self.max_tracks,
+                                transport=self.transport)
+            session.set_username_and_password(username, self._passwords[username])
+        self._sessions[username] = session
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return session
+
+    def scrobble(self, username, tracklist):
+        """
+        Queues tracks for a user added with L{add_user}
+        @param username: The user's last.fm username
+        @param tracklist: A L{ScrobbleTrack} or a list of them
+        @return: The number of tracks waiting to be submitted for this user
+        """
+        if isinstance(tracklist, ScrobbleTrack):
+            tracklist = [tracklist]
+        with self._lock:
+            if username not in self._passwords:
+                raise LastfmAuthenticationError("Unknown user %s" % username)
+            if username in self._parked:
+                self._parked[username].extend(tracklist)
+                return len(self._parked[username])
+            queue = self._queues.setdefault(username, [])
+            queue.extend(tracklist)
+            self._schedule(username)
+            return len(queue)
+
+    def _schedule(self, username):
+        """Starts a submission for this user if none is running, the lock must be held"""
+        if username in self._busy or not self._queues.get(username):
+            return
+        queue = self._queues[username]
+        queue.sort(key=lambda track: int(track.timestamp))
+        batch = queue[:self.max_tracks]
+        del queue[:self.max_tracks]
+        self._busy.add(username)
+        try:
+            self.pool.submit(self._submit, username, self._get_session(username), batch)
+        except:
+            #leave the user free to be scheduled again, or wait() never returns
+            queue[:0] = batch
+            self._busy.discard(username)
+            self._lock.notify_all()
+            raise
+
+    def _submit(self, username, session, batch):
+        try:
+            session.submit(batch)
+        except LastfmAuthenticationError, e:
+            with self._lock:
+                self._errors[username] = e
+                self._parked[username] = batch + self._queues.pop(username, [])
+                self._sessions.pop(username, None)
+                self._busy.discard(username)
+                self._lock.notify_all()
+            return
+        except Exception, e:
+            with self._lock:
+                self.retried += len(batch)
+                self._errors[username] = e
+                self._queues[username][:0] = batch
+                #the user stays busy until the retry, so nothing overtakes the batch
+                heapq.heappush(self._retries, (time.time() + self.retry_delay,
+                                               username))
+                self._lock.notify_all()
+            return
+        with self._lock:
+            self.submitted += len(batch)
+            self._errors.pop(username, None)
+            self._busy.discard(username)
+            if not self._queues[username]:
+                del self._queues[username]
+            self._schedule(username)
+            self._lock.notify_all()
+
+    def _run_retries(self):
+        with self._lock:
+            while self._running:
+                if not self._retries:
+                    self._lock.wait()
+                    continue
+                deadline, username = self._retries[0]
+                now = time.time()
+                if deadline > now:
+                    self._lock.wait(deadline - now)
+                    continue
+                heapq.heappop(self._retries)
+                self._busy.discard(username)
+                try:
+                    self._schedule(username)
+                except Exception, e:
+                    self._errors[username] = e
+                self._lock.notify_all()
+
+    def now_playing(self, username, track):
+        """
+        Sends a now playing notification for a user added with L{add_user}.
+        This blocks, see L{NowPlayingChannel}.
+        @param username: The user's last.fm username
+        @param track: A L{ScrobbleTrack}
+        @raise LastfmAuthenticationError: if the user wasn't added
+        """
+        with self._lock:
+            session = self._get_session(username)
+        session.now_playing(track)
+
+    def backlog(self, username):
+        """
+        @param username: The user's last.fm username
+        @return: The number of this user's tracks waiting to be submitted,
+        including parked ones, not counting a batch being sent
+        """
+        with self._lock:
+            return (len(self._queues.get(username, ())) +
+                    len(self._parked.get(username, ())))
+
+    def backlogs(self):
+        """
+        @return: A dictionary of usernames to the number of tracks waiting,
+        for every user with tracks waiting
+        """
+        with self._lock:
+            backlogs = dict((username, len(queue)) for username, queue in
+                            self._parked.iteritems())
+            backlogs.update((username, len(queue)) for username, queue in
+                            self._queues.iteritems() if queue)
+            return backlogs
+
+    def last_error(self, username):
+        """
+        @return: The exception raised by this user's last failed submission,
+        or None if the last submission succeeded
+        """
+        with self._lock:
+            return self._errors.get(username)
+
+    def wait(self, timeout=None):
+        """
+        Blocks until every queued track has been submitted or parked.
+        @param timeout: (Optional) The maximum time in seconds to wait
+        @return: True if all tracks were submitted, False if some are parked
+        or the timeout passed
+        """
+        end = None
+        if timeout is not None:
+            end = time.time() + timeout
+        with self._lock:
+            while self._queues or self._busy:
+                remaining = None
+                if end is not None:
+                    remaining = end - time.time()
+                    if remaining <= 0:
+                        return False
+                self._lock.wait(remaining)
+            return not self._parked
+
+    def stats(self):
+        """
+        @return: A dictionary of service counters
+        """
+        with self._lock:
+            return {"users" : len(self._passwords), "sessions" : len(self._sessions),
+                    "queued" : sum(len(queue) for queue in self._queues.itervalues()),
+                    "in_flight" : len(self._busy), "submitted" : self.submitted,
+                    "parked" : sum(len(queue) for queue in self._parked.itervalues()),
+                    "retried" : self.retried}
+
+    def close(self):
+        """
+        Stops the workers once running submissions have finished, retries
+        not yet due are abandoned
+        """
+        with self._lock:
+            self._running = False
+            self._lock.notify_all()
+        self._thread.join()
+        self.pool.shutdown()
+
+
+class NowPlayingChannel(object):
+    """
+    Sends now playing notifications from a background thread, so players
+    never wait on the network. Updates for a user are held for window
+    seconds and only the latest is sent, so seeking, pausing and resuming
+    don't each cost a request. An update for the track last announced for
+    that user is dropped.
+    """
+
+    def __init__(self, send, window=2.0, workers=1):
+        """
+        @param send: A function taking a username and a L{ScrobbleTrack} that
+        sends the notification, eg. L{ScrobbleService.now_playing} or
+        lambda username, track: scrobbler.now_playing(track)
+        @param window: How long in seconds to wait for further updates
+        before sending
+        @param workers: The number of notifications sent at once
+        """
+        self.send = send
+        self.window = window
+        self.pool = WorkerPool(workers)
+        self.updates = 0
+        self.coalesced = 0
+        """Updates replaced by a later one before they were sent"""
+        self.dropped = 0
+        """Updates for a track that had already been announced"""
+        self.sent = 0
+        self.errors = 0
+        self._pending = {}
+        self._deadlines = []
+        self._announced = {}
+        self._running = True
+        self._lock = threading.Condition(threading.Lock())
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @staticmethod
+    def _identify(track):
+        return (track.artist, track.track, track.album)
+
+    def update(self, username, track):
+        """
+        Queues a now playing notification, returning at once.
+        @param username: The user's last.fm username
+        @param track: A L{ScrobbleTrack}
+        """
+        with self._lock:
+            self.updates += 1
+            if username in self._pending:
+                self.coalesced += 1
+                self._pending[username] = track
+                return
+            if self._announced.get(username) == self._identify(track):
+                self.dropped += 1
+                return
+            self._pending[username] = track
+            heapq.heappush(self._deadlines, (time.time() + self.window, username))
+            self._lock.notify()
+
+    def _run(self):
+        with self._lock:
+            while self._running:
+                if not self._deadlines:
+                    self._lock.wait()
+                    continue
+                deadline, username = self._deadlines[0]
+                now = time.time()
+                if deadline > now:
+                    self._lock.wait(deadline - now)
+                    continue
+                heapq.heappop(self._deadlines)
+                track = self._pending.pop(username)
+                identity = self._identify(track)
+                if self._announced.get(username) == identity:
+                    self.dropped += 1
+                    continue
+                self._announced[username] = identity
+                self.pool.submit(self._send, username, track)
+
+    def _send(self, username, track):
+        try:
+            self.send(username, track)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+                #let the next update for this track try again
+                if self._announced.get(username) == self._identify(track):
+                    del self._announced[username]
+            return
+        with self._lock:
+            self.sent += 1
+
+    def stats(self):
+        """
+        @return: A dictionary of notification counters
+        """
+        with self._lock:
+            return {"updates" : self.updates, "coalesced" : self.coalesced,
+                    "dropped" : self.dropped, "sent" : self.sent,
+                    "errors" : self.errors, "pending" : len(self._pending)}
+
+    def close(self):
+        """Stops the channel, notifications not yet sent are discarded"""
+        with self._lock:
+            self._running = False
+            self._lock.notify()
+        self._thread.join()
+        self.pool.shutdown()
@@ -2,17 +2,45 @@
 import unittest
 import sys
 import hashlib
+import time
+import os
+import tempfile
+import socket
+import threading
+import urlparse
+import pickle
+from StringIO import StringIO
 from xml.etree import ElementTree
 #append system path
 sys.path.insert(0, "../")
-from pylastfm.api.connection import LastfmApiConnection
-from pylastfm.api.user import User
-from pylastfm.api.error import LastfmError
-f = open("../api_keys", "r")
-api_key = f.readline().strip()
-secret = f.readline().strip()
-session_key = f.readline().strip()
-f.close()
+from pylastfm.api.connection import LastfmApiConnection, Cache
+from pylastfm.api.diskcache import DiskCache
+from pylastfm.api.ratelimit import TokenBucket
+from pylastfm.api.retry import RetryPolicy
+from pylastfm.api.pager import PageIterator
+from pylastfm.api.album import Album
+from pylastfm.api.sync import RecentTracksSync
+from pylastfm.api.connection import _get_error_code, _iter_nodes
+from pylastfm.api.user import User, UserMethod
+from pylastfm.api.track import Track
+from pylastfm.api.artist import Artist
+from pylastfm.api.event import Event
+from pylastfm.api.error import LastfmError, LastfmParamError
+from pylastfm.api.keypool import PooledLastfmApiConnection
+from pylastfm.api.tagging import BulkTagger
+from pylastfm.api.charthistory import ChartHistory
+from pylastfm.api.tracktable import TrackTable
+if os.path.exists("../api_keys"):
+    f = open("../api_keys", "r")
+    api_key = f.readline().strip()
+    secret = f.readline().strip()
+    session_key = f.readline().strip()
+    f.close()
+else:
+    #none of these tests talk to last.fm, so any keys will do
+    api_key = "b25b959554ed76058ac220b7b2e0a026"
+    secret = "425b55975eed76058ac220b7b2e0a026"
+    session_key = "b9c31fdbdd4bfe3cbcbb1f96d5ec8b6e"
 
 class LastfmObjects(unittest.TestCase):
 
@@ -34,6 +62,163 @@ class LastfmObjects(unittest.TestCase):
             self.assertEqual(user.subscriber, False)
             self.assertEqual(user.registered_unixtime, 1178554666)
 
+    def test_tracks(self):
+        f = open("data/user.getRecentTracks", "r")
+        tracks = self.api.create_objects(f, Track)
+        f.close()
+        self.assertEqual(len(tracks), 10)
+        self.assertEqual(tracks[0].track_nowplaying, True)
+        self.assertEqual(tracks[0].date_uts, None)
+        self.assertEqual(tracks[1].artist, "Gerling")
+        self.assertEqual(tracks[1].date_uts, 1234567650)
+        self.assertEqual(tracks[1].streamable, True)
+        artist = Artist(ElementTree.fromstring(
+            "<artist><name>Cher</name><match>0.25</match></artist>"))
+        self.assertEqual(artist.match, 0.25)
+
+    def test_nested(self):
+        doc = """<lfm status="ok"><lovedtracks user="woodenbrick" page="1">
+<track>
+  <name>Believe</name>
+  <mbid></mbid>
+  <url>http://www.last.fm/music/Cher/_/Believe</url>
+  <date uts="1234567650">13 Feb 2009, 23:27</date>
+  <artist>
+    <name>Cher</name>
+    <mbid>bfcc6d75-a6a5-4bc6-8282-47aec8531818</mbid>
+    <url>http://www.last.fm/music/Cher</url>
+  </artist>
+  <image size="small">http://userserve-ak.last.fm/serve/34/2000000.jpg</image>
+</track></lovedtracks></lfm>"""
+        track = self.api.create_objects(StringIO(doc), Track)
+        self.assertEqual((track.name, track.artist), ("Believe", "Cher"))
+        self.assertEqual(track.url, "http://www.last.fm/music/Cher/_/Believe")
+        self.assertEqual(track.artist_mbid, "bfcc6d75-a6a5-4bc6-8282-47aec8531818")
+        self.assertEqual(track.date_uts, 1234567650)
+        doc = """<lfm status="ok"><artist>
+  <name>Cher</name>
+  <mbid>bfcc6d75-a6a5-4bc6-8282-47aec8531818</mbid>
+  <url>http://www.last.fm/music/Cher</url>
+  <streamable>1</streamable>
+  <stats><listeners>1000</listeners><playcount>20000</playcount></stats>
+  <similar>
+    <artist><name>Madonna</name><url>http://www.last.fm/music/Madonna</url></artist>
+    <artist><name>Kylie</name><url>http://www.last.fm/music/Kylie</url></artist>
+  </similar>
+  <tags>
+    <tag><name>pop</name><url>http://www.last.fm/tag/pop</url></tag>
+  </tags>
+  <bio><published>Sat, 6 Dec 2008</published><summary>Singer</summary></bio>
+</artist></lfm>"""
+        artist = self.api.create_objects(StringIO(doc), Artist)
+        self.assertEqual((artist.name, artist.url), ("Cher", "http://www.last.fm/music/Cher"))
+        self.assertEqual((artist.listeners, artist.playcount), (1000, 20000))
+        self.assertEqual((artist.summary, artist.streamable), ("Singer", True))
+        doc = """<lfm status="ok"><album>
+  <name>Believe</name>
+  <artist>Cher</artist>
+  <id>2026126</id>
+  <url>http://www.last.fm/music/Cher/Believe</url>
+  <listeners>47602</listeners>
+  <playcount>212991</playcount>
+  <toptags>
+    <tag><name>pop</name><url>http://www.last.fm/tag/pop</url></tag>
+  </toptags>
+</album></lfm>"""
+        album = self.api.create_objects(StringIO(doc), Album)
+        self.assertEqual((album.name, album.artist), ("Believe", "Cher"))
+        self.assertEqual(album.url, "http://www.last.fm/music/Cher/Believe")
+        self.assertEqual((album.id, album.listeners), ("2026126", 47602))
+
+    def test_event(self):
+        event = Event(ElementTree.fromstring("""
+<event xmlns:geo="http://www.w3.org/2003/01/geo/wgs84_pos#">
+  <id>640418</id>
+  <title>Nine Inch Nails</title>
+  <artists>
+    <artist>Nine Inch Nails</artist>
+    <artist>Jane's Addiction</artist>
+    <headliner>Nine Inch Nails</headliner>
+  </artists>
+  <venue>
+    <id>8908030</id>
+    <name>Sydney Entertainment Centre</name>
+    <location>
+      <city>Sydney</city>
+      <country>Australia</country>
+      <street>Harbour St</street>
+      <postalcode>2000</postalcode>
+      <geo:point>
+        <geo:lat>-33.881</geo:lat>
+        <geo:long>151.202</geo:long>
+      </geo:point>
+      <timezone>AEDT</timezone>
+    </location>
+    <url>http://www.last.fm/venue/8908030</url>
+  </venue>
+  <startDate>Tue, 24 Feb 2009 20:00:00</startDate>
+  <image size="small">http://userserve-ak.last.fm/serve/34/2000000.jpg</image>
+  <attendance>78</attendance>
+  <reviews>0</reviews>
+  <url>http://www.last.fm/event/640418</url>
+  <tickets>
+    <ticket supplier="ticketmaster">http://www.ticketmaster.com.au/</ticket>
+  </tickets>
+</event>"""))
+        self.assertEqual(event.id, "640418")
+        self.assertEqual(event.artists, ["Nine Inch Nails", "Jane's Addiction"])
+        self.assertEqual(event.headliner, ["Nine Inch Nails"])
+        self.assertEqual((event.venue, event.city, event.timezone),
+                         ("Sydney Entertainment Centre", "Sydney", "AEDT"))
+        self.assertEqual((event.latitude, event.longitude), (-33.881, 151.202))
+        self.assertEqual(event.url, "http://www.last.fm/event/640418")
+        self.assertEqual(event.venue_url, "http://www.last.fm/venue/8908030")
+        self.assertEqual((event.attendance, event.reviews), (78, 0))
+        self.assertEqual(event.start_date, "Tue, 24 Feb 2009 20:00:00")
+        self.assertEqual(event.image_small, "http://userserve-ak.last.fm/serve/34/2000000.jpg")
+        self.assertEqual(event.tickets, ["http://www.ticketmaster.com.au/"])
+        empty = Event(ElementTree.fromstring("<event><id>1</id></event>"))
+        self.assertEqual((empty.artists, empty.tickets, empty.latitude), ([], [], None))
+
+    def test_slots(self):
+        user = User(ElementTree.fromstring("<user><name>x</name><age>3</age></user>"))
+        self.assertFalse(hasattr(user, "__dict__"))
+        self.assertEqual((user.name, user.age, user.realname), ("x", 3, None))
+        self.assertTrue("age" in user.int_types)
+
+    def test_pickle(self):
+        user = User(ElementTree.fromstring("<user><name>x</name><age>3</age></user>"))
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            copy = pickle.loads(pickle.dumps(user, protocol))
+            self.assertEqual((copy.name, copy.age, copy.realname), ("x", 3, None))
+        event = pickle.loads(pickle.dumps(Event(ElementTree.fromstring(
+            "<event><id>1</id><tickets><ticket>t</ticket></tickets></event>"))))
+        self.assertEqual((event.id, event.tickets), ("1", ["t"]))
+
+    def test_iter_objects(self):
+        users = "".join("<user><name>user%s</name><playcount>%s</playcount></user>"
+                        % (i, i) for i in range(100))
+        doc = '<lfm status="ok"><friends>%s</friends></lfm>' % users
+        objects = self.api.create_objects(StringIO(doc), User, stream=True)
+        first = objects.next()
+        self.assertEqual((first.name, first.playcount), ("user0", 0))
+        names = [user.name for user in objects]
+        self.assertEqual(names, [user.name for user in
+                                 self.api.create_objects(StringIO(doc), User)][1:])
+
+    def test_iter_nodes_releases(self):
+        users = "".join("<user><name>user%s</name></user>" % i for i in range(100))
+        doc = '<lfm status="ok"><friends>%s</friends></lfm>' % users
+        parsed = {}
+        def iterparse(source, events):
+            for event, node in ElementTree.iterparse(source, events):
+                parsed.setdefault(node.tag, node)
+                yield event, node
+        nodes = _iter_nodes(StringIO(doc), ("user",), iterparse)
+        self.assertEqual(len(list(nodes)), 100)
+        #finished nodes are removed from the open container
+        self.assertEqual(len(parsed["friends"]), 0)
+
 
 class ApiTest(unittest.TestCase):
     def setUp(self):
@@ -48,6 +233,18 @@ class ApiTest(unittest.TestCase):
         sig_check = """api_key%sevent43151methodevent.attendskb9c31fdbdd4bfe3cbcbb1f96d5ec8b6estatus2userwoodenbrick%s""" % (api_key, secret)
         self.assertEqual(sig['api_sig'], hashlib.md5(sig_check).hexdigest())
 
+    def test_sig_before_api_key(self):
+        params = {"method" : "album.addTags", "artist" : "Cher", "album" : u"Believe\xe9",
+                  "tags" : None}
+        sig = self.api._create_api_signature(**params)
+        sig_check = "albumBelieve\xc3\xa9api_key%sartistChermethodalbum.addTagssk" \
+                    "b9c31fdbdd4bfe3cbcbb1f96d5ec8b6e%s" % (api_key, secret)
+        self.assertEqual(sig['api_sig'], hashlib.md5(sig_check).hexdigest())
+        self.assertFalse("api_sig" in params)
+        again = self.api._create_api_signature(**params)
+        self.assertEqual(again['api_sig'], sig['api_sig'])
+        self.assertEqual(self.api.signer.stats()["hits"], 1)
+
     
     
     def test_xml_response(self):
@@ -62,7 +259,639 @@ class ApiTest(unittest.TestCase):
         self.assertRaises(LastfmError,
                           self.api._get_xml_response_code,
                           tree)
-        
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = Cache(expiry=1, max_entries=2, max_bytes=10)
+
+    def test_key(self):
+        key = Cache.make_key({"method" : "user.getInfo", "user" : "woodenbrick",
+                              "api_key" : "xxx", "limit" : None})
+        self.assertEqual(key, Cache.make_key({"user" : "woodenbrick",
+                                              "method" : "user.getInfo"}))
+
+    def test_lru_eviction(self):
+        self.cache.put("a", "1")
+        self.cache.put("b", "2")
+        self.assertEqual(self.cache.get("a"), "1")
+        self.cache.put("c", "3")
+        self.assertEqual(self.cache.get("b"), None)
+        self.assertEqual(self.cache.get("a"), "1")
+        self.cache.put("d", "123456789")
+        self.assertEqual(self.cache.size, 10)
+        self.assertEqual(self.cache.stats()["evictions"], 2)
+
+    def test_method_expiry(self):
+        self.assertFalse(self.cache.put("a", "1", "auth.getToken"))
+        self.cache.method_expiry["user.getrecenttracks"] = -1
+        self.assertFalse(self.cache.put("a", "1", "user.getRecentTracks"))
+        self.cache.put("b", "2", "user.getInfo")
+        self.cache._entries["b"] = (time.time() - 1, "2")
+        self.assertEqual(self.cache.get("b"), None)
+        self.assertEqual(self.cache.size, 0)
+
+    def test_cached_request(self):
+        api = LastfmApiConnection("xxx", "yyy", cache_enabled=True)
+        key = Cache.make_key({"method" : "user.getInfo", "user" : "woodenbrick"})
+        api.cache.put(key, '<lfm status="ok"><user><name>woodenbrick</name></user></lfm>')
+        user = api.create_objects(api._api_get_request(method="user.getInfo",
+                                                       user="woodenbrick"), User)
+        self.assertEqual(user.name, "woodenbrick")
+        self.assertEqual(api.cache.hits, 1)
+
+class DiskCacheTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def test_shared(self):
+        first = Cache(store=DiskCache(self.path))
+        second = Cache(store=DiskCache(self.path))
+        first.put("a", "1", "user.getInfo")
+        self.assertEqual(second.get("a"), "1")
+        self.assertEqual(second.store_hits, 1)
+        self.assertEqual(second.get("a"), "1")
+        self.assertEqual(second.hits, 1)
+
+    def test_compact(self):
+        store = DiskCache(self.path, max_bytes=4)
+        store.put("old", "x", time.time() - 1)
+        store.put("a", "12", time.time() + 10)
+        store.put("b", "34", time.time() + 20)
+        store.put("c", "56", time.time() + 30)
+        self.assertEqual(store.get("old"), None)
+        self.assertEqual(store.compact(vacuum=True), 2)
+        self.assertEqual(store.get("a"), None)
+        self.assertEqual(store.get("c")[1], "56")
+        self.assertEqual(store.size(), 4)
+
+    def test_concurrent_compact(self):
+        compactions = []
+        class CountingCache(DiskCache):
+            def compact(self, vacuum=False):
+                compactions.append(vacuum)
+        store = CountingCache(self.path)
+        def put(thread):
+            for i in range(DiskCache.COMPACT_INTERVAL):
+                store.put("%d.%d" % (thread, i), "x", time.time() + 10)
+        threads = [threading.Thread(target=put, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(store._writes, 8 * DiskCache.COMPACT_INTERVAL)
+        self.assertEqual(len(compactions), 8)
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.api = LastfmApiConnection(None, None)
+
+    def divide(self, x, y=1):
+        time.sleep(0.001 * (x % 3))
+        return x / y
+
+    def test_ordered(self):
+        calls = [(self.divide, (i,)) for i in range(50)]
+        calls[7] = (self.divide, (7,), {"y" : 0})
+        results = list(self.api.batch(calls, workers=4))
+        self.assertEqual([r.index for r in results], range(50))
+        self.assertEqual(results[8].value, 8)
+        self.assertFalse(results[7].ok)
+        self.assertTrue(isinstance(results[7].error, ZeroDivisionError))
+
+    def test_as_completed(self):
+        calls = (lambda i=i: self.divide(i) for i in range(50))
+        results = self.api.batch(calls, workers=4, ordered=False)
+        self.assertEqual(sorted(r.value for r in results), range(50))
+
+class SlowTransport(object):
+    """Answers every request after a delay, or fails them all"""
+    def __init__(self, body, fail=False):
+        self.body = body
+        self.fail = fail
+        self.requests = 0
+
+    def request(self, method, url, body=None, timeout=None):
+        self.requests += 1
+        time.sleep(0.1)
+        if self.fail:
+            raise socket.error("Connection refused")
+        return 200, self.body
+
+class SingleFlightTest(unittest.TestCase):
+    def run_threads(self, api, count):
+        results = []
+        def get():
+            try:
+                results.append(api._api_get_request(method="artist.getInfo",
+                                                    artist="Cher").read())
+            except Exception, e:
+                results.append(e)
+        threads = [threading.Thread(target=get) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_coalesce(self):
+        transport = SlowTransport('<lfm status="ok"></lfm>')
+        api = LastfmApiConnection("xxx", "yyy", transport=transport, rate_limit=None)
+        results = self.run_threads(api, 10)
+        self.assertEqual(results, ['<lfm status="ok"></lfm>'] * 10)
+        self.assertEqual(transport.requests, 1)
+        stats = api.single_flight.stats()
+        self.assertEqual((stats["calls"], stats["coalesced"], stats["in_flight"]),
+                         (1, 9, 0))
+        self.run_threads(api, 1)
+        self.assertEqual(transport.requests, 2)
+
+    def test_errors(self):
+        transport = SlowTransport(None, fail=True)
+        api = LastfmApiConnection("xxx", "yyy", transport=transport, rate_limit=None,
+                                  retry_policy=RetryPolicy(max_attempts=1))
+        results = self.run_threads(api, 5)
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(isinstance(e, socket.error) for e in results))
+        self.assertEqual(transport.requests, 1)
+        self.assertEqual(api.single_flight.stats()["errors"], 1)
+
+class KeyTransport(object):
+    """Records the api key of each request, throttling the keys in throttled once"""
+    def __init__(self, *throttled):
+        self.throttled = list(throttled)
+        self.keys = []
+
+    def request(self, method, url, body=None, timeout=None):
+        if body is None:
+            body = url.split("?", 1)[1]
+        key = urlparse.parse_qs(body)["api_key"][0]
+        self.keys.append(key)
+        if key in self.throttled:
+            self.throttled.remove(key)
+            return 200, '<lfm status="failed"><error code="29">Slow down</error></lfm>'
+        return 200, '<lfm status="ok"></lfm>'
+
+class KeyPoolTest(unittest.TestCase):
+    CREDENTIALS = [("a", "secret_a"), ("b", "secret_b"), ("c", "secret_c")]
+
+    def create(self, transport, **kwargs):
+        return PooledLastfmApiConnection(KeyPoolTest.CREDENTIALS, transport=transport,
+                                         rate_limit=None, session_key="sk",
+                                         retry_policy=RetryPolicy(base_delay=0.01),
+                                         **kwargs)
+
+    def test_round_robin(self):
+        transport = KeyTransport()
+        api = self.create(transport, scheduling="round_robin")
+        for i in range(6):
+            api._api_get_request(method="artist.getInfo", artist="Cher %d" % i)
+        self.assertEqual(transport.keys, ["a", "b", "c", "a", "b", "c"])
+        self.assertEqual([s["requests"] for s in api.key_stats()], [2, 2, 2])
+
+    def test_pinned(self):
+        transport = KeyTransport()
+        api = self.create(transport)
+        api._api_get_request(method="artist.getInfo", artist="Cher")
+        api._api_post_request(method="track.love", artist="Cher", track="Believe")
+        api._api_get_request(**api._create_api_signature(method="auth.getToken"))
+        self.assertEqual(transport.keys, ["a", "a", "a"])
+
+    def test_throttled(self):
+        transport = KeyTransport("b")
+        api = self.create(transport, cooldown=60)
+        for i in range(5):
+            api._api_get_request(method="artist.getInfo", artist="Cher %d" % i)
+        self.assertEqual(transport.keys, ["a", "b", "c", "a", "c", "a"])
+        stats = api.key_stats()
+        self.assertTrue(stats[1]["throttled"])
+        self.assertEqual(stats[1]["throttles"], 1)
+        self.assertRaises(LastfmParamError, PooledLastfmApiConnection, [])
+
+class TagTransport(object):
+    """Keeps each item's tags, answering getTags, addTags and removeTag"""
+    OK = '<lfm status="ok"></lfm>'
+    FAILED = '<lfm status="failed"><error code="6">Invalid tag</error></lfm>'
+
+    def __init__(self, tags):
+        self.tags = tags
+        self.posts = []
+
+    def request(self, method, url, body=None, timeout=None):
+        if body is None:
+            body = url.split("?", 1)[1]
+        params = dict(urlparse.parse_qsl(body))
+        kind, api_method = params["method"].split(".")
+        item = (kind, params["artist"], params.get(kind))
+        if kind == "artist":
+            item = (kind, params["artist"])
+        tags = self.tags.setdefault(item, [])
+        if api_method == "getTags":
+            if params.get("user") != "woodenbrick" or "broken" in tags:
+                return 200, '<lfm status="failed"><error code="50">No user</error></lfm>'
+            return 200, '<lfm status="ok"><tags>%s</tags></lfm>' % "".join(
+                "<tag><name>%s</name></tag>" % tag for tag in tags)
+        self.posts.append((api_method, item))
+        if api_method == "addTags":
+            new = params["tags"].split(",")
+            if len(new) > 10 or "broken" in new:
+                return 200, TagTransport.FAILED
+            tags.extend(new)
+        else:
+            tags.remove(params["tag"])
+        return 200, TagTransport.OK
+
+class TaggingTest(unittest.TestCase):
+    def setUp(self):
+        self.transport = TagTransport({("artist", "Cher") : ["pop", "Disco", "old"],
+                                       ("album", "Cher", "Believe") : ["pop"]})
+        api = LastfmApiConnection("xxx", "yyy", session_key="sk", username="woodenbrick",
+                                  transport=self.transport, rate_limit=None)
+        self.tagger = BulkTagger(api, workers=4)
+
+    def test_set(self):
+        tags = ["tag%d" % i for i in range(25)]
+        items = [(("artist", "Cher"), ["pop", "disco", "dance"]),
+                 (("album", "Cher", "Believe"), tags),
+                 (("track", "Cher", "Believe"), ["broken"])]
+        results = list(self.tagger.retag(items))
+        self.assertEqual([r.item for r in results], [pair[0] for pair in items])
+        cher, album, track = results
+        self.assertEqual((cher.added, cher.removed), (["dance"], ["old"]))
+        self.assertTrue(cher.ok)
+        self.assertEqual(self.transport.tags[("artist", "Cher")], ["pop", "Disco", "dance"])
+        self.assertEqual((album.added, album.removed), (tags, ["pop"]))
+        self.assertEqual(self.transport.posts.count(("addTags", ("album", "Cher", "Believe"))), 3)
+        self.assertFalse(track.ok)
+        self.assertEqual(track.failed, ["broken"])
+
+    def test_add_remove(self):
+        results = list(self.tagger.retag([(("artist", "Cher"), ["pop", "new"])], mode="add"))
+        self.assertEqual((results[0].added, results[0].removed), (["new"], []))
+        results = list(self.tagger.retag([(("artist", "Cher"), ["POP", "missing"])],
+                                         mode="remove"))
+        self.assertEqual((results[0].added, results[0].removed), ([], ["pop"]))
+        results = list(self.tagger.retag([(("label", "Warner"), ["pop"])]))
+        self.assertTrue(isinstance(results[0].error, LastfmParamError))
+
+    def test_get_tags_failed(self):
+        self.transport.tags[("artist", "Abba")] = ["broken"]
+        results = list(self.tagger.retag([(("artist", "Abba"), ["pop"])]))
+        self.assertFalse(results[0].ok)
+        self.assertTrue(isinstance(results[0].error, LastfmError))
+        self.assertEqual((results[0].added, results[0].removed), ([], []))
+        self.assertEqual(self.transport.posts, [])
+
+class TokenBucketTest(unittest.TestCase):
+    def test_shared(self):
+        first = LastfmApiConnection("shared", "yyy", rate_limit=3)
+        second = LastfmApiConnection("shared", "zzz", rate_limit=3)
+        self.assertTrue(first.rate_limiter is second.rate_limiter)
+        self.assertEqual(LastfmApiConnection("xxx", "yyy",
+                                             rate_limit=None).rate_limiter, None)
+
+    def test_delay(self):
+        bucket = TokenBucket(100, burst=2)
+        start = time.time()
+        for i in range(6):
+            bucket.acquire()
+        self.assertTrue(time.time() - start >= 0.035)
+        stats = bucket.stats()
+        self.assertEqual(stats["requests"], 6)
+        #a sleep that overshoots refills the next token early
+        self.assertTrue(3 <= stats["delayed"] <= 4)
+        self.assertEqual(stats["queue_depth"], 0)
+        bucket.penalize(0.05)
+        self.assertTrue(bucket.acquire() > 0.04)
+
+class RetryTest(unittest.TestCase):
+    UNAVAILABLE = '<lfm status="failed"><error code="16">Try again</error></lfm>'
+    INVALID = '<lfm status="failed"><error code="6">No user</error></lfm>'
+    OK = '<lfm status="ok"></lfm>'
+
+    def setUp(self):
+        self.policy = RetryPolicy(base_delay=0, max_budget=3)
+
+    def sender(self, *responses):
+        responses = list(responses)
+        self.sent = 0
+        def send():
+            self.sent += 1
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+        return send
+
+    def test_retryable(self):
+        send = self.sender((503, ""), (200, self.UNAVAILABLE), (200, self.OK))
+        self.assertEqual(self.policy.call(send, _get_error_code), (200, self.OK))
+        self.assertEqual(self.sent, 3)
+
+    def test_fatal(self):
+        send = self.sender((400, self.INVALID), (200, self.OK))
+        self.assertEqual(self.policy.call(send, _get_error_code)[1], self.INVALID)
+        self.assertEqual(self.sent, 1)
+
+    def test_post(self):
+        send = self.sender((503, ""), (200, self.OK))
+        self.assertEqual(self.policy.call(send, _get_error_code, False)[0], 503)
+        send = self.sender(socket.timeout(), (200, self.OK))
+        self.assertRaises(socket.timeout, self.policy.call, send, _get_error_code,
+                          False)
+        send = self.sender((200, self.UNAVAILABLE), (200, self.OK))
+        self.assertEqual(self.policy.call(send, _get_error_code, False)[1], self.OK)
+
+    def test_budget(self):
+        send = self.sender(*[socket.error()] * 8)
+        self.assertRaises(socket.error, self.policy.call, send, _get_error_code)
+        self.assertRaises(socket.error, self.policy.call, send, _get_error_code)
+        self.assertEqual(self.sent, 5)
+        self.assertEqual(self.policy.stats()["exhausted"], 1)
+
+class PagedConnection(object):
+    """Serves numbered pages of tracks instead of calling last.fm"""
+    def __init__(self, pages, per_page=3):
+        self.pages = pages
+        self.per_page = per_page
+        self.fetched = []
+
+    def _api_get_request(self, **kwargs):
+        page = kwargs["page"]
+        self.fetched.append(page)
+        tracks = "".join("<track><name>%s</name></track>" % (page * 10 + i)
+                         for i in range(self.per_page))
+        return StringIO('<lfm status="ok"><recenttracks page="%s" perPage="%s" '
+                        'totalPages="%s" total="%s">%s</recenttracks></lfm>'
+                        % (page, self.per_page, self.pages,
+                           self.pages * self.per_page, tracks))
+
+
+class LovedConnection(LastfmApiConnection):
+    """Serves pages of loved tracks in last.fm's nested shape"""
+    def _api_get_request(self, **kwargs):
+        page = kwargs.get("page") or 1
+        tracks = "".join("<track><name>Song %s</name><mbid></mbid>"
+                         "<date uts=\"%s\">13 Feb 2009</date>"
+                         "<artist><name>Artist %s</name><mbid>mbid%s</mbid>"
+                         "<url>http://www.last.fm/music/Artist+%s</url></artist>"
+                         "</track>" % ((page * 10 + i,) * 5) for i in range(2))
+        return StringIO('<lfm status="ok"><lovedtracks user="woodenbrick" '
+                        'page="%s" perPage="2" totalPages="2" total="4">%s'
+                        '</lovedtracks></lfm>' % (page, tracks))
+
+
+class PageIteratorTest(unittest.TestCase):
+    def test_all_pages(self):
+        conn = PagedConnection(4)
+        pager = PageIterator(conn, Track, user="woodenbrick",
+                             method="user.getRecentTracks")
+        self.assertEqual(pager.get_total(), 12)
+        names = [track.name for track in pager]
+        self.assertEqual(names, [str(p * 10 + i) for p in range(1, 5) for i in range(3)])
+        self.assertEqual(sorted(conn.fetched), [1, 2, 3, 4])
+
+    def test_stops_early(self):
+        conn = PagedConnection(100)
+        pager = iter(PageIterator(conn, Track, prefetch=False, page=5,
+                                  method="user.getRecentTracks"))
+        self.assertEqual(pager.next().name, "50")
+        pager.close()
+        self.assertEqual(conn.fetched, [5])
+
+    def test_loved_tracks(self):
+        user = UserMethod(LovedConnection(None, None))
+        tracks = user.getLovedTracks("woodenbrick")
+        self.assertEqual([(t.name, t.artist, t.artist_mbid) for t in tracks],
+                         [("Song 10", "Artist 10", "mbid10"),
+                          ("Song 11", "Artist 11", "mbid11")])
+        tracks = list(user.iterLovedTracks("woodenbrick"))
+        self.assertEqual([track.name for track in tracks],
+                         ["Song 10", "Song 11", "Song 20", "Song 21"])
+        self.assertEqual(tracks[-1].artist, "Artist 21")
+        self.assertEqual(tracks[-1].date_uts, 21)
+
+    def test_opensearch(self):
+        doc = ('<lfm status="ok"><results xmlns:opensearch="http://a9.com/-/spec/opensearch/1.1/">'
+               '<opensearch:totalResults>61</opensearch:totalResults>'
+               '<opensearch:itemsPerPage>30</opensearch:itemsPerPage>'
+               '<albummatches><album><name>Believe</name></album></albummatches>'
+               '</results></lfm>')
+        conn = PagedConnection(1)
+        conn._api_get_request = lambda **kwargs: StringIO(doc)
+        pager = PageIterator(conn, Album, album="believe", method="album.search")
+        self.assertEqual(pager.get_total(), 61)
+        self.assertEqual(pager.total_pages, 3)
+
+class HistoryConnection(object):
+    """Serves a listening history newest first, the way last.fm does"""
+    def __init__(self, history):
+        self.history = history
+        self.fail_page = None
+        self.requests = []
+
+    def _api_get_request(self, **kwargs):
+        self.requests.append(kwargs)
+        if kwargs["page"] == self.fail_page:
+            return StringIO('<lfm status="failed"><error code="16">Try again</error></lfm>')
+        limit = kwargs["limit"]
+        tracks = [uts for uts in sorted(self.history, reverse=True)
+                  if uts >= (kwargs["from"] or 0) and uts <= kwargs["to"]]
+        pages = max(1, (len(tracks) + limit - 1) / limit)
+        start = (kwargs["page"] - 1) * limit
+        items = "".join('<track><artist>a%s</artist><name>t%s</name>'
+                        '<date uts="%s"/></track>' % (uts, uts, uts)
+                        for uts in tracks[start:start + limit])
+        return StringIO('<lfm status="ok"><recenttracks totalPages="%s">'
+                        '<track nowplaying="true"><name>now</name></track>%s'
+                        '</recenttracks></lfm>' % (pages, items))
+
+
+class SyncTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.conn = HistoryConnection(range(1000, 1025))
+        self.sync = RecentTracksSync(self.conn, self.path, limit=10)
+
+    def tearDown(self):
+        self.sync.close()
+        os.remove(self.path)
+
+    def test_incremental(self):
+        self.assertEqual(self.sync.sync("woodenbrick"), 25)
+        self.assertEqual(self.sync.get_checkpoint("woodenbrick"), 1024)
+        self.conn.history += [1030, 1031]
+        self.conn.requests = []
+        self.assertEqual(self.sync.sync("woodenbrick"), 2)
+        self.assertEqual(len(self.conn.requests), 1)
+        self.assertEqual(self.conn.requests[0]["from"], 1024)
+        uts = [row[0] for row in self.sync.iter_tracks("woodenbrick")]
+        self.assertEqual(uts, range(1000, 1025) + [1030, 1031])
+
+    def test_resume(self):
+        self.conn.fail_page = 2
+        self.assertRaises(LastfmError, self.sync.sync, "woodenbrick")
+        self.assertEqual(self.sync.get_checkpoint("woodenbrick"), 1004)
+        self.conn.fail_page = None
+        self.assertEqual(self.sync.sync("woodenbrick"), 20)
+        self.assertEqual(len(list(self.sync.iter_tracks("woodenbrick"))), 25)
+
+    def test_concurrent(self):
+        users = ["user%d" % i for i in range(8)]
+        threads = [threading.Thread(target=self.sync.sync, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for user in users:
+            self.assertEqual(self.sync.get_checkpoint(user), 1024)
+            self.assertEqual(len(list(self.sync.iter_tracks(user))), 25)
+
+class ChartTransport(object):
+    """Serves a user's weekly chart list and the charts of each week"""
+    WEEK = 604800
+
+    def __init__(self, weeks):
+        self.weeks = weeks
+        self.fail = set()
+        self.requests = []
+
+    def request(self, method, url, body=None, timeout=None):
+        params = dict(urlparse.parse_qsl(url.split("?", 1)[1]))
+        self.requests.append(params)
+        if params["method"] == "user.getWeeklyChartList":
+            return 200, '<lfm status="ok"><weeklychartlist>%s</weeklychartlist></lfm>' % (
+                "".join('<chart from="%d" to="%d"/>' % (week, week + ChartTransport.WEEK)
+                        for week in self.weeks))
+        week = int(params["from"])
+        kind = params["method"][len("user.getWeekly"):-len("Chart")].lower()
+        if (kind, week) in self.fail:
+            return 200, '<lfm status="failed"><error code="8">Operation failed</error></lfm>'
+        #a week's playcount is its index, the second artist only plays in even weeks
+        playcount = self.weeks.index(week) + 1
+        items = ['<%s rank="1"><artist>Cher</artist><name>Believe</name>'
+                 '<playcount>%d</playcount></%s>' % (kind, playcount, kind)]
+        if kind == "artist":
+            items = ['<artist rank="1"><name>Cher</name><playcount>%d</playcount></artist>'
+                     % playcount]
+            if playcount % 2 == 0:
+                items.append('<artist rank="2"><name>Abba</name><playcount>1</playcount>'
+                             '</artist>')
+        return 200, '<lfm status="ok"><weekly%schart>%s</weekly%schart></lfm>' % (
+            kind, "".join(items), kind)
+
+class ChartHistoryTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.weeks = [1000000000 + i * ChartTransport.WEEK for i in range(6)]
+        self.transport = ChartTransport(self.weeks)
+        api = LastfmApiConnection("xxx", "yyy", transport=self.transport,
+                                  rate_limit=None, coalesce=False)
+        self.history = ChartHistory(api, self.path, workers=4)
+
+    def tearDown(self):
+        self.history.close()
+        os.remove(self.path)
+
+    def test_download(self):
+        report = self.history.download("woodenbrick")
+        self.assertEqual((report["stored"], report["skipped"], report["failed"]),
+                         (18, 0, []))
+        self.assertEqual(self.history.get_series("woodenbrick", "artist", "Cher"),
+                         [(week, i + 1) for i, week in enumerate(self.weeks)])
+        self.assertEqual(self.history.get_series("woodenbrick", "track", "Believe",
+                                                 "Cher")[-1], (self.weeks[-1], 6))
+        self.assertEqual(self.history.get_totals("woodenbrick", "artist"),
+                         [(None, "Cher", 21), (None, "Abba", 3)])
+        self.assertEqual(self.history.get_totals("woodenbrick", "album",
+                                                 since=self.weeks[3]),
+                         [("Cher", "Believe", 15)])
+        self.transport.requests = []
+        report = self.history.download("woodenbrick")
+        self.assertEqual((report["stored"], report["skipped"]), (0, 18))
+        self.assertEqual(len(self.transport.requests), 1)
+        #a new instance on the same database finds the stored names
+        self.history.close()
+        self.history = ChartHistory(self.history.conn, self.path)
+        self.history._store(1, "artist", 0, ChartTransport.WEEK, [("", "Cher", 1)])
+        self.assertEqual(self.history.db.execute("SELECT COUNT(*) FROM items WHERE "
+                                                 "name = 'Cher'").fetchone()[0], 1)
+
+    def test_resume(self):
+        self.transport.fail = set([("artist", self.weeks[2]), ("track", self.weeks[0])])
+        report = self.history.download("woodenbrick", kinds=("artist", "track"))
+        self.assertEqual(report["stored"], 10)
+        self.assertEqual(sorted((kind, week) for kind, week, e in report["failed"]),
+                         [("artist", self.weeks[2]), ("track", self.weeks[0])])
+        self.assertEqual(len(self.history.get_weeks("woodenbrick", "artist")), 5)
+        self.transport.fail = set()
+        self.transport.requests = []
+        report = self.history.download("woodenbrick", kinds=("artist", "track"))
+        self.assertEqual((report["stored"], report["skipped"]), (2, 10))
+        self.assertEqual(len(self.transport.requests), 3)
+        self.assertEqual(self.history.get_weeks("woodenbrick", "artist"), self.weeks)
+
+class TrackTableTest(unittest.TestCase):
+    def setUp(self):
+        self.table = TrackTable()
+        self.table.feed(open("data/user.getRecentTracks"))
+
+    def test_feed(self):
+        #the track playing now has no timestamp
+        self.assertEqual(len(self.table), 9)
+        self.assertEqual(self.table.row(0), (1234567650, "Gerling",
+                         "When Young Terrorists Chase the Sun",
+                         "Death to the Apple Gerls", TrackTable.STREAMABLE))
+        loved = StringIO('<lfm status="ok"><lovedtracks><track><name>Believe</name>'
+                         '<date uts="1000">x</date><artist><name>Cher</name></artist>'
+                         '</track></lovedtracks></lfm>')
+        self.assertEqual(self.table.feed(loved, TrackTable.LOVED), 1)
+        self.assertEqual(self.table.row(9), (1000, "Cher", None, "Believe",
+                                             TrackTable.LOVED))
+        self.assertRaises(LastfmError, self.table.feed, StringIO(
+            '<lfm status="failed"><error code="6">No user</error></lfm>'))
+
+    def test_queries(self):
+        for i in range(5):
+            self.table.add(2000 + i, "Cher", "Believe", flags=TrackTable.LOVED * (i % 2))
+        self.assertEqual(list(self.table.select(artist="Cher")), range(9, 14))
+        self.assertEqual(list(self.table.select(artist="Cher", since=2001, until=2004,
+                                                flags=TrackTable.LOVED)), [10, 12])
+        self.assertEqual(len(self.table.select(artist="Nobody")), 0)
+        self.assertEqual(self.table.top(1), [("Cher", 5)])
+        self.assertEqual(self.table.top(1, "track"), [(("Cher", "Believe"), 5)])
+        counts = self.table.count_by("artist", self.table.select(since=2002))
+        self.assertEqual(counts["Cher"], 3)
+        self.assertEqual(sum(counts.values()), 12)
+        self.assertRaises(LastfmParamError, self.table.top, 1, "mbid")
+
+    def test_save_load(self):
+        self.table.add(2000, u"Bj\xf6rk", u"J\xf3ga")
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self.table.save(path)
+            loaded = TrackTable.load(path)
+            self.assertEqual(list(loaded), list(self.table))
+            self.assertEqual(loaded.top(3), self.table.top(3))
+            loaded.add(2001, u"Bj\xf6rk", "Army of Me")
+            self.assertEqual(loaded.count_by()[u"Bj\xf6rk"], 2)
+            loaded.close()
+            TrackTable().save(path)
+            self.assertEqual(len(TrackTable.load(path)), 0)
+            open(path, "wb").write("junk")
+            self.assertRaises(LastfmError, TrackTable.load, path)
+        finally:
+            os.remove(path)
+
 if __name__ == "__main__":
     unittest.main()
 
@@ -3,10 +3,17 @@
 import unittest
 import sys
 import time
+import os
+import tempfile
+import random
+import threading
+import urlparse
 from xml.etree import ElementTree
 #append system path
 sys.path.insert(0, "../")
-from pylastfm.scrobbler import Scrobbler
+from pylastfm.scrobbler import Scrobbler, ScrobbleTrack, ScrobbleJournal, ScrobbleService, \
+     NowPlayingChannel
+from pylastfm.api.error import LastfmError, LastfmAuthenticationError
 
 class ScrobblerTest(unittest.TestCase):
     def setUp(self):
@@ -24,9 +31,300 @@ class ScrobblerTest(unittest.TestCase):
           "n" : 2, "m" : ""},
         {"a" : "Gerling", "t" : "Death to the Apple Gerls", "i" : 1234567789,
           "o" : "P", "r" : "", "l" : 220, "b" : "The Apple", "n" : 3, "m" : ""}]
-        known_data = """a[0]=Foo+Fighters&t[0]=Monkey+Wrench&i=1234567890&o[0]=P&r[0]=&l[0]=200&b[0]=The+Color+and+the+Shape&n[0]=2&m[0]=&a[1]=Gerling&t[1]=Death+to+the+Apple+Gerls&i[1]=1234567789&o[1]=P&r[1]=&l[1]=220&b[1]=The+Apple&n[1]=3&m[1]="""
+        known_data = """a[0]=Foo+Fighters&t[0]=Monkey+Wrench&i[0]=1234567890&o[0]=P&r[0]=&l[0]=200&b[0]=The+Color+and+the+Shape&n[0]=2&m[0]=&a[1]=Gerling&t[1]=Death+to+the+Apple+Gerls&i[1]=1234567789&o[1]=P&r[1]=&l[1]=220&b[1]=The+Apple&n[1]=3&m[1]="""
         self.assertEqual(self.scrobbler._to_post_string(data), known_data)
 
-    
+    def test_encode_columns(self):
+        tracks = [ScrobbleTrack(u"Sigur R\xf3s", "Hoppipolla", 1234567890, length=270),
+                  ScrobbleTrack(u"Sigur R\xf3s", u"Glos\xf3li", 1234568160, "")]
+        columns = {"artist" : [u"Sigur R\xf3s"] * 2, "t" : ["Hoppipolla", u"Glos\xf3li"],
+                   "i" : [1234567890, 1234568160], "o" : ["P", "P"], "l" : [270, ""]}
+        encoded = self.scrobbler._to_post_string(tracks)
+        self.assertEqual(self.scrobbler._to_post_string(columns), encoded)
+        self.assertTrue(encoded.startswith("a[0]=Sigur+R%C3%B3s&t[0]=Hoppipolla&"
+                                           "i[0]=1234567890&o[0]=P&r[0]=&l[0]=270&"))
+        self.assertTrue(encoded.endswith("&n[1]=&m[1]="))
+
+
+class FakeTransport(object):
+    """Answers scrobbler requests with canned responses"""
+    def __init__(self, *submissions):
+        self.submissions = list(submissions)
+        self.requests = []
+
+    def request(self, method, url, body=None):
+        self.requests.append((method, url, body))
+        if method == "GET":
+            return 200, "OK\nsession%d\nhttp://np/\nhttp://submit/\n" % len(self.requests)
+        return 200, self.submissions.pop(0) + "\n"
+
+
+class SubmissionTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(self.path)
+        self.tracks = [ScrobbleTrack("Foo Fighters", u"Track \xe9 %d" % i,
+                                     1234567890 + i, 200) for i in range(120)]
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def create_scrobbler(self, transport):
+        scrobbler = Scrobbler(journal_path=self.path, transport=transport)
+        scrobbler.set_username_and_password("Tard", "qwerty")
+        return scrobbler
+
+    def test_batches(self):
+        transport = FakeTransport("OK", "OK", "OK")
+        scrobbler = self.create_scrobbler(transport)
+        self.assertEqual(scrobbler.scrobble(self.tracks), 120)
+        self.assertEqual(scrobbler.flush(), 120)
+        methods = [method for method, url, body in transport.requests]
+        self.assertEqual(methods, ["GET", "POST", "POST", "POST"])
+        self.assertTrue(transport.requests[1][2].startswith("s=session1&a[0]=Foo+Fighters"))
+        self.assertTrue("t[49]=Track+%C3%A9+49" in transport.requests[1][2])
+        self.assertEqual(len(scrobbler.journal), 0)
+
+    def test_bad_session(self):
+        transport = FakeTransport("BADSESSION", "OK")
+        scrobbler = self.create_scrobbler(transport)
+        scrobbler.scrobble(self.tracks[0])
+        scrobbler.flush()
+        handshakes = [url for method, url, body in transport.requests if method == "GET"]
+        self.assertEqual(len(handshakes), 2)
+        self.assertTrue(transport.requests[-1][2].startswith("s=session3&"))
+
+    def test_journal(self):
+        transport = FakeTransport("OK", "FAILED Plugin bug")
+        scrobbler = self.create_scrobbler(transport)
+        scrobbler.scrobble(self.tracks[:60])
+        self.assertRaises(LastfmError, scrobbler.flush)
+        scrobbler.journal.close()
+        #simulate a crash part way through writing a line
+        f = open(self.path, "a")
+        f.write("+999\t{")
+        f.close()
+        journal = ScrobbleJournal(self.path)
+        self.assertEqual(len(journal), 10)
+        seq, track = journal.pending(1)[0]
+        self.assertEqual(track.track, u"Track \xe9 50")
+        self.assertEqual(track.timestamp, 1234567940)
+        journal.append(self.tracks[:1])
+        journal.close()
+        self.assertEqual(len(ScrobbleJournal(self.path)), 11)
+
+    def test_journal_corrupt(self):
+        journal = ScrobbleJournal(self.path)
+        journal.append(self.tracks[:3])
+        journal.close()
+        for line in ("+999\n", "+1000\t[1]\n", "x\n"):
+            f = open(self.path, "a")
+            f.write(line)
+            f.close()
+            #a complete but unreadable line is dropped like a torn one
+            journal = ScrobbleJournal(self.path)
+            self.assertEqual(len(journal), 3)
+            journal.close()
+            self.assertEqual(len(open(self.path).readlines()), 3)
+
+    def test_background(self):
+        transport = FakeTransport("OK")
+        scrobbler = Scrobbler(flush_interval=0.01, transport=transport)
+        scrobbler.set_username_and_password("Tard", "qwerty")
+        scrobbler.start()
+        scrobbler.scrobble(self.tracks[:3])
+        for i in range(200):
+            if not len(scrobbler.journal):
+                break
+            time.sleep(0.01)
+        scrobbler.stop()
+        self.assertEqual(len(scrobbler.journal), 0)
+        self.assertEqual(len(transport.requests), 2)
+
+    def test_stop_during_backoff(self):
+        transport = FakeTransport("FAILED Try later")
+        scrobbler = Scrobbler(flush_interval=0.5, transport=transport)
+        scrobbler.set_username_and_password("Tard", "qwerty")
+        scrobbler.start()
+        scrobbler.scrobble(self.tracks[:3])
+        for i in range(200):
+            if len(transport.requests) == 2:
+                break
+            time.sleep(0.01)
+        #the failed flush backs off for a second
+        start = time.time()
+        scrobbler.stop(flush=False)
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertEqual(len(scrobbler.journal), 3)
+
+class UserTransport(object):
+    """Gives each user their own session and records what they submit"""
+    def __init__(self, fail_first=False):
+        self.handshakes = []
+        self.submitted = {}
+        self.fail_first = fail_first
+        self.down = False
+        self.badauth = set()
+        self.lock = threading.Lock()
+
+    def request(self, method, url, body=None):
+        with self.lock:
+            if method == "GET":
+                user = urlparse.parse_qs(urlparse.urlsplit(url).query)["u"][0]
+                self.handshakes.append(user)
+                if user in self.badauth:
+                    return 200, "BADAUTH\n"
+                return 200, "OK\n%s\nhttp://np/\nhttp://submit/\n" % user
+            if self.fail_first or self.down:
+                self.fail_first = False
+                return 200, "FAILED Try later\n"
+            form = urlparse.parse_qs(body, keep_blank_values=True)
+            timestamps = [int(form["i[%d]" % i][0]) for i in range(len(form) / 9)]
+            self.submitted.setdefault(form["s"][0], []).append(timestamps)
+            return 200, "OK\n"
+
+
+class ServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.transport = UserTransport()
+        self.service = ScrobbleService(workers=4, max_sessions=2, retry_delay=0.01,
+                                       transport=self.transport)
+        self.users = ["user%d" % i for i in range(5)]
+        for user in self.users:
+            self.service.add_user(user, "qwerty")
+
+    def tearDown(self):
+        self.service.close()
+
+    def test_ordering(self):
+        expected = {}
+        for user in self.users:
+            timestamps = range(1000, 1120)
+            random.shuffle(timestamps)
+            for start in range(0, 120, 7):
+                self.service.scrobble(user, [ScrobbleTrack("a", "t", i, 200) for i in
+                                             timestamps[start:start + 7]])
+            expected[user] = range(1000, 1120)
+        self.assertTrue(self.service.wait(10))
+        for user in self.users:
+            batches = self.transport.submitted[user]
+            self.assertTrue(max(len(batch) for batch in batches) <= 50)
+            self.assertEqual(sorted(sum(batches, [])), expected[user])
+            for batch in batches:
+                self.assertEqual(batch, sorted(batch))
+        stats = self.service.stats()
+        self.assertEqual(stats["submitted"], 600)
+        self.assertEqual(stats["sessions"], 2)
+        self.assertEqual(self.service.backlogs(), {})
+
+    def test_retry(self):
+        self.transport.fail_first = True
+        self.service.scrobble("user0", ScrobbleTrack("a", "t", 1000, 200))
+        self.assertTrue(self.service.wait(5))
+        self.assertEqual(self.transport.submitted["user0"], [[1000]])
+        self.assertEqual(self.service.stats()["retried"], 1)
+        self.assertEqual(self.service.last_error("user0"), None)
+        self.assertRaises(LastfmAuthenticationError, self.service.scrobble,
+                          "nobody", ScrobbleTrack("a", "t", 1000, 200))
+        self.assertRaises(LastfmAuthenticationError, self.service.now_playing,
+                          "nobody", ScrobbleTrack("a", "t", 1000, 200))
+
+    def test_outage(self):
+        self.service.retry_delay = 60
+        self.transport.down = True
+        threads = threading.active_count()
+        for user in self.users:
+            self.service.scrobble(user, ScrobbleTrack("a", "t", 1000, 200))
+        for i in range(100):
+            if self.service.stats()["retried"] == 5:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.service.stats()["retried"], 5)
+        #one scheduler thread waits for every retry, only pool workers are added
+        self.assertTrue(threading.active_count() <= threads + 4)
+        self.assertEqual(self.service.stats()["in_flight"], 5)
+        start = time.time()
+        self.service.close()
+        self.assertTrue(time.time() - start < 5)
+
+    def test_schedule_failed(self):
+        pool = self.service.pool
+        class FullPool(object):
+            def submit(self, *args):
+                raise threading.ThreadError("can't start new thread")
+        self.service.pool = FullPool()
+        self.assertRaises(threading.ThreadError, self.service.scrobble, "user0",
+                          ScrobbleTrack("a", "t", 1000, 200))
+        self.assertEqual(self.service.stats()["in_flight"], 0)
+        self.service.pool = pool
+        self.service.scrobble("user0", ScrobbleTrack("a", "t", 1001, 200))
+        self.assertTrue(self.service.wait(5))
+        self.assertEqual(self.transport.submitted["user0"], [[1000, 1001]])
+
+    def test_badauth(self):
+        self.transport.badauth.add("user1")
+        self.service.scrobble("user1", ScrobbleTrack("a", "t", 1000, 200))
+        self.service.scrobble("user2", ScrobbleTrack("a", "t", 1000, 200))
+        self.assertFalse(self.service.wait(5))
+        self.assertTrue(isinstance(self.service.last_error("user1"),
+                                   LastfmAuthenticationError))
+        self.service.scrobble("user1", ScrobbleTrack("a", "t", 1001, 200))
+        time.sleep(0.05)
+        #parked tracks aren't retried
+        self.assertEqual(self.transport.handshakes.count("user1"), 1)
+        self.assertEqual(self.service.backlogs(), {"user1" : 2})
+        self.assertEqual(self.service.stats()["parked"], 2)
+        self.transport.badauth.discard("user1")
+        self.service.add_user("user1", "new password")
+        self.assertTrue(self.service.wait(5))
+        self.assertEqual(self.transport.submitted["user1"], [[1000, 1001]])
+        self.assertEqual(self.service.last_error("user1"), None)
+
+class NowPlayingTest(unittest.TestCase):
+    def setUp(self):
+        self.sent = []
+        self.channel = NowPlayingChannel(lambda user, track:
+                                         self.sent.append((user, track.track)),
+                                         window=0.05)
+
+    def tearDown(self):
+        self.channel.close()
+
+    def wait(self):
+        for i in range(100):
+            time.sleep(0.02)
+            if not self.channel.stats()["pending"]:
+                break
+        time.sleep(0.02)
+
+    def test_coalesce(self):
+        first = ScrobbleTrack("Foo Fighters", "Monkey Wrench", 0, 200)
+        second = ScrobbleTrack("Gerling", "Death to the Apple Gerls", 0, 220)
+        for i in range(10):
+            self.channel.update("Tard", first)
+        self.channel.update("Tard", second)
+        self.channel.update("woodenbrick", first)
+        self.wait()
+        self.assertEqual(sorted(self.sent), [("Tard", "Death to the Apple Gerls"),
+                                             ("woodenbrick", "Monkey Wrench")])
+        self.channel.update("Tard", second)
+        self.channel.update("Tard", first)
+        self.wait()
+        stats = self.channel.stats()
+        self.assertEqual(self.sent[-1], ("Tard", "Monkey Wrench"))
+        self.assertEqual((stats["updates"], stats["coalesced"], stats["dropped"],
+                          stats["sent"]), (14, 10, 1, 3))
+
+    def test_scrobbler(self):
+        transport = FakeTransport("OK")
+        scrobbler = Scrobbler(transport=transport)
+        scrobbler.set_username_and_password("Tard", "qwerty")
+        scrobbler.now_playing(ScrobbleTrack("Foo Fighters", "Monkey Wrench", 0, 200))
+        self.assertEqual(transport.requests[-1][1], "http://np/")
+        self.assertEqual(transport.requests[-1][2], "s=session1&a=Foo+Fighters&"
+                         "t=Monkey+Wrench&b=&l=200&n=&m=")
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+import unittest
+import httplib
+import sys
+import threading
+import time
+import os
+import shutil
+import tempfile
+import BaseHTTPServer
+import SocketServer
+#append system path
+sys.path.insert(0, "../")
+from pylastfm.api.connection import LastfmApiConnection
+from pylastfm.api.asyncconnection import AsyncLastfmApiConnection
+from pylastfm.api.transport import HTTPConnectionPool
+from pylastfm.api.user import User
+from pylastfm.api.replay import ReplayTransport
+from pylastfm.api.stubserver import StubLastfmServer
+from pylastfm.api.connection import _get_error_code
+from pylastfm.api.error import LastfmError
+from pylastfm.api.metrics import MetricsAggregator
+from pylastfm.api.crawler import SimilarArtistCrawler
+
+USER_XML = '<lfm status="ok"><user><name>woodenbrick</name></user></lfm>'
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    delay = 0
+    active = 0
+    max_active = 0
+    drop = 0
+    posts = 0
+    lock = threading.Lock()
+
+    def _drop(self):
+        """Closes the connection without a response, if drop is set"""
+        with StubHandler.lock:
+            if not StubHandler.drop:
+                return False
+            StubHandler.drop -= 1
+        self.close_connection = 1
+        return True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.getheader("Content-Length")))
+        with StubHandler.lock:
+            StubHandler.posts += 1
+        if self._drop():
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", len(USER_XML))
+        self.end_headers()
+        self.wfile.write(USER_XML)
+
+    def do_GET(self):
+        if self._drop():
+            return
+        with StubHandler.lock:
+            StubHandler.active += 1
+            StubHandler.max_active = max(StubHandler.max_active, StubHandler.active)
+        time.sleep(StubHandler.delay)
+        with StubHandler.lock:
+            StubHandler.active -= 1
+        self.send_response(200)
+        self.send_header("Content-Length", len(USER_XML))
+        self.end_headers()
+        self.wfile.write(USER_XML)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class TransportTest(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer(("127.0.0.1", 0), StubHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = "http://127.0.0.1:%s/2.0/" % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_keep_alive(self):
+        pool = HTTPConnectionPool()
+        for i in range(5):
+            status, body = pool.request("GET", self.url + "?method=user.getInfo")
+            self.assertEqual(status, 200)
+            self.assertEqual(body, USER_XML)
+        stats = pool.stats()
+        self.assertEqual(stats["connections"], 1)
+        self.assertEqual(stats["reuse_ratio"], 0.8)
+        pool.close()
+
+    def test_stale_connection(self):
+        pool = HTTPConnectionPool()
+        pool.request("GET", self.url)
+        #a GET is sent again on a new connection
+        StubHandler.drop = 1
+        self.assertEqual(pool.request("GET", self.url), (200, USER_XML))
+        #a POST the server may have acted on isn't
+        StubHandler.drop = 1
+        StubHandler.posts = 0
+        self.assertRaises(httplib.HTTPException, pool.request, "POST", self.url, "a=1")
+        self.assertEqual(StubHandler.posts, 1)
+        self.assertEqual(pool.request("POST", self.url, "a=1"), (200, USER_XML))
+        pool.close()
+
+    def test_idle_timeout(self):
+        pool = HTTPConnectionPool(idle_timeout=0)
+        pool.request("GET", self.url)
+        pool.request("GET", self.url)
+        self.assertEqual(pool.stats()["connections"], 2)
+        pool.close()
+
+    def test_connection(self):
+        api = LastfmApiConnection("xxx", "yyy")
+        api.URL = self.url
+        user = api.create_objects(api._api_get_request(method="user.getInfo",
+                                                       user="woodenbrick"), User)
+        self.assertEqual(user.name, "woodenbrick")
+        self.assertEqual(api.transport.stats()["requests"], 1)
+        api.transport.close()
+
+    def test_async(self):
+        StubHandler.delay = 0.05
+        StubHandler.max_active = 0
+        #identical requests would share one download
+        api = AsyncLastfmApiConnection("xxx", "yyy", max_concurrency=4,
+                                       rate_limit=None, coalesce=False)
+        api.URL = self.url
+        futures = [api.user.getInfo("woodenbrick") for i in range(20)]
+        done = []
+        futures[-1].add_done_callback(done.append)
+        for future in futures:
+            self.assertEqual(future.result(5).name, "woodenbrick")
+        self.assertEqual(done, [futures[-1]])
+        self.assertEqual(StubHandler.max_active, 4)
+        api.close()
+        StubHandler.delay = 0
+
+class StubServerTest(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubLastfmServer(pages=3, per_page=5, errors={"artist.getInfo" : 6})
+        self.stub.start()
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.stub.stop()
+        shutil.rmtree(self.path)
+
+    def create(self, transport):
+        api = LastfmApiConnection("xxx", "yyy", transport=transport, rate_limit=None)
+        api.URL = self.stub.url
+        return api
+
+    def test_stub(self):
+        api = self.create(HTTPConnectionPool())
+        tracks = list(api.user.iterRecentTracks("woodenbrick", limit=5))
+        self.assertEqual(len(tracks), 15)
+        self.assertEqual([t.date_uts for t in tracks[:2]],
+                         [StubLastfmServer.BASE_UTS, StubLastfmServer.BASE_UTS - 240])
+        body = api._api_get_request(method="artist.getInfo", artist="Cher").read()
+        self.assertEqual(_get_error_code(body), 6)
+        stats = self.stub.stats()
+        self.assertEqual((stats["requests"], stats["failed"]), (4, 1))
+        #loved tracks nest their artist, as last.fm's do
+        loved = list(api.user.iterLovedTracks("woodenbrick", limit=5))
+        self.assertEqual(len(loved), 15)
+        self.assertTrue(loved[0].name.startswith("Track "))
+        self.assertTrue(loved[0].artist.startswith("Artist "))
+        self.assertEqual(len(loved[0].artist_mbid), 36)
+        api.transport.close()
+
+    def test_metrics(self):
+        api = LastfmApiConnection("xxx", "yyy", rate_limit=None, cache_enabled=True)
+        api.URL = self.stub.url
+        self.assertFalse(api.transport.record_timings)
+        metrics = MetricsAggregator()
+        api.add_observer(metrics)
+        for i in range(2):
+            api.create_objects(api._api_get_request(method="user.getInfo",
+                                                    user="woodenbrick"), User)
+        api._api_get_request(method="artist.getInfo", artist="Cher")
+        snapshot = metrics.snapshot()
+        info = snapshot["user.getInfo"]
+        self.assertEqual((info["requests"], info["cache_hits"], info["errors"]), (2, 1, 0))
+        self.assertEqual(info["cache_hit_rate"], 0.5)
+        self.assertTrue(info["bytes"] > 0)
+        self.assertEqual(info["latency"]["count"], 2)
+        self.assertEqual(sorted(info["phases"]), ["build", "connect", "parse", "read",
+                                                  "server"])
+        self.assertEqual(info["phases"]["parse"]["count"], 2)
+        self.assertEqual(info["phases"]["server"]["count"], 1)
+        self.assertEqual(snapshot["artist.getInfo"]["error_codes"], {6 : 1})
+        api.remove_observer(metrics)
+        api._api_get_request(method="artist.getInfo", artist="Cher")
+        self.assertEqual(metrics.snapshot()["artist.getInfo"]["requests"], 1)
+        api.transport.close()
+
+    def test_record_replay(self):
+        recorder = ReplayTransport(self.path, "record", HTTPConnectionPool())
+        api = self.create(recorder)
+        user = api.create_objects(api._api_get_request(method="user.getInfo",
+                                                       user="woodenbrick"), User)
+        recorder.close()
+        self.stub.stop()
+        api = LastfmApiConnection("other", "keys", rate_limit=None,
+                                  transport=ReplayTransport(self.path))
+        replayed = api.create_objects(api._api_get_request(method="user.getInfo",
+                                                           user="woodenbrick"), User)
+        self.assertEqual(replayed.playcount, user.playcount)
+        self.assertEqual(api.transport.stats()["replayed"], 1)
+        self.assertRaises(LastfmError, api._api_get_request, method="user.getInfo",
+                          user="someone_else")
+        #files named after a method alone answer any request for it
+        api = LastfmApiConnection("xxx", "yyy", rate_limit=None,
+                                  transport=ReplayTransport("data"))
+        user = api.create_objects(api._api_get_request(method="user.getInfo",
+                                                       user="someone_else"), User)
+        self.assertEqual(user.name, "woodenbrick")
+
+    def test_record_concurrent(self):
+        recorder = ReplayTransport(self.path, "record", HTTPConnectionPool())
+        bodies = ["first", "second"]
+        errors = []
+        renaming = threading.Condition()
+        waiting = []
+        rename = os.rename
+        def wait_for_both(source, destination):
+            #both writers finish their temporary file before either renames
+            with renaming:
+                waiting.append(source)
+                renaming.notify_all()
+                end = time.time() + 2
+                while len(waiting) < 2 and time.time() < end:
+                    renaming.wait(0.1)
+            rename(source, destination)
+        def save(body):
+            try:
+                recorder._save("user.getInfo.x.xml", body)
+            except Exception, e:
+                errors.append(e)
+        os.rename = wait_for_both
+        try:
+            threads = [threading.Thread(target=save, args=(body,)) for body in bodies]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            os.rename = rename
+        self.assertEqual(errors, [])
+        self.assertEqual(os.listdir(self.path), ["user.getInfo.x.xml"])
+        f = open(os.path.join(self.path, "user.getInfo.x.xml"), "rb")
+        self.assertTrue(f.read() in bodies)
+        f.close()
+        recorder.close()
+
+class CrawlerTest(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubLastfmServer(per_page=5)
+        self.stub.start()
+        self.api = LastfmApiConnection("xxx", "yyy", rate_limit=None)
+        self.api.URL = self.stub.url
+        self.path = tempfile.mkdtemp()
+        self.checkpoint = self.path + "/frontier"
+
+    def tearDown(self):
+        self.stub.stop()
+        self.api.transport.close()
+        shutil.rmtree(self.path)
+
+    def test_crawl(self):
+        tags = {}
+        crawler = SimilarArtistCrawler(self.api, workers=4, max_depth=2,
+                                       on_tags=tags.__setitem__)
+        edges = list(crawler.crawl(["Cher"]))
+        self.assertEqual(len(edges), len(set(edges)))
+        sources = set(source for source, target, match in edges)
+        self.assertEqual(sorted(tags), sorted(sources))
+        self.assertEqual(len(tags["Cher"]), 5)
+        self.assertEqual(crawler.expanded, len(sources))
+        self.assertTrue("Cher" in sources and crawler.depth == 2)
+        #only the seed and its neighbours are expanded
+        first = set(target for source, target, match in edges if source == "Cher")
+        self.assertEqual(sources, first | set(["Cher"]))
+        self.assertTrue(all(0 < match <= 1 for source, target, match in edges))
+        small = SimilarArtistCrawler(self.api, max_depth=3, max_nodes=4)
+        nodes = set()
+        for source, target, match in small.crawl(["Cher"]):
+            nodes.update((source, target))
+        self.assertEqual((small.nodes, len(nodes)), (4, 4))
+
+    def test_resume(self):
+        full = set(SimilarArtistCrawler(self.api, max_depth=2).crawl(["Cher"]))
+        crawler = SimilarArtistCrawler(self.api, max_depth=2, checkpoint=self.checkpoint,
+                                       checkpoint_interval=2)
+        edges = set()
+        for edge in crawler.crawl(["Cher"]):
+            edges.add(edge)
+            if crawler.expanded >= 3:
+                break
+        self.assertTrue(edges < full)
+        crawler = SimilarArtistCrawler(self.api, max_depth=2, checkpoint=self.checkpoint)
+        edges.update(crawler.crawl(["Cher"]))
+        self.assertEqual(edges, full)
+        self.assertEqual(list(crawler.crawl(["Cher"])), [])
+
+    def test_failed(self):
+        self.stub.errors["artist.getSimilar"] = 6
+        crawler = SimilarArtistCrawler(self.api)
+        self.assertEqual(list(crawler.crawl(["Cher"])), [])
+        self.assertEqual(crawler.failed[0][0], "Cher")
+        self.assertTrue(isinstance(crawler.failed[0][1], LastfmError))
+
+if __name__ == "__main__":
+    unittest.main()